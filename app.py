@@ -8,10 +8,22 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-import json, os, random, math, re, time
-from math import sqrt
+import json, os, random, re, sqlite3, time
 from datetime import datetime
+from functools import lru_cache
+from engine import (stream_catalog, feature_matrices, RADAR_DIMS, PairAnalysisService,
+                    GroupAnalysisService, ComboSearch, load_artifacts, catalog_frame,
+                    blend_profile, optimize_ratios, round_ratios, RadarIndex,
+                    FlavorGraph, GRAPH_TOPK, build_families, FAMILY_MIN_SIZE,
+                    flavor_map, COMPARE_MAX, resonance_matrix, cluster_order, calc_sim, NoteSearch,
+                    SimilarityBackend, SIM_KERNELS, DEFAULT_KERNEL, CANONICAL_NOTES, ARTIFACT_DIR,
+                    DatasetWatcher, RELOAD_KEEP, DATA_PATH, LOC_PATH, ARTIFACT_MANIFEST, build_symbols,
+                    LRUCache, NoteNetworkService, network_lod, NETWORK_LOD, SHARED_DIR, shared_artifacts,
+                    evict_shared)
+from disk_cache import DiskCache, cache_fingerprint
+from molecules import open_store
 
 # ================================================================
 # 0. 页面配置与全局状态
@@ -23,12 +35,17 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+CHAT_RENDER_LIMIT = 20   # 对话区默认只渲染最近的消息条数；更早的折叠，点「加载更早」每次多展开这么多
+
 def _init_state(key, val):
     if key not in st.session_state:
         st.session_state[key] = val
 
 _init_state("language", "zh")
 _init_state("chat_history", [])
+_init_state("chat_seq", 0)            # 消息编号计数器（渲染缓存的键）
+_init_state("chat_html_cache", {})    # 消息编号 → 该条消息的最终 HTML
+_init_state("chat_window", CHAT_RENDER_LIMIT)  # 当前展开的最近消息条数
 _init_state("chat_context_key", "")
 _init_state("last_api_error", None)
 _init_state("selected_cats", set())
@@ -54,7 +71,8 @@ def t(text_en, text_zh=None):
 # ================================================================
 # 1. API 配置管理
 # ================================================================
-DASHSCOPE_BASE = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+# DASHSCOPE_BASE_URL 可指向本地 stub（压测 load_test.py 使用）
+DASHSCOPE_BASE = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 DEFAULT_MODEL   = "qwen-turbo"
 
 def get_api_config():
@@ -334,37 +352,51 @@ st.markdown("""
 # 4. 本地化引擎
 # ================================================================
 @st.cache_resource
+def get_dataset_watcher():
+    """数据版本监视器；FLAVOR_LAB_HOT_RELOAD=1 时按内容哈希热更新食材库与本地化词表，无需重启"""
+    return DatasetWatcher(DATA_PATH, LOC_PATH)
+
+# 每次重跑开头固定一个数据快照：重跑中途即使换入了新版本，本次重跑仍完整使用旧快照
+SNAPSHOT = get_dataset_watcher().current()
+
 def load_localization():
-    if os.path.exists("localization_zh.json"):
-        with open("localization_zh.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"ingredients": {}, "flavor_notes": {}, "categories": {}}
+    return SNAPSHOT.loc
 
 LOC = load_localization()
 
+# 翻译走驻留符号表 SYM（见第 5 节 get_symbols）：表内字符串按编号取译名，表外的现场翻译
 def t_ingredient(name):
-    m = LOC.get("ingredients", {})
-    return m.get(name) or m.get(name.strip()) or name
+    return SYM["ingredients"].translate(name)
 
 def t_category(cat):
-    return LOC.get("categories", {}).get(cat, cat)
+    return SYM["categories"].translate(cat)
+
+def t_category_of(name):
+    """食材的中文品类：行号 → 品类编号 → 译名"""
+    i = SYM["ingredients"].id(name)
+    return SYM["categories"].zh[SYM["row_category"][i]] if i >= 0 else ""
 
 def t_note(note):
-    m = LOC.get("flavor_notes", {})
-    n = note.strip().lower()
-    return m.get(n) or m.get(note.strip()) or note.strip()
+    return SYM["notes"].translate(note)
+
+@lru_cache(maxsize=256)
+def _split_notes(raw):
+    return tuple(n.strip().lower() for n in re.split(r"[@,]+", raw) if n.strip())
 
 def t_notes_list(mol_input, top_n=999):
-    if isinstance(mol_input, set):
-        raw = sorted(mol_input)
+    """去重后的中文标签列表；传标签编号数组（note_ids）时直接按编号取译名"""
+    if isinstance(mol_input, np.ndarray):
+        items = SYM["notes"].labels(mol_input)
+    elif isinstance(mol_input, (set, frozenset)):
+        items = map(t_note, sorted(mol_input))
     else:
-        raw = [n.strip().lower() for n in re.split(r"[@,]+", str(mol_input)) if n.strip()]
-    seen, result = set(), []
-    for item in (t_note(n) for n in raw):
-        if item not in seen:
-            seen.add(item)
-            result.append(item)
-    return result[:top_n]
+        items = map(t_note, _split_notes(str(mol_input)))
+    result = {}
+    for item in items:
+        result.setdefault(item)
+        if len(result) >= top_n:
+            break
+    return list(result)
 
 def display_name(name):
     cn = t_ingredient(name)
@@ -373,120 +405,255 @@ def display_name(name):
 # ================================================================
 # 5. 数据加载
 # ================================================================
-def _parse_fp(s):
-    if not s or str(s).strip() in ("", "nan"): return set()
-    return set(x.strip().lower() for x in str(s).split(",") if x.strip())
+@st.cache_resource
+def get_disk_cache():
+    """持久化缓存（重启后免冷启动）；磁盘不可写时退化为纯内存缓存"""
+    try:
+        return DiskCache()
+    except (OSError, sqlite3.Error):
+        return None
 
-def _parse_fl(s):
-    if not s or str(s).strip() in ("", "nan"): return set()
-    return set(x.strip().lower() for x in re.split(r"[@,]+", str(s)) if x.strip())
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def evict_stale_versions(version):
+    """每个新版本第一次出现时清一次持久化缓存与共享产物目录里已不再使用的版本（过了宽限期的条目）"""
+    watcher = get_dataset_watcher()
+    live = [s.version for s in map(watcher.get, watcher.live_keys()) if s is not None]
+    n = 0
+    if SHARED_DIR:
+        n += evict_shared({v.data_key for v in live})
+    disk = get_disk_cache()
+    if disk is None:
+        return n
+    try:
+        return n + disk.evict_stale(live_fingerprints(live))
+    except sqlite3.Error:
+        return n
+
+def _snapshot(version):
+    """本次重跑固定的快照，或监视器里仍保留的同版本快照"""
+    return SNAPSHOT if SNAPSHOT.version.key == version else get_dataset_watcher().get(version)
+
+def dataset_of(version):
+    """版本键 → DatasetVersion（缓存指纹要区分 data_key 与完整键）；快照已被淘汰时退回键本身"""
+    snap = _snapshot(version)
+    return snap.version if snap is not None else version
+
+def live_fingerprints(versions):
+    """仍在使用的缓存指纹：数据部分与带译名的完整键都算"""
+    return {fp for v in versions for fp in (cache_fingerprint(v), cache_fingerprint(v, localized=True))}
+
+def _snapshot_for(version):
+    """带派生数据的快照（热更新未开启时没有，返回 None）"""
+    snap = _snapshot(version)
+    return snap if snap is not None and snap.catalog is not None else None
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_artifacts(version):
+    """
+    precompute.py 生成的离线产物（只读 mmap，同机各进程共享页缓存）；与该版本的数据部分不符时，
+    开启 FLAVOR_LAB_SHARED_DIR 则由第一个进程生成共享产物、其余进程直接映射，否则返回 None
+    """
+    snap = _snapshot(version)
+    if snap is None:
+        return None
+    art = load_artifacts(snap.version)
+    if art is None and SHARED_DIR:
+        try:
+            art = load_artifacts(snap.version, shared_artifacts(DATA_PATH))
+        except (OSError, ValueError):
+            art = None
+    return art
 
-@st.cache_data
-def load_data():
-    path = "flavordb_data.csv"
-    if not os.path.exists(path): return None
-    df = pd.read_csv(path)
-    df["flavor_profiles"] = df["flavor_profiles"].fillna("")
-    df["mol_set"] = df.apply(lambda r: _parse_fp(r["flavor_profiles"]) | _parse_fl(r.get("flavors", "")), axis=1)
-    df["mol_count"] = df["mol_set"].apply(len)
-    return df[df["mol_count"] > 0].copy()
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_catalog(version):
+    """
+    紧凑食材库（编号 / 名称 / 品类 / 词表 / CSR）：热更新快照、预计算产物优先，
+    否则分块流式解析 CSV（不为每行建 set，可直接读 .gz），结果进持久化缓存
+    """
+    snap = _snapshot_for(version)
+    if snap is not None:
+        return snap.catalog
+    art = get_artifacts(version)
+    if art is not None:
+        c = art["catalog"]
+        return {"ids": c["ids"], "names": c["names"].tolist(), "categories": c["categories"].tolist(),
+                "vocab": art["vocab"], "indptr": c["indptr"], "indices": c["indices"], "stats": None}
+    disk = get_disk_cache()
+    if disk is None:
+        return stream_catalog(DATA_PATH)
+    return disk.get_or_compute("catalog", os.path.basename(DATA_PATH), cache_fingerprint(dataset_of(version)),
+                               lambda: stream_catalog(DATA_PATH))
 
-# ================================================================
-# 6. 算法引擎
-# ================================================================
-POLARITY = {
-    "fat":"L","fatty":"L","oil":"L","oily":"L","waxy":"L","buttery":"L",
-    "butter":"L","cream":"L","creamy":"L","resin":"L","woody":"L",
-    "leather":"L","smoky":"L","smoke":"L",
-    "sweet":"H","sour":"H","acid":"H","citrus":"H","fruity":"H",
-    "floral":"H","honey":"H","alcoholic":"H","wine":"H","vinegar":"H",
-    "fresh":"H","green":"H","sugar":"H",
-}
+def load_data():
+    return _load_data(data_version())
 
-def calc_sim(a, b):
-    """分子共鸣指数 v3"""
-    if not a or not b:
-        return {"score": 0, "jaccard": 0, "shared": [], "only_a": [], "only_b": [], "type": "contrast",
-                "detail": {"shared_count": 0, "only_a_count": 0, "only_b_count": 0}}
-
-    inter = a & b
-    union = a | b
-    only_a = a - b
-    only_b = b - a
-
-    j = len(inter) / len(union) if union else 0
-    cov_a = len(inter) / max(len(a), 1)
-    cov_b = len(inter) / max(len(b), 1)
-    bi_cov = min(cov_a, cov_b)
-
-    raw = (j ** 0.6) * 0.65 + (bi_cov ** 0.4) * 0.35
-    score = int(round(18 + raw * 79))
-    score = max(18, min(97, score))
-
-    if score >= 65:
-        typ = "resonance"
-    elif score >= 42:
-        typ = "neutral"
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def _load_data(version):
+    """只读共享的食材 DataFrame（cache_data 每次调用都会反序列化出一份新拷贝，连同每行的标签集合）"""
+    c = get_catalog(version)
+    if c is None:
+        return None
+    return catalog_frame(c["ids"], c["names"], c["categories"], c["vocab"], c["indptr"], c["indices"])
+
+def data_version():
+    """本次重跑使用的数据版本键；所有按版本缓存的资源都以它为键"""
+    return SNAPSHOT.version.key
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def load_features(version):
+    snap = _snapshot_for(version)
+    if snap is not None:
+        return snap.features
+    art = get_artifacts(version)
+    if art is not None:
+        return art["features"]
+    disk = get_disk_cache()
+    if disk is None:
+        return feature_matrices(load_data())
+    return disk.get_or_compute("features", "all", cache_fingerprint(dataset_of(version)),
+                               lambda: feature_matrices(load_data()))
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_pair_service(version):
+    """跨会话共享的搭配分析服务，按数据版本区分；有预计算产物时桥接食材只在候选表里找"""
+    art = get_artifacts(version)
+    bridges = dict(art["bridges"], names=art["catalog"]["names"]) if art is not None else None
+    return PairAnalysisService(load_data(), version,
+                               features=load_features(version),
+                               bridges=bridges,
+                               disk=get_disk_cache(),
+                               fingerprint=cache_fingerprint(dataset_of(version)))
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_combo_search(version):
+    """最佳组合搜索；有预计算产物时直接复用其 CSR 与 Top-1 邻居分数作为剪枝上界"""
+    art = get_artifacts(version)
+    if art is not None:
+        c = art["catalog"]
+        nb = art["neighbors"]["score"]
+        return ComboSearch(c["names"].tolist(), c["indptr"], c["indices"], len(art["vocab"]),
+                           row_max=nb[:, 0] if nb.shape[1] else None)
+    c = get_catalog(version)
+    snap = _snapshot_for(version)
+    nb = snap.neighbors["score"] if snap is not None else None
+    return ComboSearch(c["names"], c["indptr"], c["indices"], len(c["vocab"]),
+                       row_max=nb[:, 0] if nb is not None and nb.shape[1] else None)
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_radar_index(version):
+    """雷达轮廓 k 近邻索引（大库自动建 KD 树）"""
+    return RadarIndex(load_features(version))
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_flavor_graph(version):
+    """风味虫洞路径图：每个数据版本建一次；有预计算产物时直接复用 Top-K 邻居"""
+    art = get_artifacts(version)
+    if art is not None and art["neighbors"]["idx"].shape[1] >= GRAPH_TOPK:
+        c = art["catalog"]
+        return FlavorGraph(c["names"].tolist(), c["indptr"], c["indices"], len(art["vocab"]),
+                           nb_idx=art["neighbors"]["idx"])
+    c = get_catalog(version)
+    snap = _snapshot_for(version)
+    nb = snap.neighbors["idx"] if snap is not None and snap.neighbors["idx"].shape[1] >= GRAPH_TOPK else None
+    return FlavorGraph(c["names"], c["indptr"], c["indices"], len(c["vocab"]), nb_idx=nb)
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_flavor_families(version):
+    """风味家族（预计算产物优先，其次持久化缓存，最后现场计算），附带界面用的中文标签（版本键含本地化指纹）"""
+    art = get_artifacts(version)
+    if art is not None and art.get("families") is not None:
+        fam, vocab, names = art["families"], art["vocab"], art["catalog"]["names"].tolist()
     else:
-        typ = "contrast"
-
-    return {
-        "score": score,
-        "jaccard": j,
-        "shared": sorted(inter),
-        "only_a": sorted(only_a),
-        "only_b": sorted(only_b),
-        "type": typ,
-        "detail": {
-            "shared_count": len(inter),
-            "only_a_count": len(only_a),
-            "only_b_count": len(only_b),
-            "coverage_a": round(cov_a * 100),
-            "coverage_b": round(cov_b * 100),
-        }
-    }
-
-def polarity_analysis(mol_set):
-    lipo = sum(1 for m in mol_set if POLARITY.get(m) == "L")
-    hydro = sum(1 for m in mol_set if POLARITY.get(m) == "H")
-    total = lipo + hydro
-    if total == 0: return {"type": "balanced", "lipo": 0, "hydro": 0, "total": 0}
-    t2 = "lipophilic" if lipo > hydro else ("hydrophilic" if hydro > lipo else "balanced")
-    return {"type": t2, "lipo": lipo, "hydro": hydro, "total": total}
-
-def find_bridges(df, set_a, set_b, selected, top_n=4):
-    results = []
-    for _, row in df.iterrows():
-        if row["name"] in selected: continue
-        s = row["mol_set"]
-        sa = len(s & set_a) / max(len(set_a), 1)
-        sb = len(s & set_b) / max(len(set_b), 1)
-        raw_score = sqrt(sa * sb) * (1 + min(sa, sb))
-        if raw_score > 0.04:
-            results.append((row["name"], raw_score, sa, sb))
-    results.sort(key=lambda x: -x[1])
-    top = results[:top_n]
-    if not top: return []
-    max_score = top[0][1]
-    return [(name, score/max_score, sa, sb) for name, score, sa, sb in top]
-
-def find_contrasts(df, set_a, set_b, selected, top_n=4):
-    results = []
-    for _, row in df.iterrows():
-        if row["name"] in selected: continue
-        s = row["mol_set"]
-        diff_a = len(s - set_a) / max(len(s), 1)
-        diff_b = len(s - set_b) / max(len(s), 1)
-        cs = (diff_a + diff_b) / 2
-        if cs > 0.3:
-            results.append((row["name"], cs, diff_a, diff_b))
-    results.sort(key=lambda x: -x[1])
-    top = results[:top_n]
-    if not top: return []
-    max_score = top[0][1]
-    return [(name, score/max_score, da, db) for name, score, da, db in top]
+        cat = get_catalog(version)
+        names, vocab = cat["names"], cat["vocab"]
+        compute = lambda: build_families(cat["indptr"], cat["indices"], len(vocab))
+        disk = get_disk_cache()
+        fam = (disk.get_or_compute("families", "louvain", cache_fingerprint(dataset_of(version)), compute)
+               if disk else compute())
+    labels = {}
+    for c, size in enumerate(fam["sizes"].tolist()):
+        if size < FAMILY_MIN_SIZE:
+            continue
+        reps = "、".join(t_ingredient(names[i]) for i in fam["reps"][c][:3] if i >= 0)
+        notes = " / ".join(t_note(vocab[j]) for j in fam["top_notes"][c] if j >= 0)
+        labels[c] = f"{reps} 等 {size} 种 · {notes}"
+    # 选项用纯字符串（标签 → 家族编号），避免 selectbox 依赖 format_func
+    return {"of": dict(zip(names, fam["labels"].tolist())),
+            "labels": {v: c for c, v in labels.items()}, "options": list(labels.values())}
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_flavor_map(version):
+    """全部食材的二维风味地图坐标（预计算产物优先，其次持久化缓存，最后现场计算）"""
+    art = get_artifacts(version)
+    if art is not None and art.get("flavor_map") is not None:
+        return {"names": art["catalog"]["names"].tolist(), "xy": art["flavor_map"]["xy"]}
+    c = get_catalog(version)
+    compute = lambda: flavor_map(c["indptr"], c["indices"], len(c["vocab"]))
+    disk = get_disk_cache()
+    fmap = (disk.get_or_compute("flavor_map", "umap", cache_fingerprint(dataset_of(version)), compute)
+            if disk else compute())
+    return {"names": c["names"], "xy": fmap["xy"]}
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_note_search(version):
+    """风味标签 → 食材的倒排检索（中英文标签均可查询；版本键含本地化指纹）"""
+    c = get_catalog(version)
+    return NoteSearch(c["names"], c["indptr"], c["indices"], c["vocab"], LOC.get("flavor_notes", {}))
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_sim_backend(version):
+    """可切换相似度核的打分后端，复用组合搜索已经建好的 CSR"""
+    cs = get_combo_search(version)
+    return SimilarityBackend(cs.indptr, cs.indices, cs.n_notes)
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_molecule_store(version):
+    """分子级数据（预计算 molecules.npz → FLAVOR_LAB_MOLECULES 原始导出 → 食材库 sample_molecules 列）"""
+    c = get_catalog(version)
+    art = get_artifacts(version)
+    art_path = os.path.join(art["dir"], "molecules.npz") if art is not None else None
+    try:
+        return open_store(c["names"], ids=c["ids"].tolist(),
+                          csv_path=DATA_PATH, art_path=art_path)
+    except (OSError, ValueError, KeyError):
+        return None
 
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_symbols(version):
+    """驻留符号表：标签 / 品类 / 食材名 → 编号 + 平行的中英文标签数组（版本键含本地化指纹，译名随之更新）"""
+    snap = _snapshot(version)
+    return build_symbols(get_catalog(version), snap.loc if snap is not None else LOC)
+
+SYM = get_symbols(data_version())
+
+def note_ids(name):
+    """食材的风味标签编号（CSR 行，按标签字母序，与 sorted(mol_set) 顺序一致）"""
+    i = SYM["ingredients"].id(name)
+    if i < 0:
+        return np.zeros(0, dtype=np.int32)
+    c = get_catalog(data_version())
+    return c["indices"][c["indptr"][i]:c["indptr"][i + 1]]
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_note_network(version):
+    """风味网络图的力导向布局，按所选食材集合跨会话缓存"""
+    c = get_catalog(version)
+    return NoteNetworkService(c["indptr"], c["indices"], len(c["vocab"]))
+
+def selection_network(selected):
+    """所选食材与它们全部风味标签组成的网络（节点顺序见 engine.note_network）"""
+    rows = [i for i in (SYM["ingredients"].id(n) for n in selected) if i >= 0]
+    return get_note_network(data_version()).get(rows)
+
+@st.cache_resource(max_entries=RELOAD_KEEP)
+def get_group_service(version):
+    """3-4 种食材的协同分析，两两结果跨会话复用"""
+    df = load_data()
+    return GroupAnalysisService(dict(zip(df["name"], df["mol_set"])))
 
+# ================================================================
+# 6. 算法引擎（计算实现见 engine.py）
+# ================================================================
 # 全球经典风味配对数据库
 CLASSIC_RESONANCE_PAIRS = [
     ("Coffee", "Cocoa",       "意式摩卡 — 咖啡与可可共享烘焙苦香，百年意式经典"),
@@ -510,43 +677,6 @@ CLASSIC_CONTRAST_PAIRS = [
     ("Strawberry",   "Balsamic vinegar", "草莓香醋 — 意大利夏日经典，甜酸对比"),
 ]
 
-RADAR_DIMS_V2 = {
-    "甜感": {
-        "primary":   ["sweet","caramel","honey","vanilla","sugar"],
-        "secondary": ["butterscotch","candy","molasses","toffee","syrup","saccharine"],
-    },
-    "烘烤": {
-        "primary":   ["roasted","baked","toasted","malt","smoky"],
-        "secondary": ["coffee","cocoa","bread","charred","burnt","caramelized"],
-    },
-    "果香": {
-        "primary":   ["fruity","berry","citrus","tropical","apple"],
-        "secondary": ["pear","peach","grape","banana","cherry","lemon","melon","plum"],
-    },
-    "草木": {
-        "primary":   ["herbaceous","herbal","green","fresh","leafy"],
-        "secondary": ["mint","thyme","rosemary","basil","dill","grassy","vegetal"],
-    },
-    "木质": {
-        "primary":   ["woody","earthy","mushroom","tobacco"],
-        "secondary": ["cedar","oak","resin","leather","pine","soil","fungal"],
-    },
-    "辛香": {
-        "primary":   ["spicy","pepper","pungent","hot"],
-        "secondary": ["cinnamon","ginger","clove","mustard","horseradish","anise","nutmeg","cardamom"],
-    },
-    "花香": {
-        "primary":   ["floral","rose","jasmine","lavender"],
-        "secondary": ["violet","lily","blossom","geranium","perfumy","fragrant"],
-    },
-    "醇厚": {
-        "primary":   ["fatty","creamy","buttery","nutty"],
-        "secondary": ["butter","cream","dairy","milky","waxy","oily","rich","lactonic"],
-    },
-}
-
-RADAR_DIMS = {k: v["primary"] + v["secondary"] for k, v in RADAR_DIMS_V2.items()}
-
 RADAR_TOOLTIPS = {
     "甜感": "SCA风味轮·甜香区 | 焦糖、蜂蜜、香草等甜蜜芳香；来自糖类美拉德反应，是愉悦感的核心维度",
     "烘烤": "SCA风味轮·烘烤区 | 咖啡、可可、面包、麦芽等火焰工艺香气；高温焦糖化与美拉德反应的产物",
@@ -558,23 +688,46 @@ RADAR_TOOLTIPS = {
     "醇厚": "SCA风味轮·质地区 | 奶油、坚果、黄油的圆润质感；长链脂肪酸与内酯类物质形成的口腔质地",
 }
 
-def radar_vals(mol_set):
-    """雷达图算法 v4"""
-    result = {}
-    for dim, cfg in RADAR_DIMS_V2.items():
-        primary_kws = cfg["primary"]
-        secondary_kws = cfg["secondary"]
-
-        primary_hits = sum(1 for k in primary_kws if k in mol_set)
-        secondary_hits = sum(1 for k in secondary_kws if k in mol_set)
-
-        if primary_hits == 0:
-            val = 0.0
-        else:
-            val = min(10.0, primary_hits * 3.0 + secondary_hits * 1.0)
+# 纯素筛选：品类名包含以下关键词即视为动物来源
+ANIMAL_CATS = {"meat","dairy","fish","seafood","pork","beef","chicken","egg",
+               "alcohol","poultry","shellfish","sausage","ham","bacon",
+               "lamb","veal","duck","turkey","anchovy","lard","gelatin"}
+
+# 侧边栏大类筛选
+CAT_GROUP = {
+    "🌾 谷物淀粉": ["cereal","grain","flour","starch","bread","rice","wheat","corn","oat"],
+    "🫑 蔬菜": ["vegetable","veggie","root","tuber","onion","garlic","pepper","cabbage","bean","legume","pea"],
+    "🍎 水果": ["fruit","berry","citrus","tropical","melon","stone fruit","apple","banana"],
+    "🌿 香草香料": ["herb","spice","seed","bark","leaf","seasoning","flavoring"],
+    "🍄 菌菇": ["mushroom","fungus","truffle","fungi"],
+    "☕ 饮品原料": ["beverage","coffee","tea","cocoa","chocolate","cacao"],
+    "🧈 油脂坚果": ["nut","oil","fat","seed oil","butter"],
+    "🐟 海鲜水产": ["fish","seafood","shellfish","shrimp","crab","lobster","anchovy"],
+    "🥩 肉类蛋奶": ["meat","poultry","dairy","egg","cheese","milk","beef","pork","chicken","lamb"],
+    "🧪 发酵腌制": ["fermented","pickled","vinegar","wine","beer","miso","sauce"],
+    "🍬 甜味调料": ["sugar","sweet","syrup","jam","candy","confectionery"],
+    "🌊 其他": [],
+}
 
-        result[dim] = round(val, 1)
-    return result
+def is_animal_category(cat):
+    cat_l = cat.lower()
+    return any(kw in cat_l for kw in ANIMAL_CATS)
+
+def category_group(cat):
+    cat_l = cat.lower()
+    for group, kws in CAT_GROUP.items():
+        if any(kw in cat_l for kw in kws):
+            return group
+    return "🌊 其他"
+
+def catalog_mask(df, vegan=False, groups=None):
+    """当前侧边栏筛选（纯素 / 大类）对应的布尔 mask，行顺序与 df 一致"""
+    mask = np.ones(len(df), dtype=bool)
+    if vegan:
+        mask &= ~df["category"].apply(is_animal_category).to_numpy()
+    if groups:
+        mask &= df["category"].apply(category_group).isin(groups).to_numpy()
+    return mask
 
 # ================================================================
 # 7. 工艺术语 Tooltip
@@ -617,6 +770,17 @@ def tags_html(notes, cls="tag-blue", max_n=8):
 def shared_tags_html(notes, max_n=10):
     return " ".join(f'<span class="tag tag-shared">⚡ {t_note(n)}</span>' for n in notes[:max_n])
 
+def compound_tags_html(mols, compounds, max_n=12):
+    """共享化合物标签，悬停显示该化合物的气味描述"""
+    out = []
+    for c in list(compounds)[:max_n]:
+        odors = " / ".join(t_note(o) for o in mols.odors_of(c)[:6])
+        out.append(f'<span class="tag tag-green" title="{odors}">⚗️ {mols.compound_label(c)}</span>')
+    more = len(compounds) - max_n
+    if more > 0:
+        out.append(f'<span style="color:var(--text-faint);font-size:.75rem">+{more}</span>')
+    return " ".join(out)
+
 def md_to_html(text):
     highlight_terms = ["🛰️ 虫洞坐标", "🌀 关联逻辑", "🧪 实验报告", "👨‍🍳 厨师应用", "📊 风味星图"]
     for term in highlight_terms:
@@ -630,6 +794,145 @@ def md_to_html(text):
     text = text.replace("\n", "<br>")
     return text
 
+# ---- Plotly 图表 ----
+# 雷达图与网络图直接拼出纯 dict spec，只在缓存未命中时转成 go.Figure 校验一次，
+# 按 (数据版本, 选择, 配比 / 缩放层级, 语言) 缓存校验过的 Figure。
+# st.plotly_chart 收到 dict 每次都会重新校验；收到 Figure 则跳过校验，命中时只剩它自己的拷贝与 JSON 序列化。
+# Streamlit 1.28 的公开接口不接受序列化好的 spec 字符串，这部分开销无法再省
+FIGURE_CACHE_SIZE = 256
+NETWORK_LABELS = 16   # 网络图上直接写出名字的标签数
+RADAR_PALETTE = [("#00D2FF","rgba(0,210,255,0.15)"),("#7B2FF7","rgba(123,47,247,0.15)"),
+                 ("#FF6B6B","rgba(255,107,107,0.15)"),("#00E676","rgba(0,230,118,0.15)")]
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    """
+    跨会话共享的图表缓存（只读，st.plotly_chart 只对 Figure 调 to_dict 取副本，不修改它）。
+    不用 st.cache_data：它每次命中都要哈希参数并反序列化，比手拼一张图还慢；
+    关掉 spinner 是因为默认每次调用都会往页面里插一个占位元素
+    """
+    return LRUCache(FIGURE_CACHE_SIZE)
+
+def cached_figure(key, build):
+    cache = get_figure_cache()
+    fig = cache.get(key)
+    if fig is None:
+        fig = go.Figure(build())
+        cache.put(key, fig)
+    return fig
+
+def ratio_key(selected, ratios):
+    """配比取 4 位小数作为缓存键：不到 0.01% 的差异画出来完全一样，复用同一张图"""
+    return tuple(round(float(ratios.get(n, 1/len(selected))), 4) for n in selected)
+
+def radar_figure(version, selected, ratios, lang):
+    """风味维度雷达图，按 (数据版本, 选择, 配比, 语言) 缓存"""
+    key = ("radar", version, tuple(selected), ratio_key(selected, ratios), lang)
+    return cached_figure(key, lambda: _radar_figure(version, list(selected), ratios))
+
+def _radar_figure(version, selected, ratios):
+    ratios = {n: ratios.get(n, 1/len(selected)) for n in selected}
+    pair_service = get_pair_service(version)
+    scaled = pair_service.radar_for(pair_service.get(selected), selected, ratios)
+    dims = list(RADAR_DIMS.keys())
+    theta = dims + [dims[0]]
+    data = []
+    for i, name in enumerate(selected[:4]):
+        vals_s = scaled[name] + scaled[name][:1]
+        lc, fc = RADAR_PALETTE[i]
+        pct = int(ratios[name]*100)
+        hover_texts = [f"<b>{d.split(chr(10))[0]}</b><br>{RADAR_TOOLTIPS.get(d,'')}<br>分值: {vals_s[di]:.1f}/10" for di,d in enumerate(dims)] + [""]
+        data.append({"fill": "toself", "fillcolor": fc, "hovertemplate": "%{text}<extra></extra>",
+                     "line": {"color": lc, "width": 2.5}, "marker": {"size": 4},
+                     "mode": "lines+markers", "name": f"{t_ingredient(name)} ({pct}%)",
+                     "r": vals_s, "text": hover_texts, "theta": theta, "type": "scatterpolar"})
+    axis_font = {"size": 9, "color": "#6B7280"}
+    layout = {
+        "polar": {"radialaxis": {"tickfont": axis_font, "visible": True, "range": [0, 10],
+                                 "tickvals": [2, 4, 6, 8, 10], "ticktext": ["2", "4", "6", "8", "10"],
+                                 "gridcolor": "rgba(107,114,128,0.2)",
+                                 "linecolor": "rgba(107,114,128,0.2)"},
+                  "angularaxis": {"tickfont": {"size": 12, "color": "#6B7280"}},
+                  "bgcolor": "rgba(248,249,255,0.4)"},
+        "legend": {"font": {"size": 11, "color": "#6B7280"}, "orientation": "h", "y": -0.18},
+        "margin": {"t": 20, "b": 80, "l": 40, "r": 40},
+        "showlegend": True, "height": 420, "paper_bgcolor": "rgba(0,0,0,0)",
+    }
+    return {"data": data, "layout": layout}
+
+def network_figure(version, selected, level, lang):
+    """风味网络图，按 (数据版本, 选择, 缩放层级, 语言) 缓存"""
+    key = ("network", version, tuple(selected), level, lang)
+    return cached_figure(key, lambda: _network_figure(list(selected), level))
+
+def _xy_list(v):
+    """坐标保留 3 位小数；NaN（线段分隔）转成 None"""
+    return [None if x != x else x for x in np.round(v, 3).tolist()]
+
+def _network_figure(selected, level):
+    net = selection_network(selected)
+    k = len(net["rows"])
+    lod = network_lod(net, level)
+    ing_en = SYM["ingredients"].en[net["rows"]].tolist()
+    ing_zh = SYM["ingredients"].zh[net["rows"]].tolist()
+    ing_colors = [RADAR_PALETTE[selected.index(n) % len(RADAR_PALETTE)][0] for n in ing_en]
+    ing_xy = net["xy"][:k]
+    xy, owners, count = lod["xy"], lod["owners"], lod["count"]
+    bits = (owners[:, None] >> np.arange(k, dtype=np.uint8)) & 1
+    degree = bits.sum(axis=1)
+
+    # 连线：每个显示项连到持有它的每种食材，所有线段合成一条 trace，用 null 断开
+    t_i, b_i = np.nonzero(bits)
+    nan = np.full(len(t_i), np.nan)
+    ex = np.column_stack([ing_xy[b_i, 0], xy[t_i, 0], nan]).ravel()
+    ey = np.column_stack([ing_xy[b_i, 1], xy[t_i, 1], nan]).ravel()
+
+    note_zh = SYM["notes"].zh
+    titles, hover, colors, sizes = [], [], [], []
+    for t in range(len(count)):
+        own = " · ".join(ing_zh[b] for b in np.flatnonzero(bits[t]))
+        members = net["notes"][lod["members"][lod["ptr"][t]:lod["ptr"][t + 1]]]
+        colors.append("#F97316" if degree[t] > 1 else ing_colors[int(np.argmax(bits[t]))])
+        if count[t] > 1:
+            titles.append(f"{count[t]} 个次要风味")
+            more = "…" if count[t] > 8 else ""
+            hover.append(f"<b>{titles[-1]}</b><br>{own}<br>" + "、".join(note_zh[members[:8]]) + more)
+            sizes.append(round(8 + 3 * float(np.sqrt(count[t])), 1))
+        else:
+            titles.append(note_zh[members[0]])
+            hover.append(f"<b>{titles[-1]}</b><br>{own}")
+            sizes.append(6 + 3 * int(degree[t]))
+    opacity = np.where(count > 1, 0.45, 0.85).tolist()
+    # 只给最重要的几个标签写字，其余靠悬停
+    lab = np.flatnonzero(count == 1)[:NETWORK_LABELS]
+    ing_notes = [int(((net["owners"] >> b) & 1).sum()) for b in range(k)]
+
+    data = [
+        {"hoverinfo": "none", "line": {"color": "rgba(150,150,200,0.15)", "width": 1},
+         "mode": "lines", "showlegend": False, "x": _xy_list(ex), "y": _xy_list(ey), "type": "scattergl"},
+        {"hoverinfo": "text", "hovertext": hover,
+         "marker": {"color": colors, "line": {"color": "white", "width": 1}, "opacity": opacity, "size": sizes},
+         "mode": "markers", "showlegend": False,
+         "x": _xy_list(xy[:, 0]), "y": _xy_list(xy[:, 1]), "type": "scattergl"},
+        {"hoverinfo": "skip", "mode": "text", "showlegend": False,
+         "text": [titles[t] for t in lab],
+         "textfont": {"color": "#6B7280", "size": 10}, "textposition": "top center",
+         "x": _xy_list(xy[lab, 0]), "y": _xy_list(xy[lab, 1]), "type": "scattergl"},
+        {"hoverinfo": "text",
+         "hovertext": [f"<b>{n}</b><br>{c} 个风味标签" for n, c in zip(ing_zh, ing_notes)],
+         "marker": {"color": ing_colors, "line": {"color": "white", "width": 2}, "opacity": 0.95, "size": 30},
+         "mode": "markers+text", "showlegend": False, "text": ing_zh,
+         "textfont": {"color": "#374151", "size": 12}, "textposition": "top center",
+         "x": _xy_list(ing_xy[:, 0]), "y": _xy_list(ing_xy[:, 1]), "type": "scattergl"},
+    ]
+    layout = {
+        "margin": {"t": 10, "b": 10, "l": 10, "r": 10},
+        "xaxis": {"visible": False}, "yaxis": {"visible": False, "scaleanchor": "x"},
+        "hovermode": "closest", "height": 460,
+        "paper_bgcolor": "rgba(0,0,0,0)", "plot_bgcolor": "rgba(248,249,255,0.2)",
+    }
+    return {"data": data, "layout": layout}
+
 
 # ================================================================
 # 9. AI 对话区
@@ -644,22 +947,74 @@ def _do_ai_request(user_content, context_str):
             msg_history.append({"role": msg["role"], "content": msg["content"]})
     msg_history.append({"role": "user", "content": user_content})
 
-    st.session_state.chat_history.append({
-        "role": "user", "content": user_content, "time": current_time
-    })
+    _chat_append({"role": "user", "content": user_content, "time": current_time})
     st.session_state.last_api_error = None
 
     success, result, is_rate_limit = call_ai_api(msg_history, context_str)
 
-    st.session_state.chat_history.append({
-        "role": "assistant", "content": result, "is_error": not success
-    })
+    _chat_append({"role": "assistant", "content": result, "is_error": not success})
 
     if not success:
         st.session_state.last_api_error = "频率限制，请稍后重试" if is_rate_limit else "API 调用失败"
 
 
-def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, df):
+def _chat_append(msg):
+    """追加一条消息，并分配递增的消息编号"""
+    st.session_state.chat_seq += 1
+    msg["id"] = st.session_state.chat_seq
+    st.session_state.chat_history.append(msg)
+
+def chat_message_html(msg):
+    """单条消息的最终 HTML；按消息编号缓存，只有新消息才做 Markdown 转换"""
+    cache = st.session_state.chat_html_cache
+    key = msg.get("id")
+    html = cache.get(key) if key is not None else None
+    if html is None:
+        if msg["role"] == "user":
+            html = (f'<div class="chat-bubble-user">{msg["content"]}</div>'
+                    f'<div class="chat-time">{msg.get("time", "")}</div>'
+                    '<div class="chat-clearfix"></div>')
+        else:
+            cls = "chat-bubble-ai chat-error" if msg.get("is_error", False) else "chat-bubble-ai"
+            html = f'<div class="{cls}">{md_to_html(msg["content"])}</div><div class="chat-clearfix"></div>'
+        if key is not None:
+            cache[key] = html
+    return html
+
+def _chat_load_older():
+    st.session_state.chat_window += CHAT_RENDER_LIMIT
+
+def render_chat_history(history):
+    """
+    只渲染最近 chat_window 条消息，更早的折叠成「加载更早」按钮。
+    拼好的 HTML 也缓存：展开的消息只是在末尾追加了新消息时，直接接在上次的结果后面。
+    """
+    for msg in history:
+        if "id" not in msg:
+            st.session_state.chat_seq += 1
+            msg["id"] = st.session_state.chat_seq
+    hidden = max(0, len(history) - st.session_state.chat_window)
+    if hidden:
+        st.button(f"⬆️ 加载更早的 {min(hidden, CHAT_RENDER_LIMIT)} 条消息（已折叠 {hidden} 条）",
+                  key="chat_load_older", on_click=_chat_load_older)
+    visible = history[hidden:]
+    ids = tuple(m["id"] for m in visible)
+    built = st.session_state.get("chat_html_built")
+    if built is not None and built["ids"] == ids:
+        body = built["html"]
+    elif built is not None and built["ids"] and ids[:len(built["ids"])] == built["ids"]:
+        body = built["html"] + "".join(chat_message_html(m) for m in visible[len(built["ids"]):])
+    else:
+        body = "".join(chat_message_html(m) for m in visible)
+    st.session_state.chat_html_built = {"ids": ids, "html": body}
+    cache = st.session_state.chat_html_cache
+    if len(cache) > len(history):
+        alive = {m["id"] for m in history}
+        for key in [k for k in cache if k not in alive]:
+            del cache[key]
+    st.markdown(f'<div class="chat-wrap">{body}</div>', unsafe_allow_html=True)
+
+def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, notes, df):
     st.markdown("---")
     st.markdown(
         f'<div class="card"><h4 class="card-title">🤖 风味虫洞顾问 '
@@ -696,7 +1051,7 @@ def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, d
         details = []
         for n in selected:
             pct = int(ratios.get(n, 1/len(selected))*100)
-            top3 = t_notes_list(mol_sets[n], 3)
+            top3 = t_notes_list(notes[n], 3)
             details.append(f"{t_ingredient(n)}({pct}%): {', '.join(top3)}")
         return (f"食材: {food_str} | 共鸣指数: {sim['score']} | 类型: {typ_str} | "
                 f"共享分子: {shared_str} | 详情: {'; '.join(details)}")
@@ -706,6 +1061,7 @@ def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, d
     current_key = "+".join(sorted(selected))
     if st.session_state.chat_context_key != current_key:
         st.session_state.chat_history = []
+        st.session_state.chat_window = CHAT_RENDER_LIMIT
         st.session_state.chat_context_key = current_key
         st.session_state.last_api_error = None
         st.session_state.pending_ai_message = None
@@ -719,7 +1075,7 @@ def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, d
         st.session_state.is_ai_thinking = False
         st.session_state.thinking_started_at = None
         st.session_state.pending_ai_message = None
-        st.session_state.chat_history.append({
+        _chat_append({
             "role": "assistant",
             "content": "⏱️ **请求超时（60秒）** — 千问响应过慢。请重试，或在设置中确认使用 qwen-turbo。",
             "is_error": True
@@ -738,20 +1094,7 @@ def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, d
         st.rerun()
 
     if st.session_state.chat_history:
-        chat_html = '<div class="chat-wrap">'
-        for msg in st.session_state.chat_history:
-            if msg["role"] == "user":
-                chat_html += f'<div class="chat-bubble-user">{msg["content"]}</div>'
-                chat_html += f'<div class="chat-time">{msg.get("time", "")}</div>'
-                chat_html += '<div class="chat-clearfix"></div>'
-            else:
-                is_error = msg.get("is_error", False)
-                cls = "chat-bubble-ai chat-error" if is_error else "chat-bubble-ai"
-                content = md_to_html(msg["content"])
-                chat_html += f'<div class="{cls}">{content}</div>'
-                chat_html += '<div class="chat-clearfix"></div>'
-        chat_html += "</div>"
-        st.markdown(chat_html, unsafe_allow_html=True)
+        render_chat_history(st.session_state.chat_history)
     else:
         type_hints = {
             "resonance": f"它们共享大量芳香分子，属于「**同源共振**」型搭配，适合叠加增强。",
@@ -836,6 +1179,7 @@ def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, d
     with col_clear:
         if st.button("🗑️ 清空", key="clear_btn", use_container_width=True):
             st.session_state.chat_history = []
+            st.session_state.chat_window = CHAT_RENDER_LIMIT
             st.session_state.last_api_error = None
             st.session_state.pending_ai_message = None
             st.session_state.is_ai_thinking = False
@@ -849,7 +1193,7 @@ def render_chat_section(api_config, cn1, cn2, selected, ratios, sim, mol_sets, d
 # 10. 主界面
 # ================================================================
 def render_sidebar_tabs(df):
-    tabs = ["实验台", "配方台", "设置"]
+    tabs = ["实验台", "配方台", "对比台", "设置"]
     selected_tab = st.radio(
         "标签",
         tabs,
@@ -865,6 +1209,7 @@ def render_sidebar_tabs(df):
     tab_guides = {
         "实验台": "🧪 **实验台** — 选择 2-4 种食材，右侧实时呈现分子共鸣分析、雷达图和 AI 顾问",
         "配方台": "⚖️ **配方台** — 拖动滑块调整各食材比例，雷达图面积随比例实时变化",
+        "对比台": f"🗺 **对比台** — 一次选入最多 {COMPARE_MAX} 种候选食材，右侧以聚类热力图比较两两共鸣",
         "设置":   "🔑 **设置** — 填入千问 API Key 以启用 AI 风味顾问对话功能",
     }
     st.caption(tab_guides[selected_tab])
@@ -879,39 +1224,14 @@ def render_experiment_tab(df):
     is_vegan = st.toggle("🌿 仅植物基 Vegan", value=st.session_state.vegan_on, key="vegan_toggle")
     st.session_state.vegan_on = is_vegan
 
-    ANIMAL_CATS = {"meat","dairy","fish","seafood","pork","beef","chicken","egg",
-                   "alcohol","poultry","shellfish","sausage","ham","bacon",
-                   "lamb","veal","duck","turkey","anchovy","lard","gelatin"}
     if is_vegan:
-        df_base = df[~df["category"].str.lower().apply(
-            lambda c: any(kw in c.lower() for kw in ANIMAL_CATS))]
+        df_base = df[~df["category"].apply(is_animal_category)]
     else:
         df_base = df
 
     all_cats = sorted(df_base["category"].unique().tolist())
-    CAT_GROUP = {
-        "🌾 谷物淀粉": ["cereal","grain","flour","starch","bread","rice","wheat","corn","oat"],
-        "🫑 蔬菜": ["vegetable","veggie","root","tuber","onion","garlic","pepper","cabbage","bean","legume","pea"],
-        "🍎 水果": ["fruit","berry","citrus","tropical","melon","stone fruit","apple","banana"],
-        "🌿 香草香料": ["herb","spice","seed","bark","leaf","seasoning","flavoring"],
-        "🍄 菌菇": ["mushroom","fungus","truffle","fungi"],
-        "☕ 饮品原料": ["beverage","coffee","tea","cocoa","chocolate","cacao"],
-        "🧈 油脂坚果": ["nut","oil","fat","seed oil","butter"],
-        "🐟 海鲜水产": ["fish","seafood","shellfish","shrimp","crab","lobster","anchovy"],
-        "🥩 肉类蛋奶": ["meat","poultry","dairy","egg","cheese","milk","beef","pork","chicken","lamb"],
-        "🧪 发酵腌制": ["fermented","pickled","vinegar","wine","beer","miso","sauce"],
-        "🍬 甜味调料": ["sugar","sweet","syrup","jam","candy","confectionery"],
-        "🌊 其他": [],
-    }
 
-    def get_group(cat):
-        cat_l = cat.lower()
-        for group, kws in CAT_GROUP.items():
-            if any(kw in cat_l for kw in kws):
-                return group
-        return "🌊 其他"
-
-    cat_to_group = {c: get_group(c) for c in all_cats}
+    cat_to_group = {c: category_group(c) for c in all_cats}
     groups_present = sorted(set(cat_to_group.values()))
 
     st.markdown('<div style="font-size:.82rem;color:var(--text-muted);margin-bottom:6px">🗂 按大类筛选（可多选）</div>', unsafe_allow_html=True)
@@ -937,6 +1257,14 @@ def render_experiment_tab(df):
     else:
         df_show = df_base
 
+    # 风味家族：离线社区发现得到的归属，比关键词大类更贴近「闻起来像一家」
+    families = get_flavor_families(data_version())
+    if families["options"]:
+        fam = st.selectbox("🧬 风味家族", ["全部家族"] + families["options"], key="family_filter")
+        if fam in families["labels"]:
+            df_show = df_show[df_show["name"].map(families["of"]).eq(families["labels"][fam])]
+
+    df_filtered = df_show
     search_query = st.text_input("🔍 搜索食材", key="search_box", placeholder="输入名称...")
     if search_query.strip():
         q = search_query.lower()
@@ -1019,11 +1347,47 @@ def render_experiment_tab(df):
     # 同步到持久化 state
     if selected:
         st.session_state["selected_ingredients"] = selected
-    
+
+    render_note_search(df_filtered)
     return selected
 
+def _fill_compare(names):
+    st.session_state["compare_select"] = list(names)[:COMPARE_MAX]
+
+def render_compare_tab(df):
+    """对比台：批量选入候选食材，可按风味家族一键填充"""
+    families = get_flavor_families(data_version())
+    if families["options"]:
+        fam = st.selectbox("🧬 按风味家族填充", families["options"], key="compare_family")
+        fid = families["labels"][fam]
+        members = [n for n in df["name"] if families["of"].get(n) == fid]
+        st.button(f"填入该家族（{min(len(members), COMPARE_MAX)} 种）", key="compare_fill_family",
+                  on_click=_fill_compare, args=(members,), use_container_width=True)
+    current = [n for n in st.session_state.get("selected_ingredients", []) if n in set(df["name"])]
+    if current:
+        st.button("以当前组合开始", key="compare_fill_current", on_click=_fill_compare,
+                  args=(current + [n for n in st.session_state.get("compare_select", []) if n not in current],),
+                  use_container_width=True)
+    names = st.multiselect(f"候选食材（最多 {COMPARE_MAX} 种）", options=df["name"].tolist(),
+                           format_func=display_name, max_selections=COMPARE_MAX, key="compare_select")
+    kernel_of = {v["label"]: k for k, v in SIM_KERNELS.items()}
+    kernel = st.selectbox("相似度核", list(kernel_of), key="compare_kernel",
+                          help="默认即实验台使用的分子共鸣指数；其余核用于对照")
+    basis = "notes"
+    mols = get_molecule_store(data_version())
+    if mols is not None:
+        pick = st.radio("比较依据", ["风味标签", "化合物分子"], horizontal=True, key="compare_basis",
+                        help=f"化合物分子：按共有化合物打分（{mols.coverage} 种食材有分子数据，来源 {mols.source}）")
+        basis = "molecules" if pick == "化合物分子" else "notes"
+    return names, kernel_of[kernel], basis
+
 def render_formula_tab(selected):
     ratios = {}
+    # 上一轮求解出的比例：必须在滑块创建之前写入它们的 state
+    pending = st.session_state.pop("_pending_ratios", None)
+    if pending:
+        for name, pct in pending.items():
+            st.session_state[f"r_{name}"] = pct
     if len(selected) >= 2:
         st.markdown("""
         <div class="ratio-guide">
@@ -1057,10 +1421,35 @@ def render_formula_tab(selected):
                 unsafe_allow_html=True
             )
         st.markdown("</div>", unsafe_allow_html=True)
+        render_ratio_solver(selected, ratios)
     else:
         st.info("请选择至少2种食材以调整配方比例")
     return ratios
 
+def render_ratio_solver(selected, ratios):
+    """设定目标风味轮廓，反推最接近的配方比例（毫秒级，不用反复拖滑块）"""
+    with st.expander("🎯 按目标风味反推比例"):
+        feats = load_features(data_version())
+        row_of = {n: i for i, n in enumerate(feats["names"])}
+        V = np.asarray([feats["radar"][row_of[n]] for n in selected], dtype=np.float64)
+        current = blend_profile(V[None], [[ratios.get(n, 1/len(selected)) for n in selected]])[0]
+        st.caption("默认值为当前比例下的组合轮廓（各食材缩放后雷达值的平均）")
+        target = []
+        for k, d in enumerate(feats["dims"]):
+            target.append(st.slider(d, 0.0, 10.0, float(round(current[k] * 2) / 2), 0.5, key=f"target_{d}"))
+        if st.button("🧮 求解比例", key="solve_ratios", use_container_width=True):
+            t0 = time.perf_counter()
+            res = optimize_ratios(V, target)
+            pcts = round_ratios(res["ratios"], step=5)
+            st.session_state["_ratio_solve"] = {"rmse": res["rmse"], "ms": (time.perf_counter() - t0) * 1000,
+                                                "pcts": dict(zip(selected, pcts))}
+            st.session_state["_pending_ratios"] = dict(zip(selected, pcts))
+            st.rerun()
+        last = st.session_state.get("_ratio_solve")
+        if last and set(last["pcts"]) == set(selected):
+            parts = " · ".join(f"{t_ingredient(n)} {p}%" for n, p in last["pcts"].items())
+            st.caption(f"已应用：{parts}（轮廓误差 RMSE {last['rmse']:.2f} · {last['ms']:.1f} ms）")
+
 def render_settings_tab():
     st.markdown("### 🔑 API 配置")
     st.markdown("**通义千问（阿里云 DashScope）**")
@@ -1147,7 +1536,80 @@ DASHSCOPE_MODEL = "qwen-turbo"
 ⚠️ Secrets 中的模型设置会**覆盖**界面中的选择，建议设为 `qwen-turbo`
 
 **获取 Key：** https://dashscope.console.aliyun.com/
+
+**风味标签规范化（可选）：** 设置环境变量 `FLAVOR_LAB_CANONICAL_NOTES=1` 后，
+roast / roasted、medical / medicinal 等同义标签会合并计算；预计算产物需用 `python precompute.py --canonical` 生成
+
+**分子级数据（可选）：** 把 FlavorDB 导出的 `ingredient_compounds.csv` 与 `compounds.csv`（可 gzip）放到一个目录，
+设置 `FLAVOR_LAB_MOLECULES=该目录` 或运行 `python precompute.py --molecules 该目录`；未提供时使用食材库自带的部分分子样本
+
+**数据热更新（可选）：** 设置 `FLAVOR_LAB_HOT_RELOAD=1` 后，修改 `flavordb_data.csv` 或 `localization_zh.json`
+无需重启：按内容哈希发现新版本，只重算变化的食材行，新版本对之后的操作生效（`FLAVOR_LAB_RELOAD_INTERVAL` 秒检查一次）
+
+**多进程部署（可选）：** 同一台机器上开多个 Streamlit 进程时，设置 `FLAVOR_LAB_SHARED_DIR=共享目录`：
+第一个进程生成一份派生产物，其余进程只读映射同一份文件，每个进程的私有内存不随进程数增长
         """)
+        st.caption(f"风味标签规范化：{'已开启' if CANONICAL_NOTES else '未开启'}")
+        cat_stats = get_catalog(data_version()).get("stats")
+        if cat_stats:
+            st.caption(f"食材库解析：分块流式读取 {cat_stats['rows_read']:,} 行 · 丢弃 {cat_stats['rows_dropped']} 行无风味数据 · "
+                       f"{cat_stats['rows_per_s']:,} 行/秒")
+        mols = get_molecule_store(data_version())
+        if mols is not None:
+            st.caption(f"分子数据：{mols.source} · {mols.n_edges:,} 条边 · {mols.n_compounds:,} 个化合物 · "
+                       f"覆盖 {mols.coverage} 种食材 · {mols.nbytes() / 1024:.0f} KB")
+        render_reload_status()
+        render_version_manifest()
+
+def render_version_manifest():
+    """各数据版本的缓存清单：预计算产物对应哪个版本、持久化缓存里每个版本存了什么"""
+    v = SNAPSHOT.version
+    art = get_artifacts(v.key)
+    manifest_path = os.path.join(ARTIFACT_DIR, ARTIFACT_MANIFEST)
+    if art is not None:
+        src = "precompute.py 生成" if art["dir"] == ARTIFACT_DIR else "本机共享，由第一个进程生成"
+        st.caption(f"预计算产物：{v.data_key} · {len(art['manifest'].get('files', {}))} 个文件"
+                   f"（{src}，各进程只读映射）")
+    elif os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                stale = json.load(f).get("fingerprint")
+        except (OSError, ValueError):
+            stale = None
+        st.caption(f"预计算产物：{stale or '清单损坏'} 与当前数据 {v.data_key} 不符，已回退现场计算"
+                   "（重新运行 precompute.py）")
+    disk = get_disk_cache()
+    if disk is None:
+        return
+    try:
+        versions = disk.versions()
+    except sqlite3.Error:
+        return
+    watcher = get_dataset_watcher()
+    live = live_fingerprints(s.version for s in map(watcher.get, watcher.live_keys()) if s is not None)
+    for row in versions[:RELOAD_KEEP + 2]:
+        fp = row["fingerprint"]
+        mark = "当前" if fp in (v.key, v.data_key) else "保留" if fp in live else "待清除"
+        st.caption(f"缓存 {fp}（{mark}）· {row['entries']} 条 · {row['bytes'] / 1024:.0f} KB · "
+                   + "、".join(f"{ns}×{n}" for ns, n in sorted(row["namespaces"].items())))
+
+def render_reload_status():
+    watcher = get_dataset_watcher()
+    if not watcher.enabled:
+        st.caption(f"数据热更新：未开启 · 数据版本 {SNAPSHOT.version.key}")
+        return
+    st.caption(f"数据热更新：已开启（每 {watcher.interval:g} 秒检查）· 当前版本 {SNAPSHOT.version.key}")
+    for ev in reversed(watcher.events[-3:]):
+        if "error" in ev:
+            st.caption(f"⚠️ {ev['time']} 读取失败，继续使用旧版本：{ev['error'][:80]}")
+        elif ev["diff"].get("loc_only"):
+            st.caption(f"🔄 {ev['time']} 本地化词表已更新（{ev['elapsed_s']:.2f}s）")
+        else:
+            d = ev["diff"] or {}
+            mode = "整体重算" if d.get("full_rebuild", True) else "增量更新"
+            st.caption(f"🔄 {ev['time']} 新增 {d.get('added', 0)} · 变化 {d.get('changed', 0)} · 删除 {d.get('removed', 0)} · "
+                       f"重算 {d.get('rows_recomputed', '全部')} 行（{mode}，{ev['elapsed_s']:.2f}s）")
+    st.button("🔄 立即检查数据文件", key="reload_check", on_click=watcher.poll, kwargs={"force": True})
 
 def render_empty_state(df):
     st.markdown("""
@@ -1302,6 +1764,277 @@ def render_empty_state(df):
     st.markdown("</div>", unsafe_allow_html=True)
     st.markdown(f'<div style="text-align:center;padding:16px;color:var(--text-faint);font-size:.75rem">🧬 FlavorDB · {len(df)} 种食材 · 分子风味科学</div>', unsafe_allow_html=True)
 
+def add_to_selection(name):
+    curr = list(st.session_state.get("selected_ingredients", []))
+    if name not in curr and len(curr) < 4:
+        curr.append(name)
+        st.session_state["selected_ingredients"] = curr
+        st.session_state["_button_trigger"] = st.session_state.get("_button_trigger", 0) + 1
+        st.rerun()
+    elif len(curr) >= 4:
+        st.warning("⚠️ 最多支持4种食材")
+
+def render_note_search(df_filtered):
+    """按想要 / 必须 / 排除的风味标签反查食材，沿用侧边栏的纯素 / 大类 / 家族筛选"""
+    with st.expander("🎯 按风味反查食材"):
+        ns = get_note_search(data_version())
+        labels = [f"{t_note(v)} · {v}" if t_note(v) != v else v for v in ns.vocab]
+        note_of = dict(zip(labels, ns.vocab))
+        should = st.multiselect("想要的风味", labels, key="ns_should", placeholder="中英文均可搜索")
+        must = st.multiselect("必须包含", labels, key="ns_must")
+        must_not = st.multiselect("排除", labels, key="ns_not")
+        if not should and not must:
+            st.caption("例：想要 烘焙 + 柑橘 + 花香，排除 硫味")
+            return
+        mask = np.isin(ns.names, df_filtered["name"].to_numpy())
+        res = ns.search(must=[note_of[x] for x in must], should=[note_of[x] for x in should],
+                        must_not=[note_of[x] for x in must_not], k=8, mask=mask)
+        if not res["results"]:
+            st.info("没有同时满足这些条件的食材")
+            return
+        for hit in res["results"]:
+            name = hit["name"]
+            got = " ".join(f'<span class="tag tag-green">{t_note(v)}</span>' for v, _ in hit["matched"])
+            miss = " ".join(f'<span class="tag" style="opacity:.45">{t_note(v)}</span>' for v in hit["missing"])
+            st.markdown(f"""<div class="ing-row">
+              <div style="font-weight:700;color:var(--text-primary)">{t_ingredient(name)}
+                <span style="font-size:.72rem;color:var(--text-muted);font-weight:400"> 得分 {hit["score"]:.2f}</span></div>
+              <div style="line-height:1.9">{got} {miss}</div></div>""", unsafe_allow_html=True)
+            if st.button("➕ 加入实验", key=f"add_ns_{name}", use_container_width=True):
+                add_to_selection(name)
+        st.caption(f"IDF 加权 · 扫描 {res['blocks_scored']}/{res['blocks_total']} 块 · {res['elapsed_ms']:.1f} ms")
+
+def render_molecule_overlap(n1, n2):
+    """化合物层面的重合：两种食材都有分子数据时才显示"""
+    mols = get_molecule_store(data_version())
+    if mols is None or not (mols.has(n1) and mols.has(n2)):
+        return
+    ov = mols.overlap(n1, n2)
+    st.markdown('<div class="card"><h4 class="card-title">⚗️ 化合物重合</h4>', unsafe_allow_html=True)
+    st.markdown(f"<div style='margin-bottom:6px'>分子共鸣 <b style='color:{score_color(ov['score'])}'>{ov['score']}</b>"
+                f" · 共享 {len(ov['shared'])} 个化合物（{t_ingredient(n1)} {ov['n_a']} · {t_ingredient(n2)} {ov['n_b']}）</div>",
+                unsafe_allow_html=True)
+    st.markdown(compound_tags_html(mols, ov["shared"]) if len(ov["shared"])
+                else "<span style='color:var(--text-faint)'>没有共享化合物</span>", unsafe_allow_html=True)
+    st.caption(f"按共有化合物计算（来源 {mols.source}），与上方基于风味标签的共鸣指数相互参照")
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def render_wormholes(n1, n2):
+    cn1, cn2 = t_ingredient(n1), t_ingredient(n2)
+    st.markdown('<div class="card"><h4 class="card-title">🌀 风味虫洞路径</h4>', unsafe_allow_html=True)
+    st.markdown(f"<p style='color:var(--text-muted);font-size:.82rem'>从 <b>{cn1}</b> 一步步过渡到 <b>{cn2}</b>：每一跳都是高共鸣搭配</p>", unsafe_allow_html=True)
+    graph = get_flavor_graph(data_version())
+    t0 = time.perf_counter()
+    paths = graph.wormholes(n1, n2, k=3)
+    ms = (time.perf_counter() - t0) * 1000
+    if not paths:
+        st.info("在相似图中没有找到连接两者的路径")
+        st.markdown("</div>", unsafe_allow_html=True)
+        return
+    for pi, path in enumerate(paths):
+        chain = ""
+        for i, name in enumerate(path["names"]):
+            chain += f'<span class="tag tag-{"blue" if i in (0, len(path["names"]) - 1) else "orange"}">{t_ingredient(name)}</span>'
+            if i < len(path["hops"]):
+                chain += f'<span style="color:var(--text-faint);font-size:.72rem;margin:0 4px">─{path["hops"][i]}→</span>'
+        st.markdown(f"""<div class="ing-row">
+          <div style="font-size:.74rem;color:var(--text-muted);margin-bottom:4px">路线 {pi + 1} · {len(path["hops"])} 跳 · 最弱一环 {min(path["hops"])}</div>
+          <div style="line-height:2">{chain}</div></div>""", unsafe_allow_html=True)
+        if len(path["names"]) <= 4 and st.button("🧪 按这条路线实验", key=f"wormhole_{pi}"):
+            st.session_state["selected_ingredients"] = list(path["names"])
+            st.session_state["_button_trigger"] = st.session_state.get("_button_trigger", 0) + 1
+            st.rerun()
+    st.caption(f"A* + Jaccard 启发 · K 条备选路径 · {ms:.1f} ms")
+    st.markdown("</div>", unsafe_allow_html=True)
+
+MAP_COLORS = ["#F59E0B", "#22C55E", "#EF4444", "#10B981", "#A16207", "#8B5CF6",
+              "#D97706", "#0EA5E9", "#DC2626", "#7C3AED", "#EC4899", "#94A3B8"]
+
+def render_flavor_map(df, selected, bridge_names):
+    """风味宇宙：全部食材按二维坐标铺开，按大类着色，高亮当前组合与桥接食材（WebGL 渲染）"""
+    st.markdown('<div class="card"><h4 class="card-title">🌌 风味宇宙</h4>', unsafe_allow_html=True)
+    if not st.checkbox("显示全部食材的二维风味地图", key="show_flavor_map"):
+        st.caption("距离越近，风味标签越相似；可缩放、悬停查看食材")
+        st.markdown("</div>", unsafe_allow_html=True)
+        return
+    fmap = get_flavor_map(data_version())
+    names, xy = fmap["names"], fmap["xy"]
+    # 地图与符号表来自同一数据版本，行号一致：品类与译名都按编号取
+    cat_ids = SYM["row_category"]
+    groups = np.array([category_group(c) for c in SYM["categories"].en])[cat_ids]
+    hover = np.char.add(np.char.add(SYM["ingredients"].zh.astype(str), " · "),
+                        SYM["categories"].zh[cat_ids].astype(str))
+
+    fig = go.Figure()
+    for gi, group in enumerate(CAT_GROUP):
+        idx = np.flatnonzero(groups == group)
+        if len(idx) == 0:
+            continue
+        fig.add_trace(go.Scattergl(
+            x=xy[idx, 0], y=xy[idx, 1], mode="markers", name=group,
+            marker=dict(size=5, color=MAP_COLORS[gi % len(MAP_COLORS)], opacity=0.55),
+            text=hover[idx], hoverinfo="text"))
+    pos = {n: i for i, n in enumerate(names)}
+    for label, members, symbol, color, size in (
+            ("桥接食材", [n for n in bridge_names if n in pos and n not in selected], "diamond", "#F97316", 12),
+            ("当前组合", [n for n in selected if n in pos], "star", "#7B2FF7", 18)):
+        if not members:
+            continue
+        idx = [pos[n] for n in members]
+        fig.add_trace(go.Scattergl(
+            x=xy[idx, 0], y=xy[idx, 1], mode="markers+text", name=label,
+            text=[t_ingredient(n) for n in members], textposition="top center",
+            textfont=dict(size=11, color="#374151"),
+            marker=dict(size=size, symbol=symbol, color=color, line=dict(width=1.5, color="white")),
+            hoverinfo="text"))
+    fig.update_layout(
+        height=520, margin=dict(t=10, b=10, l=10, r=10),
+        xaxis=dict(visible=False), yaxis=dict(visible=False, scaleanchor="x"),
+        legend=dict(orientation="h", y=-0.02, font=dict(size=10)),
+        paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(248,249,255,0.2)")
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(f"{len(names)} 种食材 · TF-IDF 截断 SVD + 邻域图嵌入 · 距离越近风味越相似")
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def _open_pair(a, b):
+    st.session_state["selected_ingredients"] = [a, b]
+    st.session_state["sidebar_tab"] = "实验台"
+    st.session_state["sidebar_tab_radio"] = "实验台"
+    st.session_state["_button_trigger"] = st.session_state.get("_button_trigger", 0) + 1
+
+def render_compare_view(df, names, kernel=DEFAULT_KERNEL, basis="notes"):
+    """N×N 共鸣热力图：整块向量化打分（或直接切预计算矩阵），按层次聚类排序；basis 切换标签 / 化合物"""
+    st.markdown('<div class="card"><h4 class="card-title">🗺 多食材共鸣对比</h4>', unsafe_allow_html=True)
+    if len(names) < 3:
+        st.info("💡 在左侧「对比台」选入至少 3 种候选食材（可按风味家族一键填充）")
+        st.markdown("</div>", unsafe_allow_html=True)
+        return
+    h = data_version()
+    cs = get_combo_search(h)
+    art = get_artifacts(h)
+    mols = get_molecule_store(h) if basis == "molecules" else None
+    unit = "个化合物" if mols is not None else "个标签"
+    t0 = time.perf_counter()
+    rows = [cs.index[n] for n in names]
+    if mols is not None:
+        # 同一套 CSR 打分，只是列从风味标签换成化合物
+        m = resonance_matrix(mols.ing_ptr, mols.comp_idx, mols.n_compounds, rows)
+        backend = mols.backend()
+    else:
+        snap = _snapshot_for(h)
+        scores = snap.scores if snap is not None else (art["scores"] if art is not None else None)
+        m = resonance_matrix(cs.indptr, cs.indices, cs.n_notes, rows, scores=scores)
+        backend = None
+    spec = SIM_KERNELS[kernel]
+    if kernel == DEFAULT_KERNEL:
+        vals = m["scores"]
+        order = cluster_order(vals)
+    else:
+        vals = (backend or get_sim_backend(h)).block(rows, rows, kernel=kernel)
+        order = cluster_order(vals * (100.0 / spec["scale"]))
+    ms = (time.perf_counter() - t0) * 1000
+    names = [names[i] for i in order]
+    sc = vals[np.ix_(order, order)]
+    shared = m["shared"][np.ix_(order, order)]
+    labels = [t_ingredient(n) for n in names]
+    if len(set(labels)) < len(labels):
+        labels = [display_name(n) for n in names]
+
+    # 对角线留空，颜色只反映两两之间的差异；悬停只带分数与共享数，标签明细按需加载
+    z = sc.astype(float)
+    np.fill_diagonal(z, np.nan)
+    fmt = "{:d}" if kernel == DEFAULT_KERNEL else "{:.2f}"
+    hover = [[f"{labels[i]} × {labels[j]}<br>{spec['label']} {fmt.format(sc[i, j])} · 共享 {shared[i, j]} {unit}"
+              for j in range(len(names))] for i in range(len(names))]
+    zmin, zmax = (18, 97) if kernel == DEFAULT_KERNEL else (0, spec["scale"])
+    fig = go.Figure(go.Heatmap(
+        z=z, x=labels, y=labels, text=hover, hoverinfo="text", zmin=zmin, zmax=zmax,
+        colorscale=[[0, "#EF4444"], [0.35, "#F97316"], [0.6, "#FBBF24"], [1, "#22C55E"]],
+        colorbar=dict(title="共鸣" if kernel == DEFAULT_KERNEL else "相似度", thickness=12)))
+    fig.update_layout(
+        height=max(420, 16 * len(names) + 160), margin=dict(t=10, b=10, l=10, r=10),
+        xaxis=dict(tickangle=-60, tickfont=dict(size=10)),
+        yaxis=dict(autorange="reversed", tickfont=dict(size=10)),
+        paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
+    st.plotly_chart(fig, use_container_width=True)
+
+    csv = pd.DataFrame(sc, index=names, columns=names).to_csv().encode("utf-8-sig")
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        st.caption(f"{len(names)} 种食材 · {len(names) * (len(names) - 1) // 2} 对 · {spec['label']} · "
+                   + (f"化合物重合（{mols.source}，{sum(mols.has(n) for n in names)} 种有分子数据）· "
+                      if mols is not None else "")
+                   + f"向量化打分 + 平均连接聚类 {ms:.1f} ms")
+    with c2:
+        st.download_button("⬇️ 导出 CSV", data=csv,
+                           file_name=f"{kernel}_{'molecule_' if mols is not None else ''}matrix.csv",
+                           mime="text/csv", key="compare_csv", use_container_width=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    # 单元格明细：选中一对后才计算共享标签
+    st.markdown(f'<div class="card"><h4 class="card-title">🔬 查看一对的共享{"化合物" if mols is not None else "标签"}</h4>',
+                unsafe_allow_html=True)
+    pa, pb = st.columns(2)
+    with pa:
+        a = st.selectbox("食材 A", labels, index=0, key="compare_a")
+    with pb:
+        b = st.selectbox("食材 B", labels, index=1, key="compare_b")
+    na, nb = names[labels.index(a)], names[labels.index(b)]
+    if na != nb and mols is not None:
+        ov = mols.overlap(na, nb)
+        st.markdown(f"<div style='margin-bottom:6px'>分子共鸣 <b style='color:{score_color(ov['score'])}'>{ov['score']}</b>"
+                    f" · 共享 {len(ov['shared'])} 个化合物（{ov['n_a']} / {ov['n_b']}）</div>", unsafe_allow_html=True)
+        st.markdown(compound_tags_html(mols, ov["shared"], 30) if len(ov["shared"])
+                    else "<span style='color:var(--text-faint)'>没有共享化合物</span>", unsafe_allow_html=True)
+        st.button(f"🧪 深入分析 {a} × {b}", key="compare_open_pair", on_click=_open_pair, args=(na, nb))
+    elif na != nb:
+        mol = dict(zip(df["name"], df["mol_set"]))
+        sim = calc_sim(mol[na], mol[nb])
+        st.markdown(f"<div style='margin-bottom:6px'>共鸣 <b style='color:{score_color(sim['score'])}'>{sim['score']}</b>"
+                    f" · 共享 {len(sim['shared'])} 个标签</div>", unsafe_allow_html=True)
+        st.markdown(shared_tags_html([t_note(x) for x in sim["shared"]], 30) if sim["shared"]
+                    else "<span style='color:var(--text-faint)'>没有共享标签</span>", unsafe_allow_html=True)
+        st.button(f"🧪 深入分析 {a} × {b}", key="compare_open_pair", on_click=_open_pair, args=(na, nb))
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def render_radar_knn(df, selected, ratios):
+    """按雷达轮廓找「味道形状」相似的食材，沿用侧边栏的纯素 / 大类筛选"""
+    with st.expander("🔎 找风味轮廓相似的食材"):
+        index = get_radar_index(data_version())
+        mode = st.radio("查询方式", ["当前组合", "单个食材", "手绘轮廓"], horizontal=True,
+                        key="knn_mode", label_visibility="collapsed")
+        if mode == "单个食材":
+            base = st.selectbox("食材", selected, format_func=display_name, key="knn_ing")
+            profile = index.profile_of([base])
+            exclude = [base]
+        elif mode == "手绘轮廓":
+            current = index.profile_of(selected, ratios)
+            cols = st.columns(2)
+            profile = []
+            for k, d in enumerate(index.dims):
+                with cols[k % 2]:
+                    profile.append(st.slider(d, 0.0, 10.0, float(round(current[k] * 2) / 2), 0.5, key=f"knn_{d}"))
+            exclude = []
+        else:
+            profile = index.profile_of(selected, ratios)
+            exclude = selected
+        mask = catalog_mask(df, st.session_state.get("vegan_on", False),
+                            st.session_state.get("selected_groups", set()))
+        results = index.query(profile, k=6, mask=mask, exclude=exclude)
+        if not results:
+            st.info("当前筛选下没有可比较的食材")
+            return
+        for r in results:
+            kcat_zh = t_category_of(r["name"])
+            kc1, kc2 = st.columns([3, 1])
+            with kc1:
+                st.markdown(f"""<div style="font-size:.84rem"><b>{t_ingredient(r["name"])}</b>
+                  <span style="color:var(--text-faint);font-size:.74rem">{kcat_zh} · 轮廓相似 {r["similarity"]*100:.0f}% · 距离 {r["distance"]:.1f}</span></div>""",
+                            unsafe_allow_html=True)
+            with kc2:
+                if r["name"] not in selected and st.button("➕", key=f"add_knn_{r['name']}"):
+                    add_to_selection(r["name"])
+
 # ================================================================
 # 11. 主函数
 # ================================================================
@@ -1310,6 +2043,7 @@ def main():
     if df is None:
         st.error("❌ 找不到 flavordb_data.csv，请确保数据文件在同一目录下")
         st.stop()
+    evict_stale_versions(data_version())
 
     # Hero
     _, btn_col = st.columns([9, 1])
@@ -1350,6 +2084,8 @@ def main():
                 ratios = {}
             else:
                 ratios = render_formula_tab(selected)
+        elif selected_tab == "对比台":
+            compare, kernel, basis = render_compare_tab(df)
         else:
             selected = st.session_state.get("selected_ingredients", [])
             ratios = {}
@@ -1358,15 +2094,20 @@ def main():
         st.divider()
         st.caption("数据来源：FlavorDB · 分子风味科学 · 通义千问")
 
+    if selected_tab == "对比台":
+        render_compare_view(df, compare, kernel, basis)
+        return
+
     if len(selected) < 2:
         render_empty_state(df)
         return
 
     # 分析
-    rows = {n: df[df["name"] == n].iloc[0] for n in selected}
-    mol_sets = {n: rows[n]["mol_set"] for n in selected}
+    notes = {n: note_ids(n) for n in selected}
     n1, n2 = selected[0], selected[1]
-    sim = calc_sim(mol_sets[n1], mol_sets[n2])
+    pair_service = get_pair_service(data_version())
+    bundle = pair_service.get(selected)
+    sim = pair_service.sim_for(bundle, n1, n2)
     cn1, cn2 = t_ingredient(n1), t_ingredient(n2)
 
     if not ratios:
@@ -1377,39 +2118,9 @@ def main():
 
     with r1_left:
         st.markdown('<div class="card"><h4 class="card-title">🔭 风味维度雷达图</h4>', unsafe_allow_html=True)
-        palette = [("#00D2FF","rgba(0,210,255,0.15)"),("#7B2FF7","rgba(123,47,247,0.15)"),
-                   ("#FF6B6B","rgba(255,107,107,0.15)"),("#00E676","rgba(0,230,118,0.15)")]
-        fig_radar = go.Figure()
-        dims = list(RADAR_DIMS.keys())
-        for i, name in enumerate(selected[:4]):
-            rv = radar_vals(mol_sets[name])
-            vals = [rv[d] for d in dims]
-            scale = 0.5 + ratios.get(name, 1/len(selected)) * 0.5 * len(selected)
-            vals_s = [min(10, v*scale) for v in vals] + [min(10, vals[0]*scale)]
-            lc, fc = palette[i]
-            pct = int(ratios.get(name, 1/len(selected))*100)
-            hover_texts = [f"<b>{d.split(chr(10))[0]}</b><br>{RADAR_TOOLTIPS.get(d,'')}<br>分值: {vals_s[di]:.1f}/10" for di,d in enumerate(dims)] + [""]
-            fig_radar.add_trace(go.Scatterpolar(
-                r=vals_s, theta=dims+[dims[0]], fill="toself", fillcolor=fc,
-                line=dict(color=lc, width=2.5), name=f"{t_ingredient(name)} ({pct}%)",
-                mode='lines+markers', marker=dict(size=4),
-                text=hover_texts, hovertemplate="%{text}<extra></extra>"
-            ))
-        fig_radar.update_layout(
-            polar=dict(bgcolor="rgba(248,249,255,0.4)",
-                       radialaxis=dict(
-                           visible=True, range=[0,10],
-                           tickvals=[2, 4, 6, 8, 10],
-                           ticktext=["2", "4", "6", "8", "10"],
-                           tickfont=dict(size=9, color="#6B7280"),
-                           gridcolor="rgba(107,114,128,0.2)",
-                           linecolor="rgba(107,114,128,0.2)"
-                       ),
-                       angularaxis=dict(tickfont=dict(size=12, color="#6B7280"))),
-            showlegend=True, legend=dict(orientation="h", y=-0.18, font=dict(size=11, color="#6B7280")),
-            height=420, margin=dict(t=20, b=80, l=40, r=40), paper_bgcolor="rgba(0,0,0,0)"
-        )
-        st.plotly_chart(fig_radar, use_container_width=True)
+        st.plotly_chart(radar_figure(data_version(), selected, ratios, st.session_state.language),
+                        use_container_width=True)
+        render_radar_knn(df, selected, ratios)
         st.markdown("</div>", unsafe_allow_html=True)
 
     with r1_right:
@@ -1486,7 +2197,7 @@ def main():
         st.markdown('<div class="card"><h4 class="card-title">🧪 风味指纹</h4>', unsafe_allow_html=True)
         for i, name in enumerate(selected):
             cn = t_ingredient(name)
-            notes_cn = t_notes_list(rows[name]["mol_set"], top_n=10)
+            notes_cn = t_notes_list(notes[name], top_n=10)
             pct = int(ratios.get(name, 1/len(selected))*100)
             cls = TAG_CLASSES[i % len(TAG_CLASSES)]
             dom = ""
@@ -1501,41 +2212,66 @@ def main():
               <div style="margin-top:4px">{tags_html(notes_cn, cls, 8)}</div>
             </div>""", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
+        render_molecule_overlap(n1, n2)
 
-    # 分子连线网络图
-    if sim["shared"]:
+    # 分子连线网络图：所选食材 + 它们的全部风味标签，次要标签按缩放层级聚簇
+    net = selection_network(selected)
+    if len(net["notes"]):
         st.markdown('<div class="card"><h4 class="card-title">🕸 分子连线网络图</h4>', unsafe_allow_html=True)
-        shared_top = sim["shared"][:14]
-        nx_l,ny_l,ntxt,nclr,nsz,ex,ey = [],[],[],[],[],[],[]
-        nx_l += [-1.6, 1.6]; ny_l += [0, 0]
-        ntxt += [cn1, cn2]; nclr += ["#00D2FF","#7B2FF7"]; nsz += [34, 34]
-        for idx, note in enumerate(shared_top):
-            angle = math.pi/2 + idx*2*math.pi/len(shared_top)
-            px, py = 1.15*math.cos(angle), 1.15*math.sin(angle)
-            nx_l.append(px); ny_l.append(py)
-            ntxt.append(t_note(note)); nclr.append("#F97316"); nsz.append(14)
-            for sx, sy in [(-1.6,0),(1.6,0)]:
-                ex += [sx,px,None]; ey += [sy,py,None]
-        fig_net = go.Figure()
-        fig_net.add_trace(go.Scatter(x=ex, y=ey, mode="lines",
-            line=dict(color="rgba(150,150,200,0.2)", width=1), hoverinfo="none", showlegend=False))
-        fig_net.add_trace(go.Scatter(x=nx_l, y=ny_l, mode="markers+text",
-            text=ntxt, textposition="top center", textfont=dict(size=10, color="#6B7280"),
-            marker=dict(color=nclr, size=nsz, line=dict(width=2, color="white"), opacity=0.9),
-            hoverinfo="text", showlegend=False))
-        fig_net.update_layout(
-            height=340, margin=dict(t=10, b=20, l=20, r=20),
-            xaxis=dict(visible=False), yaxis=dict(visible=False),
-            paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(248,249,255,0.2)")
-        st.plotly_chart(fig_net, use_container_width=True)
+        level_of = {cfg["label"]: lvl for lvl, cfg in NETWORK_LOD.items()}
+        pick = st.radio("缩放层级", list(level_of), horizontal=True, key="network_lod",
+                        help="「全局」「局部」只单独画最重要的标签，其余按区域聚成半透明的簇（悬停看成员）；"
+                             "「全部」画出每个标签。图上可框选放大、双击复原")
+        st.plotly_chart(network_figure(data_version(), selected, level_of[pick], st.session_state.language),
+                        use_container_width=True)
+        dots = "".join(f'<span><span style="color:{RADAR_PALETTE[i % len(RADAR_PALETTE)][0]}">●</span> '
+                       f'{t_ingredient(n)}</span>' for i, n in enumerate(selected))
         st.markdown(f"""
-        <div style="display:flex;align-items:center;gap:20px;justify-content:center;
+        <div style="display:flex;align-items:center;gap:20px;justify-content:center;flex-wrap:wrap;
              padding:8px 0 4px;font-size:.78rem;color:var(--text-muted)">
-          <span>🔵 {cn1}</span><span>🟣 {cn2}</span>
-          <span>🟠 共享节点 · {len(sim["shared"])} 个</span>
+          {dots}
+          <span>🟠 共享风味 · {int((net["degree"] > 1).sum())} 个</span>
+          <span>共 {len(net["notes"])} 个风味节点</span>
         </div>""", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
 
+    # 多食材协同分析（3-4 种食材）
+    if len(selected) >= 3:
+        group_service = get_group_service(data_version())
+        group_service.seed_pair(bundle.pair, bundle.sim)
+        group = group_service.summary(group_service.get(selected), selected, ratios)
+        gsc = group["score"]
+        gtype = {"resonance": "同源共振", "neutral": "平衡搭档", "contrast": "对比碰撞"}[group["type"]]
+        head = "".join(f'<th style="padding:6px 8px;font-size:.74rem;color:var(--text-muted)">{t_ingredient(n)}</th>'
+                       for n in selected)
+        body = ""
+        for i, a in enumerate(selected):
+            cells = ""
+            for j in range(len(selected)):
+                v = group["matrix"][i][j]
+                if v is None:
+                    cells += '<td style="text-align:center;color:var(--text-faint)">—</td>'
+                else:
+                    cells += f'<td style="text-align:center;font-weight:800;color:{score_color(v)}">{v}</td>'
+            body += f'<tr><th style="text-align:left;padding:6px 8px;font-size:.74rem;color:var(--text-muted)">{t_ingredient(a)}</th>{cells}</tr>'
+        core_html = (shared_tags_html(group["core"], 12) if group["core"]
+                     else '<span style="color:var(--text-faint);font-size:.8rem">没有所有食材共有的风味标签</span>')
+        uniq_html = ""
+        for i, n in enumerate(selected):
+            notes_u = [t_note(m) for m in group["unique"][n]]
+            tags_u = tags_html(notes_u, TAG_CLASSES[i % len(TAG_CLASSES)], 6) if notes_u else "—"
+            uniq_html += f'<div style="margin-bottom:6px"><b>{t_ingredient(n)}</b> <span style="color:var(--text-faint);font-size:.74rem">独有 {len(notes_u)} 个</span><br>{tags_u}</div>'
+        st.markdown(f"""<div class="card"><h4 class="card-title">👥 多食材协同分析</h4>
+          <div style="display:flex;align-items:baseline;gap:10px;margin-bottom:10px">
+            <span style="font-size:2.2rem;font-weight:900;color:{score_color(gsc)}">{gsc}</span>
+            <span style="color:var(--text-muted);font-size:.82rem">组内加权共鸣 · {gtype} · 按当前比例加权</span>
+          </div>
+          <table style="border-collapse:collapse;margin-bottom:12px"><tr><th></th>{head}</tr>{body}</table>
+          <div style="margin-bottom:10px"><b>🎯 全员共享</b>
+            <span style="color:var(--text-faint);font-size:.74rem">{len(group["core"])} / {group["union_count"]} 个标签</span><br>{core_html}</div>
+          {uniq_html}
+        </div>""", unsafe_allow_html=True)
+
     # 行3：深度诊断 | 介质推演+主厨建议
     r3_left, r3_right = st.columns([1, 1.2], gap="large")
 
@@ -1548,8 +2284,8 @@ def main():
               <b>共享节点：</b><br>{shared_tags_html(sim["shared"][:10])}
             </div>""", unsafe_allow_html=True)
         elif sim["type"] == "contrast":
-            a3 = " / ".join(t_notes_list(rows[n1]["mol_set"], 3))
-            b3 = " / ".join(t_notes_list(rows[n2]["mol_set"], 3))
+            a3 = " / ".join(t_notes_list(notes[n1], 3))
+            b3 = " / ".join(t_notes_list(notes[n2], 3))
             st.markdown(f"""<div class="diag diag-ctr">
               <b>⚡ 对比碰撞</b> — 共享分子比例 {jpct}%<br>
               经典「切割平衡」结构。<b>{cn1}</b> 以 <b>{a3}</b> 主导，<b>{cn2}</b> 以 <b>{b3}</b> 抗衡。
@@ -1573,7 +2309,7 @@ def main():
         st.markdown("</div>", unsafe_allow_html=True)
 
     with r3_right:
-        pol = polarity_analysis(mol_sets[n1] | mol_sets[n2])
+        pol = bundle.polarity
         if pol["total"] > 0:
             st.markdown('<div class="card"><h4 class="card-title">💧 介质推演</h4>', unsafe_allow_html=True)
             st.markdown(f"""
@@ -1664,18 +2400,21 @@ def main():
                 </div>""", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
 
+    # 风味虫洞：低共鸣组合之间的逐步过渡链
+    if sim["type"] != "resonance":
+        render_wormholes(n1, n2)
+
     st.markdown("---")
-    cb, cc = st.columns([1,1], gap="large")
+    cb, cx, cc = st.columns([1,1,1], gap="large")
 
     with cb:
         st.markdown('<div class="card"><h4 class="card-title">🌉 风味桥接推荐</h4>', unsafe_allow_html=True)
         st.markdown(f"<p style='color:var(--text-muted);font-size:.82rem'>寻找能串联 <b>{cn1}</b> 与 <b>{cn2}</b> 的「第三食材」</p>", unsafe_allow_html=True)
-        bridges = find_bridges(df, mol_sets[n1], mol_sets[n2], selected)
+        bridges = pair_service.bridges_for(bundle, n1, n2)
         if bridges:
             for bname, bsc, sa, sb in bridges:
                 bcn = t_ingredient(bname)
-                bcat_row = df[df["name"]==bname]
-                bcat_zh = t_category(bcat_row.iloc[0]["category"]) if len(bcat_row)>0 else ""
+                bcat_zh = t_category_of(bname)
                 ps = min(100, int(bsc*100)); pa = min(100, int(sa*100)); pb = min(100, int(sb*100))
                 st.markdown(f"""
                 <div class="ing-row">
@@ -1698,15 +2437,43 @@ def main():
             st.info("未找到合适的桥接食材")
         st.markdown("</div>", unsafe_allow_html=True)
 
+    with cx:
+        st.markdown('<div class="card"><h4 class="card-title">🧩 最佳组合搜索</h4>', unsafe_allow_html=True)
+        combo_label = st.radio("组合规模", ["3 种食材", "4 种食材"], horizontal=True,
+                               key="combo_size", label_visibility="collapsed")
+        combo_size = 4 if combo_label.startswith("4") else 3
+        anchors = selected[:min(len(selected), combo_size - 1)]
+        anchor_cn = " + ".join(t_ingredient(a) for a in anchors)
+        st.markdown(f"<p style='color:var(--text-muted);font-size:.82rem'>以 <b>{anchor_cn}</b> 为基础，组内平均共鸣最高的 {combo_size} 食材组合</p>", unsafe_allow_html=True)
+        combo_res = get_combo_search(data_version()).search(anchors, combo_size, top_k=4)
+        if combo_res["combos"]:
+            for ci, combo in enumerate(combo_res["combos"]):
+                added_cn = " + ".join(t_ingredient(a) for a in combo["added"])
+                cs_pct = min(100, int(combo["score"]))
+                st.markdown(f"""
+                <div class="ing-row">
+                  <div style="font-weight:700;color:var(--text-primary)">＋ {added_cn}</div>
+                  <div style="font-size:.74rem;color:var(--text-muted)">组内平均共鸣 {combo["score"]:.1f}</div>
+                  <div class="pbar-bg" style="margin-top:5px"><div class="pbar-fill" style="width:{cs_pct}%;background:linear-gradient(90deg,#00D2FF,#7B2FF7)"></div></div>
+                </div>""", unsafe_allow_html=True)
+                if st.button("✅ 采用组合", key=f"use_combo_{ci}", use_container_width=True):
+                    st.session_state["selected_ingredients"] = list(combo["names"])
+                    st.session_state["_button_trigger"] = st.session_state.get("_button_trigger", 0) + 1
+                    st.rerun()
+            note = "" if combo_res["complete"] else " · ⏱ 已达时间预算，结果为当前最优"
+            st.caption(f"分支定界 · 展开 {combo_res['nodes']} 个节点 · {combo_res['elapsed_ms']:.0f} ms{note}")
+        else:
+            st.info("未找到可补齐的组合")
+        st.markdown("</div>", unsafe_allow_html=True)
+
     with cc:
         st.markdown('<div class="card"><h4 class="card-title">⚡ 对比风味推荐</h4>', unsafe_allow_html=True)
         st.markdown(f"<p style='color:var(--text-muted);font-size:.82rem'>与 <b>{cn1}</b> × <b>{cn2}</b> 形成张力对比的食材</p>", unsafe_allow_html=True)
-        contrasts = find_contrasts(df, mol_sets[n1], mol_sets[n2], selected)
+        contrasts = pair_service.contrasts_for(bundle, n1, n2)
         if contrasts:
             for cname, csc, da, db in contrasts:
                 ccn = t_ingredient(cname)
-                ccat_row = df[df["name"]==cname]
-                ccat_zh = t_category(ccat_row.iloc[0]["category"]) if len(ccat_row)>0 else ""
+                ccat_zh = t_category_of(cname)
                 ps = min(100, int(csc*100))
                 st.markdown(f"""
                 <div class="ing-row">
@@ -1729,9 +2496,12 @@ def main():
             st.info("未找到合适的对比食材")
         st.markdown("</div>", unsafe_allow_html=True)
 
+    # 风味宇宙：当前组合与桥接食材在全库中的位置
+    render_flavor_map(df, selected, [b[0] for b in bridges or []])
+
     # AI 对话区
     api_ok, api_config = check_api_status()
-    render_chat_section(api_config if api_ok else None, cn1, cn2, selected, ratios, sim, mol_sets, df)
+    render_chat_section(api_config if api_ok else None, cn1, cn2, selected, ratios, sim, notes, df)
 
     st.markdown(f"""
     <div style="text-align:center;padding:14px;color:var(--text-faint);font-size:.76rem">
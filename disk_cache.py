@@ -0,0 +1,201 @@
+"""
+味觉虫洞 Flavor Lab - 持久化分析缓存
+
+Streamlit 的 st.cache_data / st.cache_resource 只在进程内存里，
+每次重启或重新部署都要冷启动。这里用单个 SQLite 文件保存昂贵的派生结果
+（解析后的数据集、特征矩阵、搭配分析 bundle、推荐列表），重启后直接读盘。
+
+  · 每条记录带数据版本指纹（引擎版本 + 食材库的内容指纹；含译名的输出再加本地化词表），任一变化后旧记录不会被命中
+  · 不再使用的版本在宽限期后整批清除；总大小超过上限时按最近访问时间（LRU）淘汰
+  · 多个 Streamlit 进程可以共用同一个缓存文件（SQLite WAL 模式）
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from engine import DatasetVersion
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.getenv("FLAVOR_LAB_CACHE_DIR", os.path.join(BASE_DIR, ".flavor_cache"))
+DEFAULT_MAX_BYTES = int(os.getenv("FLAVOR_LAB_CACHE_MB", "256")) * 1024 * 1024
+# 过期版本的宽限期：滚动部署时新旧进程可能短暂共用一个缓存文件，避免互相清掉对方正在用的条目
+STALE_GRACE_S = float(os.getenv("FLAVOR_LAB_CACHE_GRACE", "600"))
+# 总字节数在进程内累计；缓存文件可能被多个进程共写，隔这么久按全表重新核对一次
+TOTAL_RESYNC_S = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace   TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    value       BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    created     REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (namespace, key, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access);
+"""
+
+
+def cache_fingerprint(version, localized=False):
+    """
+    缓存指纹。只依赖数据的结果（解析后的食材库、特征矩阵、搭配 bundle 等）用 data_key，只改译名不会让它们失效；
+    含译名的输出传 localized=True，用完整的版本键。传入字符串时原样使用
+    """
+    if isinstance(version, DatasetVersion):
+        return version.key if localized else version.data_key
+    return str(version)
+
+
+class DiskCache:
+    """SQLite 内容寻址缓存：(namespace, key, fingerprint) → pickle 后的值"""
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "analysis.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        with self._lock:
+            self._sync_total_locked()
+
+    def get(self, namespace, key, fingerprint, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE namespace=? AND key=? AND fingerprint=?",
+                (namespace, str(key), fingerprint)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self._conn.execute(
+                "UPDATE entries SET last_access=? WHERE namespace=? AND key=? AND fingerprint=?",
+                (time.time(), namespace, str(key), fingerprint))
+            self.hits += 1
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            # 反序列化失败（例如类定义变了）按未命中处理
+            self.delete(namespace, key, fingerprint)
+            return default
+
+    def put(self, namespace, key, fingerprint, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return False
+        now = time.time()
+        with self._lock:
+            old = self._size_locked(namespace, key, fingerprint)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, str(key), fingerprint, sqlite3.Binary(blob), len(blob), now, now))
+            self._total += len(blob) - old
+            self._evict_locked()
+        return True
+
+    def get_or_compute(self, namespace, key, fingerprint, compute):
+        missing = object()
+        value = self.get(namespace, key, fingerprint, missing)
+        if value is missing:
+            value = compute()
+            if value is not None:
+                self.put(namespace, key, fingerprint, value)
+        return value
+
+    def delete(self, namespace, key, fingerprint):
+        with self._lock:
+            self._total -= self._size_locked(namespace, key, fingerprint)
+            self._conn.execute(
+                "DELETE FROM entries WHERE namespace=? AND key=? AND fingerprint=?",
+                (namespace, str(key), fingerprint))
+
+    def total_bytes(self):
+        with self._lock:
+            return self._sync_total_locked()
+
+    def _size_locked(self, namespace, key, fingerprint):
+        """单条记录的字节数（走主键索引）；不存在时为 0"""
+        row = self._conn.execute(
+            "SELECT size FROM entries WHERE namespace=? AND key=? AND fingerprint=?",
+            (namespace, str(key), fingerprint)).fetchone()
+        return row[0] if row else 0
+
+    def _sync_total_locked(self):
+        """全表核对总字节数（只在初始化、超限、清理和定期核对时做）"""
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._synced = time.time()
+        return self._total
+
+    def _evict_locked(self):
+        # 平时只看进程内累计的总数；超限或到了核对时间才扫全表（其他进程的写入 / 淘汰在这时计入）
+        if self._total <= self.max_bytes and time.time() - self._synced < TOTAL_RESYNC_S:
+            return
+        total = self._sync_total_locked()
+        if total <= self.max_bytes:
+            return
+        # 淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for ns, k, fp, size in self._conn.execute(
+                "SELECT namespace, key, fingerprint, size FROM entries ORDER BY last_access"):
+            victims.append((ns, k, fp))
+            freed += size
+            if total - freed <= target:
+                break
+        self._conn.executemany(
+            "DELETE FROM entries WHERE namespace=? AND key=? AND fingerprint=?", victims)
+        self._total = total - freed
+
+    def evict_stale(self, keep, grace=STALE_GRACE_S):
+        """
+        清除不属于 keep（仍在使用的缓存指纹）的条目；宽限期内被访问过的暂不清除。返回清除的条目数
+        """
+        keep = [str(k) for k in keep]
+        cutoff = time.time() - grace
+        marks = ",".join("?" * len(keep)) or "NULL"
+        with self._lock:
+            cur = self._conn.execute(
+                f"DELETE FROM entries WHERE fingerprint NOT IN ({marks}) AND last_access < ?",
+                (*keep, cutoff))
+            self._sync_total_locked()
+            return cur.rowcount
+
+    def versions(self):
+        """缓存清单：每个版本键下有哪些命名空间、多少条目、占多少字节"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fingerprint, namespace, COUNT(*), SUM(size), MAX(last_access) "
+                "FROM entries GROUP BY fingerprint, namespace").fetchall()
+        out = {}
+        for fp, ns, n, size, last in rows:
+            v = out.setdefault(fp, {"fingerprint": fp, "namespaces": {}, "entries": 0, "bytes": 0,
+                                    "last_access": 0.0})
+            v["namespaces"][ns] = n
+            v["entries"] += n
+            v["bytes"] += size
+            v["last_access"] = max(v["last_access"], last)
+        return sorted(out.values(), key=lambda v: -v["last_access"])
+
+    def stats(self):
+        with self._lock:
+            n, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            self._total, self._synced = size, time.time()
+        return {"entries": n, "bytes": size, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,2899 @@
+"""
+味觉虫洞 Flavor Lab - 风味计算引擎
+
+不依赖 Streamlit 的纯算法层：数据解析、分子共鸣指数、雷达维度、介质极性、
+桥接/对比推荐，以及跨会话共享的搭配分析缓存。
+app.py 与离线脚本（压测、预计算）共用这里的实现。
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import time
+import zipfile
+from collections import OrderedDict, namedtuple
+from itertools import chain
+from math import sqrt
+from types import MappingProxyType
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有文件锁，多个进程可能各自生成一次，靠目录原子改名保证完整
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+ENGINE_VERSION = "3.1"
+
+# ================================================================
+# 1. 数据加载
+# ================================================================
+# 风味标签规范化：分隔符统一 + 去掉 "-like" 后缀 + 固定的词形 / 同义词表。
+# 表是人工审定后写死的（不随数据集推断），同一个原始标签在任何数据版本里都映射到同一个规范名。
+# 默认关闭以保持现有分数；FLAVOR_LAB_CANONICAL_NOTES=1 或 read_catalog(canonical=True) 开启。
+CANON_VERSION = "2"
+CANONICAL_NOTES = os.getenv("FLAVOR_LAB_CANONICAL_NOTES", "0") == "1"
+NOTE_SYNONYMS = {
+    # 形容词 → 名词
+    "acidic": "acid", "alcoholic": "alcohol", "aniseed": "anise", "anisic": "anise",
+    "balsamic": "balsam", "beany": "bean", "beefy": "beef", "bready": "bread", "buttery": "butter",
+    "camphoraceous": "camphor", "camphoreous": "camphor", "caramellic": "caramel", "catty": "cat",
+    "cheesy": "cheese", "cooling": "cool", "coumarinic": "coumarin", "creamy": "cream",
+    "dusty": "dust", "earthy": "earth", "estery": "ester", "ethereal": "ether", "fatty": "fat",
+    "fishy": "fish", "floral": "flower", "fruity": "fruit", "grassy": "grass", "herbaceous": "herb",
+    "herbal": "herb", "jammy": "jam", "leafy": "leaf", "leathery": "leather", "leaves": "leaf",
+    "malty": "malt", "meaty": "meat", "medical": "medicine", "medicinal": "medicine", "mentholic": "menthol",
+    "metallic": "metal", "milky": "milk", "minty": "mint", "moldy": "mold", "mouldy": "mold",
+    "mossy": "moss", "musky": "musk", "nutty": "nut", "oily": "oil", "painty": "paint",
+    "peppery": "pepper", "phenolic": "phenol", "resinous": "resin", "roasted": "roast",
+    "rooty": "root", "rosy": "rose", "rubbery": "rubber", "rummy": "rum", "smoked": "smoke",
+    "smoky": "smoke", "soapy": "soap", "spicy": "spice", "sulfurous": "sulfur", "sulfury": "sulfur",
+    "sweaty": "sweat", "tarry": "tar", "terpenic": "terpene", "waxy": "wax", "winey": "wine",
+    "vinous": "wine", "woody": "wood", "yeasty": "yeast", "ammoniacal": "ammonia",
+    # 复数 / 拼写变体 / 同物异名
+    "roasted nuts": "roasted nut", "clean clothes": "clean cloth", "black currant": "blackcurrant",
+    "moth ball": "mothball", "jasmin": "jasmine", "hawthorne": "hawthorn", "camomile": "chamomile",
+    "cedarwood": "cedar", "cuminseed": "cumin", "orange flower": "orange blossom",
+    "wine lee": "wine", "tropica": "tropical", "terpentine": "turpentine",
+}
+
+def canonical_note(note):
+    """单个风味标签的规范名（小写、'_'/'-' 视作空格、去掉 like 后缀、查同义词表）"""
+    n = re.sub(r"[_\-]+", " ", note.strip().lower())
+    n = re.sub(r"\s+", " ", n).strip()
+    n = re.sub(r" like$", "", n)
+    return NOTE_SYNONYMS.get(n, n)
+
+def note_key(note):
+    """标签的稳定编号（名称的 63 位哈希）：与词表顺序无关，跨数据版本不变"""
+    return int.from_bytes(hashlib.blake2b(note.encode("utf-8"), digest_size=8).digest(), "big") >> 1
+
+def _parse_fp(s, canonical=False):
+    if not s or str(s).strip() in ("", "nan"): return set()
+    notes = (x.strip().lower() for x in str(s).split(",") if x.strip())
+    return set(canonical_note(x) for x in notes) if canonical else set(notes)
+
+def _parse_fl(s, canonical=False):
+    if not s or str(s).strip() in ("", "nan"): return set()
+    notes = (x.strip().lower() for x in re.split(r"[@,]+", str(s)) if x.strip())
+    return set(canonical_note(x) for x in notes) if canonical else set(notes)
+
+def read_catalog(path, canonical=None):
+    """读取食材库 CSV，解析风味标签为 mol_set，丢弃无风味数据的行；canonical=None 时跟随全局开关"""
+    if not os.path.exists(path): return None
+    canonical = CANONICAL_NOTES if canonical is None else canonical
+    df = pd.read_csv(path)
+    df["flavor_profiles"] = df["flavor_profiles"].fillna("")
+    df["mol_set"] = df.apply(lambda r: _parse_fp(r["flavor_profiles"], canonical)
+                             | _parse_fl(r.get("flavors", ""), canonical), axis=1)
+    df["mol_count"] = df["mol_set"].apply(len)
+    out = df[df["mol_count"] > 0].copy()
+    out.attrs["canonical"] = canonical
+    return out
+
+CATALOG_CHUNK = 5_000
+
+def _chunk_notes(col, at_sep):
+    """
+    一列风味文本 → (行内下标, 原始片段)，片段可能带空白或为空串，由调用方去重后再 strip / 丢弃。
+    切分结果与 _parse_fp（逗号）/ _parse_fl（@ 与逗号，at_sep=True）一致。
+    """
+    vals = col.fillna("").astype(str).tolist()
+    if at_sep:
+        lists = [v.lower().replace("@", ",").split(",") if v.strip() not in ("", "nan") else [] for v in vals]
+    else:
+        lists = [v.lower().split(",") if v.strip() not in ("", "nan") else [] for v in vals]
+    pos = np.repeat(np.arange(len(vals)), [len(x) for x in lists])
+    return pos, list(chain.from_iterable(lists))
+
+def stream_catalog(path, chunksize=CATALOG_CHUNK, canonical=None, progress=None):
+    """
+    分块流式读取食材库（.gz 直接读）：每块解析完就把标签编码进全局词表与 CSR，随读随丢无风味数据的行，
+    不为每行建 Python set；峰值内存 ≈ 一个分块 + 已编码的整数数组，与文件大小无关。
+    结果与 build_incidence(read_catalog(path)["mol_set"]) 逐位一致（词表按字母序，行内标签升序）。
+    progress(stats) 每块回调一次。
+    返回 {"ids", "names", "categories", "vocab", "indptr", "indices", "stats"}
+    """
+    if not os.path.exists(path): return None
+    canonical = CANONICAL_NOTES if canonical is None else canonical
+    t0 = time.perf_counter()
+    note_id, canon = {}, {}
+    ids, names, cats, counts, parts = [], [], [], [], []
+    rows_read = 0
+    stats = {}
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        n = len(chunk)
+        p1, t1 = _chunk_notes(chunk["flavor_profiles"], False)
+        if "flavors" in chunk:
+            p2, t2 = _chunk_notes(chunk["flavors"], True)
+            p1, t1 = np.concatenate([p1, p2]), t1 + t2
+        # 先对本块去重后的原始片段 strip + 查表（规范化 + 编号），再按编码展开；空串编号为 -1 丢弃
+        codes, uniq = pd.factorize(np.array(t1, dtype=object))
+        uniq = [u.strip() for u in uniq]
+        if canonical:
+            uniq = [canon.setdefault(u, canonical_note(u)) if u else u for u in uniq]
+        lut = np.array([note_id.setdefault(u, len(note_id)) if u else -1 for u in uniq] + [-1], dtype=np.int64)
+        gid = lut[codes]
+        p1, gid = p1[gid >= 0], gid[gid >= 0]
+        # (行, 标签) 编成一个 int64 去重：同一行 fp 与 flavors 里重复的标签只算一次
+        pairs = np.unique((p1.astype(np.int64) << 32) | gid)
+        rows, gid = pairs >> 32, (pairs & 0xFFFFFFFF).astype(np.int32)
+        cnt = np.bincount(rows, minlength=n)
+        kept = cnt > 0
+        ids.append(chunk["id"].to_numpy()[kept])
+        names.extend(chunk["name"].to_numpy()[kept].tolist())
+        cats.extend(chunk["category"].astype(str).to_numpy()[kept].tolist())
+        counts.append(cnt[kept])
+        parts.append(gid)
+        rows_read += n
+        el = time.perf_counter() - t0
+        stats = {"rows_read": rows_read, "rows_kept": len(names), "rows_dropped": rows_read - len(names),
+                 "nnz": int(sum(len(x) for x in parts)), "vocab": len(note_id),
+                 "elapsed_s": round(el, 3), "rows_per_s": round(rows_read / max(el, 1e-9))}
+        if progress is not None:
+            progress(stats)
+
+    # 词表改为字母序，与 build_incidence 一致：旧编号 → 新编号后行内重新排序
+    first_seen = list(note_id)
+    order = sorted(range(len(first_seen)), key=first_seen.__getitem__)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    # 逐块重排（临时数组只有一个分块大小），直接写进预先分配好的 indices
+    indptr = np.zeros(sum(len(c) for c in counts) + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(counts) if counts else [], out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    at = 0
+    while parts:
+        cnt, gid = counts.pop(0), parts.pop(0)
+        rows = np.repeat(np.arange(len(cnt), dtype=np.int64), cnt)
+        indices[at:at + len(gid)] = np.sort((rows << 32) | rank[gid]) & 0xFFFFFFFF
+        at += len(gid)
+    stats["elapsed_s"] = round(time.perf_counter() - t0, 3)
+    stats["rows_per_s"] = round(rows_read / max(stats["elapsed_s"], 1e-9)) if rows_read else 0
+    return {
+        "ids": np.concatenate(ids).astype(np.int64) if ids else np.zeros(0, dtype=np.int64),
+        "names": names, "categories": cats, "vocab": [first_seen[j] for j in order],
+        "indptr": indptr, "indices": indices, "stats": stats,
+    }
+
+def canonical_report(raw_sets, canon_sets, max_rows=2000, seed=0):
+    """
+    规范化前后对比：词表与每个食材标签数的收缩，共鸣指数的变化，以及雷达 / 极性特征的命中数
+    （食材数超过 max_rows 时随机抽样计算）。feature_regressions 列出规范化后命中变少的特征。
+    """
+    raw_sets, canon_sets = list(raw_sets), list(canon_sets)
+    vocab_raw = set().union(*raw_sets) if raw_sets else set()
+    vocab_canon = set().union(*canon_sets) if canon_sets else set()
+    merged = {}
+    for n in vocab_raw:
+        merged.setdefault(canonical_note(n), []).append(n)
+    merges = sorted(((c, sorted(v)) for c, v in merged.items() if len(v) > 1),
+                    key=lambda cv: (-len(cv[1]), cv[0]))
+    size_raw = np.array([len(x) for x in raw_sets], dtype=np.float64)
+    size_canon = np.array([len(x) for x in canon_sets], dtype=np.float64)
+
+    rows = np.arange(len(raw_sets))
+    if len(rows) > max_rows:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, max_rows, replace=False))
+    scores = []
+    for sets in (raw_sets, canon_sets):
+        vocab, indptr, indices = build_incidence([sets[i] for i in rows])
+        X = dense_rows(indptr, indices, len(vocab))
+        sz = np.diff(indptr).astype(np.float64)
+        scores.append(sim_scores(X @ X.T, sz[:, None], sz[None, :]).astype(np.int16))
+    iu = np.triu_indices(len(rows), 1)
+    before, after = scores[0][iu], scores[1][iu]
+    band = lambda x: np.digitize(x, [42, 65])
+    # 特征命中：每个雷达维度 / 极性方向有命中的食材数。关键词表与标签模式一致时，
+    # 原始标签命中的关键词规范化后仍在规范表里，规范化后的命中数不应少于原始
+    hits = []
+    for sets, canonical in ((raw_sets, False), (canon_sets, True)):
+        f = feature_matrices(pd.DataFrame({"name": [str(i) for i in rows],
+                                           "mol_set": [sets[i] for i in rows]}), canonical)
+        hits.append(dict(zip(f["dims"] + ["脂溶", "水溶"],
+                             np.concatenate([(f["radar"] > 0).sum(axis=0),
+                                             (f["polarity"] > 0).sum(axis=0)]).tolist())))
+    return {
+        "vocab_before": len(vocab_raw), "vocab_after": len(vocab_canon),
+        "nnz_before": int(size_raw.sum()), "nnz_after": int(size_canon.sum()),
+        "mean_size_before": float(size_raw.mean()) if len(size_raw) else 0.0,
+        "mean_size_after": float(size_canon.mean()) if len(size_canon) else 0.0,
+        "pairs": int(len(before)),
+        "mean_score_delta": float((after - before).mean()) if len(before) else 0.0,
+        "changed_pairs": float((after != before).mean()) if len(before) else 0.0,
+        "changed_type": float((band(after) != band(before)).mean()) if len(before) else 0.0,
+        "feature_hits_before": hits[0], "feature_hits_after": hits[1],
+        "feature_regressions": [k for k in hits[0] if hits[1][k] < hits[0][k]],
+        "merges": merges,
+    }
+
+def file_hash(*paths):
+    """按文件内容计算数据版本指纹（缺失文件按空内容计）"""
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8"))
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()[:16]
+
+# ================================================================
+# 2. 算法引擎
+# ================================================================
+POLARITY = {
+    "fat":"L","fatty":"L","oil":"L","oily":"L","waxy":"L","buttery":"L",
+    "butter":"L","cream":"L","creamy":"L","resin":"L","woody":"L",
+    "leather":"L","smoky":"L","smoke":"L",
+    "sweet":"H","sour":"H","acid":"H","citrus":"H","fruity":"H",
+    "floral":"H","honey":"H","alcoholic":"H","wine":"H","vinegar":"H",
+    "fresh":"H","green":"H","sugar":"H",
+}
+# 规范化模式下标签已改写成规范名（fatty → fat），查表也要用规范名；同义的键合并后极性不变
+POLARITY_CANON = {canonical_note(k): v for k, v in POLARITY.items()}
+
+def polarity_table(canonical=None):
+    """与标签模式匹配的极性表；canonical=None 时跟随全局开关"""
+    return POLARITY_CANON if (CANONICAL_NOTES if canonical is None else canonical) else POLARITY
+
+def calc_sim(a, b):
+    """分子共鸣指数 v3"""
+    if not a or not b:
+        return {"score": 0, "jaccard": 0, "shared": [], "only_a": [], "only_b": [], "type": "contrast",
+                "detail": {"shared_count": 0, "only_a_count": 0, "only_b_count": 0}}
+
+    inter = a & b
+    union = a | b
+    only_a = a - b
+    only_b = b - a
+
+    j = len(inter) / len(union) if union else 0
+    cov_a = len(inter) / max(len(a), 1)
+    cov_b = len(inter) / max(len(b), 1)
+    bi_cov = min(cov_a, cov_b)
+
+    raw = (j ** 0.6) * 0.65 + (bi_cov ** 0.4) * 0.35
+    score = int(round(18 + raw * 79))
+    score = max(18, min(97, score))
+
+    if score >= 65:
+        typ = "resonance"
+    elif score >= 42:
+        typ = "neutral"
+    else:
+        typ = "contrast"
+
+    return {
+        "score": score,
+        "jaccard": j,
+        "shared": sorted(inter),
+        "only_a": sorted(only_a),
+        "only_b": sorted(only_b),
+        "type": typ,
+        "detail": {
+            "shared_count": len(inter),
+            "only_a_count": len(only_a),
+            "only_b_count": len(only_b),
+            "coverage_a": round(cov_a * 100),
+            "coverage_b": round(cov_b * 100),
+        }
+    }
+
+def polarity_analysis(mol_set, canonical=None):
+    table = polarity_table(canonical)
+    lipo = sum(1 for m in mol_set if table.get(m) == "L")
+    hydro = sum(1 for m in mol_set if table.get(m) == "H")
+    total = lipo + hydro
+    if total == 0: return {"type": "balanced", "lipo": 0, "hydro": 0, "total": 0}
+    t2 = "lipophilic" if lipo > hydro else ("hydrophilic" if hydro > lipo else "balanced")
+    return {"type": t2, "lipo": lipo, "hydro": hydro, "total": total}
+
+def find_bridges(df, set_a, set_b, selected, top_n=4):
+    results = []
+    for _, row in df.iterrows():
+        if row["name"] in selected: continue
+        s = row["mol_set"]
+        sa = len(s & set_a) / max(len(set_a), 1)
+        sb = len(s & set_b) / max(len(set_b), 1)
+        raw_score = sqrt(sa * sb) * (1 + min(sa, sb))
+        if raw_score > 0.04:
+            results.append((row["name"], raw_score, sa, sb))
+    results.sort(key=lambda x: -x[1])
+    top = results[:top_n]
+    if not top: return []
+    max_score = top[0][1]
+    return [(name, score/max_score, sa, sb) for name, score, sa, sb in top]
+
+def bridges_from_candidates(names, mol_sets, cand, theta, set_a, set_b, selected, top_n=4):
+    """
+    用预计算的桥接候选（precompute 的 bridges.npz：两种食材各自按覆盖率取的 Top-K）求 find_bridges 的结果。
+    不在两张候选表里的食材，对两侧的覆盖率分别不超过各表第 K 名 θa、θb，桥接分数不超过
+    sqrt(θa·θb)·(1 + min(θa, θb))。候选中第 top_n 名严格高于这个上界（候选不足 top_n 个时上界够不到门槛）
+    才与全表扫描一致；否则返回 None，由调用方退回 find_bridges。
+    cand 为候选行号，names / mol_sets 按行号排列
+    """
+    ta, tb = theta
+    bound = sqrt(ta * tb) * (1 + min(ta, tb))
+    results = []
+    for i in sorted(set(int(c) for c in cand)):   # 按行号遍历，同分时与 find_bridges 的顺序一致
+        if names[i] in selected: continue
+        s = mol_sets[i]
+        sa = len(s & set_a) / max(len(set_a), 1)
+        sb = len(s & set_b) / max(len(set_b), 1)
+        raw_score = sqrt(sa * sb) * (1 + min(sa, sb))
+        if raw_score > 0.04:
+            results.append((names[i], raw_score, sa, sb))
+    results.sort(key=lambda x: -x[1])
+    top = results[:top_n]
+    if (top[-1][1] if len(top) == top_n else 0.04) <= bound:
+        return None
+    if not top: return []
+    max_score = top[0][1]
+    return [(name, score/max_score, sa, sb) for name, score, sa, sb in top]
+
+def find_contrasts(df, set_a, set_b, selected, top_n=4):
+    results = []
+    for _, row in df.iterrows():
+        if row["name"] in selected: continue
+        s = row["mol_set"]
+        diff_a = len(s - set_a) / max(len(s), 1)
+        diff_b = len(s - set_b) / max(len(s), 1)
+        cs = (diff_a + diff_b) / 2
+        if cs > 0.3:
+            results.append((row["name"], cs, diff_a, diff_b))
+    results.sort(key=lambda x: -x[1])
+    top = results[:top_n]
+    if not top: return []
+    max_score = top[0][1]
+    return [(name, score/max_score, da, db) for name, score, da, db in top]
+
+# ================================================================
+# 2b. 向量化评分（离线预计算 / 批量分析用）
+# ================================================================
+def build_incidence(mol_sets, vocab=None):
+    """
+    食材 × 风味标签的 CSR 关联结构。
+    返回 (vocab, indptr, indices)：第 i 个食材的标签 id 为 indices[indptr[i]:indptr[i+1]]
+    """
+    mol_sets = list(mol_sets)
+    if vocab is None:
+        vocab = sorted(set().union(*mol_sets)) if mol_sets else []
+    note_id = {n: i for i, n in enumerate(vocab)}
+    indptr = np.zeros(len(mol_sets) + 1, dtype=np.int64)
+    chunks = []
+    for i, s in enumerate(mol_sets):
+        ids = sorted(note_id[n] for n in s if n in note_id)
+        chunks.append(np.asarray(ids, dtype=np.int32))
+        indptr[i + 1] = indptr[i] + len(ids)
+    indices = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    return vocab, indptr, indices
+
+def dense_rows(indptr, indices, n_notes, rows=None, dtype=np.float32):
+    """把 CSR 中的若干行展开为稠密 0/1 矩阵（rows=None 表示全部）"""
+    if rows is None:
+        rows = np.arange(len(indptr) - 1)
+    rows = np.asarray(rows)
+    out = np.zeros((len(rows), n_notes), dtype=dtype)
+    for k, r in enumerate(rows):
+        out[k, indices[indptr[r]:indptr[r + 1]]] = 1
+    return out
+
+def sim_scores(inter, size_a, size_b):
+    """
+    calc_sim 分数的向量化版本（结果与逐对调用 calc_sim 完全一致）。
+    inter: 交集大小矩阵；size_a / size_b: 可广播的集合大小
+    """
+    inter = np.asarray(inter, dtype=np.float64)
+    na = np.asarray(size_a, dtype=np.float64)
+    nb = np.asarray(size_b, dtype=np.float64)
+    union = na + nb - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        j = np.where(union > 0, inter / union, 0.0)
+        bi_cov = np.minimum(inter / np.maximum(na, 1), inter / np.maximum(nb, 1))
+    raw = (j ** 0.6) * 0.65 + (bi_cov ** 0.4) * 0.35
+    score = np.clip(np.rint(18 + raw * 79), 18, 97)
+    score = np.where((na == 0) | (nb == 0), 0, score)
+    return score.astype(np.uint8)
+
+def topk_neighbors(indptr, indices, n_notes, k, block=1024):
+    """
+    每个食材共鸣指数最高的 k 个邻居（不含自身，同分按下标升序），分块计算。
+    返回 (idx int32 n×k, score uint8 n×k)，与 precompute.py 的 neighbors.npz 一致。
+    """
+    X = dense_rows(indptr, indices, n_notes)
+    sizes = np.diff(indptr).astype(np.float64)
+    n = X.shape[0]
+    k = min(k, max(n - 1, 0))
+    idx = np.zeros((n, k), dtype=np.int32)
+    score = np.zeros((n, k), dtype=np.uint8)
+    if k == 0:
+        return idx, score
+    for s in range(0, n, block):
+        e = min(s + block, n)
+        sc = sim_scores(X[s:e] @ X.T, sizes[s:e, None], sizes[None, :])
+        key = sc.astype(np.float64) * (n + 1) - np.arange(n)[None, :]
+        key[np.arange(e - s), np.arange(s, e)] = -np.inf
+        part = np.argpartition(-key, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(key, part, axis=1), axis=1, kind="stable")
+        idx[s:e] = np.take_along_axis(part, order, axis=1)
+        score[s:e] = np.take_along_axis(sc, idx[s:e], axis=1)
+    return idx, score
+
+# ================================================================
+# 3. 雷达维度
+# ================================================================
+RADAR_DIMS_V2 = {
+    "甜感": {
+        "primary":   ["sweet","caramel","honey","vanilla","sugar"],
+        "secondary": ["butterscotch","candy","molasses","toffee","syrup","saccharine"],
+    },
+    "烘烤": {
+        "primary":   ["roasted","baked","toasted","malt","smoky"],
+        "secondary": ["coffee","cocoa","bread","charred","burnt","caramelized"],
+    },
+    "果香": {
+        "primary":   ["fruity","berry","citrus","tropical","apple"],
+        "secondary": ["pear","peach","grape","banana","cherry","lemon","melon","plum"],
+    },
+    "草木": {
+        "primary":   ["herbaceous","herbal","green","fresh","leafy"],
+        "secondary": ["mint","thyme","rosemary","basil","dill","grassy","vegetal"],
+    },
+    "木质": {
+        "primary":   ["woody","earthy","mushroom","tobacco"],
+        "secondary": ["cedar","oak","resin","leather","pine","soil","fungal"],
+    },
+    "辛香": {
+        "primary":   ["spicy","pepper","pungent","hot"],
+        "secondary": ["cinnamon","ginger","clove","mustard","horseradish","anise","nutmeg","cardamom"],
+    },
+    "花香": {
+        "primary":   ["floral","rose","jasmine","lavender"],
+        "secondary": ["violet","lily","blossom","geranium","perfumy","fragrant"],
+    },
+    "醇厚": {
+        "primary":   ["fatty","creamy","buttery","nutty"],
+        "secondary": ["butter","cream","dairy","milky","waxy","oily","rich","lactonic"],
+    },
+}
+
+RADAR_DIMS = {k: v["primary"] + v["secondary"] for k, v in RADAR_DIMS_V2.items()}
+
+def _canonical_dims(dims):
+    """关键词换成规范名并去重（herbaceous / herbal → herb 只算一次；已在主关键词里的不再计入次关键词）"""
+    out = {}
+    for dim, cfg in dims.items():
+        primary = list(dict.fromkeys(canonical_note(k) for k in cfg["primary"]))
+        secondary = [k for k in dict.fromkeys(canonical_note(k) for k in cfg["secondary"]) if k not in primary]
+        out[dim] = {"primary": primary, "secondary": secondary}
+    return out
+
+RADAR_DIMS_V2_CANON = _canonical_dims(RADAR_DIMS_V2)
+
+def radar_table(canonical=None):
+    """与标签模式匹配的雷达关键词表；canonical=None 时跟随全局开关"""
+    return RADAR_DIMS_V2_CANON if (CANONICAL_NOTES if canonical is None else canonical) else RADAR_DIMS_V2
+
+def radar_vals(mol_set, canonical=None):
+    """雷达图算法 v4"""
+    result = {}
+    for dim, cfg in radar_table(canonical).items():
+        primary_kws = cfg["primary"]
+        secondary_kws = cfg["secondary"]
+
+        primary_hits = sum(1 for k in primary_kws if k in mol_set)
+        secondary_hits = sum(1 for k in secondary_kws if k in mol_set)
+
+        if primary_hits == 0:
+            val = 0.0
+        else:
+            val = min(10.0, primary_hits * 3.0 + secondary_hits * 1.0)
+
+        result[dim] = round(val, 1)
+    return result
+
+def feature_matrices(df, canonical=None):
+    """
+    逐食材特征矩阵（行顺序与 df 一致）：
+      radar    n × 8  未缩放雷达值（RADAR_DIMS 顺序）
+      polarity n × 2  [脂溶标签数, 水溶标签数]
+    canonical=None 时按 df 的标签模式（read_catalog / catalog_frame 记在 df.attrs 里）选关键词表。
+    """
+    canonical = df.attrs.get("canonical", CANONICAL_NOTES) if canonical is None else canonical
+    table = polarity_table(canonical)
+    dims = list(RADAR_DIMS.keys())
+    names = df["name"].tolist()
+    radar = np.zeros((len(names), len(dims)), dtype=np.float32)
+    polarity = np.zeros((len(names), 2), dtype=np.int32)
+    for i, s in enumerate(df["mol_set"]):
+        rv = radar_vals(s, canonical)
+        radar[i] = [rv[d] for d in dims]
+        polarity[i, 0] = sum(1 for m in s if table.get(m) == "L")
+        polarity[i, 1] = sum(1 for m in s if table.get(m) == "H")
+    return {"names": names, "dims": dims, "radar": radar, "polarity": polarity}
+
+def radar_scaled(vals, ratio, n):
+    """按配方比例缩放雷达值（与雷达图一致：0.5 + ratio*0.5*n，封顶 10）"""
+    scale = 0.5 + ratio * 0.5 * n
+    return [min(10, v * scale) for v in vals]
+
+# ================================================================
+# 3b. 比例求解（按目标雷达轮廓反推配方比例）
+# ================================================================
+# 组合轮廓 = 各食材缩放后雷达值的平均：P = mean_i min(10, v_i · (0.5 + r_i·0.5·n))
+# 未封顶时 P = 0.5·mean(v) + 0.5·Σ r_i·v_i，对 r 是线性的，在单纯形上做投影梯度即可。
+
+def blend_profile(V, ratios, mask=None):
+    """
+    V: (B, n, D) 未缩放雷达值；ratios: (B, n)；mask: (B, n) 有效食材。
+    返回 (B, D) 组合轮廓（与雷达图相同的缩放与封顶）。
+    """
+    V = np.asarray(V, dtype=np.float64)
+    ratios = np.asarray(ratios, dtype=np.float64)
+    if mask is None:
+        mask = np.ones(ratios.shape, dtype=bool)
+    n = mask.sum(axis=1, keepdims=True).astype(np.float64)
+    scale = 0.5 + ratios * 0.5 * n
+    scaled = np.minimum(10.0, V * scale[:, :, None]) * mask[:, :, None]
+    return scaled.sum(axis=1) / np.maximum(n, 1)
+
+def project_simplex(x, mask, lo=0.0):
+    """逐行投影到 {r ≥ lo, Σr = 1}（只在 mask 内），排序法，完全向量化"""
+    n = mask.sum(axis=1, keepdims=True)
+    budget = 1.0 - lo * n                       # 扣除下限后剩余可分配的比例
+    y = np.where(mask, x - lo, -np.inf)
+    u = -np.sort(-y, axis=1)
+    u_fin = np.where(np.isfinite(u), u, 0.0)
+    css = np.cumsum(u_fin, axis=1) - budget
+    k = np.arange(1, x.shape[1] + 1)[None, :]
+    cond = (u - css / k > 0) & np.isfinite(u)
+    rho = np.maximum(cond.sum(axis=1, keepdims=True), 1)
+    theta = np.take_along_axis(css, rho - 1, axis=1) / rho
+    return np.where(mask, np.maximum(y - theta, 0.0) + lo, 0.0)
+
+def _pg_solve(Vm, T, mask, r, step, iters, lo, tol):
+    """FISTA 主循环；已收敛的行不再参与计算（批量时大部分行几十步内就收敛）"""
+    n = mask.sum(axis=1).astype(np.float64)
+    r = r.copy()
+    z, t = r.copy(), np.ones(len(r))
+    live = np.arange(len(r))
+    used = 0
+    for used in range(1, iters + 1):
+        Vl, zl, nl = Vm[live], z[live], n[live]
+        raw = Vl * (0.5 + zl * 0.5 * nl[:, None])[:, :, None]
+        resid = np.minimum(10.0, raw).sum(axis=1) / np.maximum(nl, 1)[:, None] - T[live]
+        active = (raw < 10.0) & mask[live][:, :, None]     # 封顶的维度对比例不敏感
+        grad = (Vl * active * resid[:, None, :]).sum(axis=2)
+        r_new = project_simplex(zl - step[live] * grad, mask[live], lo)
+        tl = t[live]
+        t_new = (1 + np.sqrt(1 + 4 * tl * tl)) / 2
+        delta = np.abs(r_new - r[live]).max(axis=1)
+        z[live] = r_new + ((tl - 1) / t_new)[:, None] * (r_new - r[live])
+        r[live], t[live] = r_new, t_new
+        live = live[delta >= tol]
+        if not len(live):
+            break
+    return r, used
+
+def optimize_ratios(V, target, mask=None, iters=200, lo=0.0, tol=1e-6):
+    """
+    批量求解配方比例，使组合轮廓最接近目标轮廓（最小二乘，比例在单纯形内）。
+      V       (B, n, D) 或 (n, D)  各组候选食材的未缩放雷达值（不足 n 种的组用 mask 补齐）
+      target  (D,) 或 (B, D)      目标轮廓（0-10）
+      lo      每种食材的最低比例
+    加速投影梯度（FISTA），步长 1/L。封顶（10 分）让问题非凸且有平台，
+    所以从均分点和每种食材占优的 n 个点同时出发（一并向量化），取误差最小的解。
+    返回 {"ratios": (B, n), "profile": (B, D), "rmse": (B,), "iters": 实际迭代次数}
+    """
+    V = np.asarray(V, dtype=np.float64)
+    single = V.ndim == 2
+    if single:
+        V = V[None]
+    B, n_max, D = V.shape
+    mask = np.ones((B, n_max), dtype=bool) if mask is None else np.asarray(mask, dtype=bool).reshape(B, n_max)
+    T = np.broadcast_to(np.asarray(target, dtype=np.float64), (B, D))
+    lo = min(lo, 1.0 / max(n_max, 1))
+
+    Vm = V * mask[:, :, None]
+    # 未封顶时 ∂P/∂r_i = 0.5·v_i，损失 ‖P-T‖² 的梯度 Lipschitz 常数 = 2·λmax(0.25·V·Vᵀ)
+    gram = 0.25 * np.einsum("bid,bjd->bij", Vm, Vm)
+    L = 2.0 * np.linalg.eigvalsh(gram)[:, -1] + 1e-9
+
+    # 起点：均分 + 每种食材各占 70%
+    S = n_max + 1
+    starts = np.repeat(np.where(mask, 1.0, 0.0)[:, None, :], S, axis=1)
+    starts[:, 1:, :] += np.eye(n_max)[None] * 2.0 * n_max
+    r0 = starts / np.maximum(starts.sum(axis=2, keepdims=True), 1e-12)
+    rep = lambda a: np.repeat(a, S, axis=0)
+    mask_s = rep(mask)
+    r0 = project_simplex(r0.reshape(B * S, n_max), mask_s, lo)
+    r, used = _pg_solve(rep(Vm), rep(T), mask_s, r0, rep((1.0 / L)[:, None]), iters, lo, tol)
+
+    prof = blend_profile(rep(V), r, mask_s)
+    err = ((prof - rep(T)) ** 2).mean(axis=1).reshape(B, S)
+    best = err.argmin(axis=1)
+    pick = np.arange(B) * S + best
+    r, prof = r[pick], prof[pick]
+    rmse = np.sqrt(err[np.arange(B), best])
+    if single:
+        return {"ratios": r[0], "profile": prof[0], "rmse": float(rmse[0]), "iters": used}
+    return {"ratios": r, "profile": prof, "rmse": rmse, "iters": used}
+
+def round_ratios(ratios, step=5):
+    """把比例取整到滑块刻度（百分比，step 的倍数），保持总和为 100"""
+    ratios = np.asarray(ratios, dtype=np.float64)
+    units = 100 // step
+    raw = ratios / max(ratios.sum(), 1e-12) * units
+    base = np.floor(raw).astype(int)
+    for i in np.argsort(-(raw - base), kind="stable")[:units - base.sum()]:
+        base[i] += 1
+    return [int(b * step) for b in base]
+
+# ================================================================
+# 3c. 雷达轮廓近邻（"找味道形状相似的食材"）
+# ================================================================
+KD_TREE_MIN_ROWS = 20000      # 食材数超过该值时改用 KD 树，否则直接整表向量化计算
+KD_LEAF_SIZE = 64
+
+class _KDTree:
+    """只读 KD 树：按最大方差维度取中位数切分，叶子内向量化算距离"""
+
+    def __init__(self, X, leaf_size=KD_LEAF_SIZE):
+        self.X = X
+        self.perm = np.arange(len(X))
+        # 节点：[start, end, 左子, 右子]，以及包围盒 lo / hi
+        self.nodes, self.lo, self.hi = [], [], []
+        stack = [(0, len(X), -1, 0)]
+        while stack:
+            start, end, parent, side = stack.pop()
+            nid = len(self.nodes)
+            pts = X[self.perm[start:end]]
+            self.nodes.append([start, end, -1, -1])
+            self.lo.append(pts.min(axis=0))
+            self.hi.append(pts.max(axis=0))
+            if parent >= 0:
+                self.nodes[parent][2 + side] = nid
+            if end - start <= leaf_size:
+                continue
+            dim = int(np.argmax(pts.var(axis=0)))
+            mid = (end - start) // 2
+            order = np.argsort(pts[:, dim], kind="stable")
+            self.perm[start:end] = self.perm[start:end][order]
+            stack.append((start + mid, end, nid, 1))
+            stack.append((start, start + mid, nid, 0))
+        self.nodes = np.asarray(self.nodes, dtype=np.int64)
+        self.lo, self.hi = np.asarray(self.lo), np.asarray(self.hi)
+
+    def query(self, q, k, valid):
+        import heapq
+        box_d = lambda nid: float(np.sum((q - np.clip(q, self.lo[nid], self.hi[nid])) ** 2))
+        best = []                                   # 最大堆：(-距离², -下标)
+        frontier = [(box_d(0), 0)]
+        while frontier:
+            d, nid = heapq.heappop(frontier)
+            if len(best) == k and d > -best[0][0]:
+                break
+            start, end, left, right = self.nodes[nid]
+            if left < 0:
+                idx = self.perm[start:end]
+                idx = idx[valid[idx]]
+                dist = np.sum((self.X[idx] - q) ** 2, axis=1)
+                for dd, ii in zip(dist.tolist(), idx.tolist()):
+                    item = (-dd, -ii)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                continue
+            for child in (left, right):
+                heapq.heappush(frontier, (box_d(child), child))
+        best.sort(key=lambda x: (-x[0], -x[1]))
+        return [-i for _, i in best], [-d for d, _ in best]
+
+
+class RadarIndex:
+    """
+    食材雷达向量（radar_vals 的 8 维结果）的 k 近邻检索，欧氏距离。
+    三种查询：已有食材 / 按比例混合的一组食材 / 手绘的目标轮廓；
+    可附加布尔 mask（品类、纯素等筛选）。规模超过 KD_TREE_MIN_ROWS 时建 KD 树。
+    """
+
+    def __init__(self, features, tree_threshold=KD_TREE_MIN_ROWS):
+        self.names = list(features["names"])
+        self.dims = list(features["dims"])
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.X = np.asarray(features["radar"], dtype=np.float64)
+        self.tree = _KDTree(self.X) if len(self.X) >= tree_threshold else None
+        self.max_dist = math.sqrt(len(self.dims)) * 10.0
+
+    def profile_of(self, names, ratios=None):
+        """一组食材按比例混合后的轮廓（与雷达图缩放一致）；单个食材即其原始雷达值"""
+        rows = self.X[[self.index[n] for n in names]]
+        if len(names) == 1:
+            return rows[0]
+        r = [(ratios or {}).get(n, 1 / len(names)) for n in names]
+        return blend_profile(rows[None], [r])[0]
+
+    def query(self, profile, k=8, mask=None, exclude=()):
+        q = np.asarray(profile, dtype=np.float64)
+        valid = np.ones(len(self.X), dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+        for n in exclude:
+            if n in self.index:
+                valid[self.index[n]] = False
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return []
+        if self.tree is not None:
+            idx, d2 = self.tree.query(q, k, valid)
+        else:
+            cand = np.flatnonzero(valid)
+            dist = np.sum((self.X[cand] - q) ** 2, axis=1)
+            # 距离相同按行号，与 KD 树一致（雷达向量重复很常见，先 argpartition 会在并列处随机截断）
+            order = np.lexsort((cand, dist))[:k]
+            idx, d2 = cand[order].tolist(), dist[order].tolist()
+        return [{"name": self.names[i], "distance": math.sqrt(d),
+                 "similarity": 1 - math.sqrt(d) / self.max_dist}
+                for i, d in zip(idx, d2)]
+
+    def like_ingredient(self, name, k=8, mask=None):
+        return self.query(self.X[self.index[name]], k, mask, exclude=(name,))
+
+    def like_blend(self, names, ratios=None, k=8, mask=None):
+        return self.query(self.profile_of(names, ratios), k, mask, exclude=names)
+
+# ================================================================
+# 4. 搭配分析缓存（跨会话共享）
+# ================================================================
+class LRUCache:
+    """线程安全的定长 LRU 缓存，Streamlit 多会话共用一个实例"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses}
+
+
+PairBundle = namedtuple("PairBundle", [
+    "key",        # (数据指纹, 排序后的全部食材, 排序后的主搭配对)
+    "pair",       # 主搭配对 (a, b)，按名称排序
+    "sim",        # calc_sim(a, b) 结果（只读）
+    "radar",      # 食材 → 未缩放雷达值元组（RADAR_DIMS 顺序）
+    "polarity",   # polarity_analysis(a ∪ b)
+    "bridges",    # find_bridges 结果
+    "contrasts",  # find_contrasts 结果
+])
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+def oriented_sim(sim, swap):
+    """主搭配对按用户选择顺序返回 calc_sim 视图（a/b 互换时交换独有与覆盖率）"""
+    if not swap:
+        return sim
+    d = dict(sim["detail"])
+    d["only_a_count"], d["only_b_count"] = d.get("only_b_count", 0), d.get("only_a_count", 0)
+    if "coverage_a" in d:
+        d["coverage_a"], d["coverage_b"] = d["coverage_b"], d["coverage_a"]
+    out = dict(sim)
+    out["only_a"], out["only_b"] = sim["only_b"], sim["only_a"]
+    out["detail"] = MappingProxyType(d)
+    return MappingProxyType(out)
+
+def _thaw(obj):
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {k: _thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return tuple(_thaw(v) for v in obj)
+    return obj
+
+def bundle_to_plain(bundle):
+    """PairBundle → 可 pickle 的普通 dict（MappingProxyType 不能直接序列化）"""
+    return _thaw(dict(bundle._asdict()))
+
+def bundle_from_plain(data):
+    return PairBundle(**{k: (v if k == "key" else _freeze(v)) for k, v in data.items()})
+
+def _oriented_pairs(items, swap):
+    """桥接/对比结果 (name, score, 对 a, 对 b)：a/b 互换时交换后两项"""
+    if not swap:
+        return items
+    return tuple((name, sc, vb, va) for name, sc, va, vb in items)
+
+
+class PairAnalysisService:
+    """
+    搭配分析服务：同一数据版本下，同一组食材的分析结果是确定的，
+    计算一次后生成只读 PairBundle，由所有会话共享；比例相关的部分（雷达缩放）
+    在 bundle 之上即时计算，滑块拖动不再触发重算。
+    """
+
+    def __init__(self, df, data_hash, maxsize=256, features=None, disk=None, fingerprint=None,
+                 bridges=None):
+        self.df = df
+        self.data_hash = data_hash
+        self.cache = LRUCache(maxsize)
+        self._mol = dict(zip(df["name"], df["mol_set"]))
+        self._canonical = df.attrs.get("canonical", CANONICAL_NOTES)
+        # 可选：预计算的桥接候选 {"idx", "coverage", "names"}，行序须与 df 一致，否则不用
+        self._bridges = None
+        if bridges is not None and bridges["idx"].shape[1] and \
+                np.array_equal(np.asarray(bridges["names"], dtype=object), df["name"].to_numpy(dtype=object)):
+            self._bridges = bridges
+            self._row = {n: i for i, n in enumerate(df["name"])}
+            self._names = df["name"].tolist()
+            self._sets = df["mol_set"].tolist()
+        # 可选：预先算好的特征矩阵（雷达行直接查表）与持久化缓存（重启后免重算）
+        self._radar_rows = None
+        if features is not None:
+            self._radar_rows = {n: tuple(float(v) for v in row)
+                                for n, row in zip(features["names"], features["radar"])}
+        self.disk = disk
+        self.fingerprint = fingerprint or data_hash
+
+    def key_for(self, selected):
+        return (self.data_hash, tuple(sorted(selected)), tuple(sorted(selected[:2])))
+
+    def get(self, selected):
+        key = self.key_for(selected)
+        bundle = self.cache.get(key)
+        if bundle is None:
+            disk_key = "|".join(key[1]) + "#" + "|".join(key[2])
+            plain = self.disk.get("pair_bundle", disk_key, self.fingerprint) if self.disk else None
+            if plain is not None:
+                bundle = bundle_from_plain(plain)
+            else:
+                bundle = self._build(key)
+                if self.disk:
+                    self.disk.put("pair_bundle", disk_key, self.fingerprint, bundle_to_plain(bundle))
+            self.cache.put(key, bundle)
+        return bundle
+
+    def _build(self, key):
+        _, names, pair = key
+        a, b = pair
+        sa, sb = self._mol[a], self._mol[b]
+        sim = calc_sim(sa, sb)
+        dims = list(RADAR_DIMS.keys())
+        radar = {}
+        for n in names:
+            if self._radar_rows is not None and n in self._radar_rows:
+                radar[n] = self._radar_rows[n]
+            else:
+                rv = radar_vals(self._mol[n], self._canonical)
+                radar[n] = tuple(rv[d] for d in dims)
+        return PairBundle(
+            key=key,
+            pair=pair,
+            sim=_freeze(sim),
+            radar=MappingProxyType(radar),
+            polarity=_freeze(polarity_analysis(sa | sb, self._canonical)),
+            bridges=_freeze(self._find_bridges(a, b, sa, sb, set(names))),
+            contrasts=_freeze(find_contrasts(self.df, sa, sb, set(names))),
+        )
+
+    def _find_bridges(self, a, b, sa, sb, selected):
+        """有预计算候选时只在两侧的 Top-K 候选里找；上界不够紧时退回全表扫描"""
+        if self._bridges is not None:
+            ia, ib = self._row[a], self._row[b]
+            idx, cov = self._bridges["idx"], self._bridges["coverage"]
+            # coverage 为 float32，上界放宽一点，避免舍入误差
+            theta = (float(cov[ia, -1]) + 1e-6, float(cov[ib, -1]) + 1e-6)
+            top = bridges_from_candidates(self._names, self._sets, np.concatenate([idx[ia], idx[ib]]),
+                                          theta, sa, sb, selected)
+            if top is not None:
+                return top
+        return find_bridges(self.df, sa, sb, selected)
+
+    def sim_for(self, bundle, n1, n2):
+        return oriented_sim(bundle.sim, (n1, n2) != bundle.pair)
+
+    def bridges_for(self, bundle, n1, n2):
+        return _oriented_pairs(bundle.bridges, (n1, n2) != bundle.pair)
+
+    def contrasts_for(self, bundle, n1, n2):
+        return _oriented_pairs(bundle.contrasts, (n1, n2) != bundle.pair)
+
+    def radar_for(self, bundle, selected, ratios):
+        """按当前比例缩放雷达值，返回 {食材: 缩放后的值列表}"""
+        n = len(selected)
+        return {name: radar_scaled(bundle.radar[name], ratios.get(name, 1/n), n)
+                for name in selected}
+
+# ================================================================
+# 4b. 多食材协同分析（3-4 种食材）
+# ================================================================
+GroupBundle = namedtuple("GroupBundle", [
+    "names",    # 排序后的全部食材
+    "matrix",   # 两两共鸣指数（names 顺序的方阵，对角线为 None）
+    "counts",   # 风味标签 → 出现在几种食材中
+])
+
+def sim_type(score):
+    """与 calc_sim 一致的三档划分"""
+    if score >= 65: return "resonance"
+    if score >= 42: return "neutral"
+    return "contrast"
+
+def group_resonance(names, matrix, ratios=None):
+    """按配方比例加权的组内共鸣：Σ w_i·w_j·s_ij / Σ w_i·w_j（i<j）"""
+    n = len(names)
+    w = [(ratios or {}).get(name, 1 / n) for name in names]
+    num = den = 0.0
+    for i in range(n):
+        for j in range(i + 1, n):
+            num += w[i] * w[j] * matrix[i][j]
+            den += w[i] * w[j]
+    return int(round(num / den)) if den else 0
+
+
+class GroupAnalysisService:
+    """
+    多食材分析：两两结果逐对缓存（增删一种食材只补算新出现的配对），
+    组级的标签计数在已缓存的相邻组合（多/少一种食材）上增量加减得到。
+    与比例相关的加权共鸣在 bundle 之上即时计算。
+    """
+
+    def __init__(self, mol_sets, maxsize=256):
+        self._mol = mol_sets
+        self.pairs = LRUCache(maxsize * 4)
+        self.groups = LRUCache(maxsize)
+
+    def pair_sim(self, a, b):
+        key = (a, b) if a <= b else (b, a)
+        sim = self.pairs.get(key)
+        if sim is None:
+            sim = _freeze(calc_sim(self._mol[key[0]], self._mol[key[1]]))
+            self.pairs.put(key, sim)
+        return oriented_sim(sim, key != (a, b))
+
+    def seed_pair(self, pair, sim):
+        """复用 PairAnalysisService 已算好的主搭配对结果（pair 已按名称排序）"""
+        if self.pairs.get(pair) is None:
+            self.pairs.put(pair, sim)
+
+    def _counts(self, names):
+        # 优先在相邻组合上增量更新：去掉一种食材 / 增加一种食材
+        for drop in names:
+            parent = self.groups.get(tuple(n for n in names if n != drop))
+            if parent is not None:
+                counts = dict(parent.counts)
+                for m in self._mol[drop]:
+                    counts[m] = counts.get(m, 0) + 1
+                return counts
+        target = set(names)
+        for key in self.groups.keys():
+            if len(key) == len(names) + 1 and target.issubset(key):
+                child = self.groups.get(key)
+                extra = next(n for n in key if n not in target)
+                counts = dict(child.counts)
+                for m in self._mol[extra]:
+                    counts[m] -= 1
+                    if counts[m] == 0:
+                        del counts[m]
+                return counts
+        counts = {}
+        for n in names:
+            for m in self._mol[n]:
+                counts[m] = counts.get(m, 0) + 1
+        return counts
+
+    def get(self, selected):
+        names = tuple(sorted(selected))
+        bundle = self.groups.get(names)
+        if bundle is None:
+            matrix = tuple(
+                tuple(None if i == j else self.pair_sim(a, b)["score"] for j, b in enumerate(names))
+                for i, a in enumerate(names))
+            bundle = GroupBundle(names=names, matrix=matrix,
+                                 counts=MappingProxyType(self._counts(names)))
+            self.groups.put(names, bundle)
+        return bundle
+
+    def summary(self, bundle, selected, ratios=None):
+        """按用户选择顺序输出：两两矩阵、全员共享标签、各自独有标签、加权组内共鸣"""
+        pos = {n: i for i, n in enumerate(bundle.names)}
+        matrix = [[bundle.matrix[pos[a]][pos[b]] for b in selected] for a in selected]
+        n_all = len(selected)
+        core = sorted(m for m, c in bundle.counts.items() if c == n_all)
+        unique = {n: sorted(m for m in self._mol[n] if bundle.counts.get(m) == 1) for n in selected}
+        score = group_resonance(selected, matrix, ratios)
+        union = len(bundle.counts)
+        return {
+            "names": list(selected),
+            "matrix": matrix,
+            "core": core,
+            "unique": unique,
+            "union_count": union,
+            "core_ratio": len(core) / union if union else 0,
+            "score": score,
+            "type": sim_type(score),
+        }
+
+# ================================================================
+# 4c. 最佳组合搜索（分支定界 / 束搜索 / 多进程）
+# ================================================================
+# 组合得分 = 组内两两共鸣指数的平均值（与 group_resonance 等权时一致）
+COMBO_BUDGET_S = 0.5
+
+class ComboSearch:
+    """
+    围绕已选食材（锚点）补齐到 3 或 4 种，找组内平均共鸣最高的 Top-K 组合。
+
+    exact    分支定界：候选按与锚点的共鸣之和排序，逐层展开；
+             上界 = 当前和 + 剩余候选与已选成员的最大共鸣 + 候选之间的最大可能共鸣，
+             不超过当前第 K 名的分支整批剪掉，最后一层整行向量化打分
+    beam     束搜索：每层只保留 beam_width 个最优的部分组合，近似但很快
+    parallel 第一层分支按轮转分给进程池，各自做分支定界后合并（适合大库离线跑）
+
+    超出时间预算时返回已找到的最好结果，并标记 complete=False。结果（含未搜完的）按
+    (锚点, 规模, 参数) 缓存：界面每次重跑都会调用 search，不能每次再耗一遍时间预算。
+    """
+
+    def __init__(self, names, indptr, indices, n_notes, row_max=None, maxsize=512):
+        self.names = list(names)
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.indptr, self.indices, self.n_notes = indptr, indices, n_notes
+        self.X = dense_rows(indptr, indices, n_notes)
+        self.sizes = np.diff(indptr).astype(np.float64)
+        self.rows = LRUCache(maxsize)
+        self.results = LRUCache(maxsize)
+        # 每个食材与任意其他食材的最高共鸣（剪枝上界）；可直接用预计算的 Top-1 邻居
+        self.row_max = None if row_max is None else np.asarray(row_max, dtype=np.int32)
+
+    def row(self, i):
+        """第 i 个食材对全库的共鸣指数（int32，自身为 0）"""
+        r = self.rows.get(i)
+        if r is None:
+            r = sim_scores(self.X @ self.X[i], self.sizes[i], self.sizes).astype(np.int32)
+            r[i] = 0
+            self.rows.put(i, r)
+        return r
+
+    def _row_max(self, block=1024):
+        if self.row_max is None:
+            n = len(self.names)
+            out = np.zeros(n, dtype=np.int32)
+            for s in range(0, n, block):
+                e = min(s + block, n)
+                sc = sim_scores(self.X[s:e] @ self.X.T, self.sizes[s:e, None], self.sizes[None, :])
+                sc[np.arange(e - s), np.arange(s, e)] = 0
+                out[s:e] = sc.max(axis=1)
+            self.row_max = out
+        return self.row_max
+
+    def search(self, anchors, size, top_k=5, mode="exact", budget_s=COMBO_BUDGET_S,
+               beam_width=32, mask=None, workers=None):
+        anchors = [a for a in dict.fromkeys(anchors) if a in self.index]
+        key = (tuple(anchors), size, top_k, mode, beam_width,
+               None if mask is None else hashlib.sha1(np.packbits(mask).tobytes()).hexdigest())
+        cached = self.results.get(key)
+        if cached is not None:
+            return cached
+
+        t0 = time.perf_counter()
+        a_idx = [self.index[a] for a in anchors]
+        free = size - len(a_idx)
+        out = {"combos": [], "mode": mode, "complete": True, "nodes": 0, "pruned": 0}
+        if free <= 0 or not a_idx:
+            return out
+
+        base = sum(int(self.row(a)[b]) for k, a in enumerate(a_idx) for b in a_idx[k + 1:])
+        h = np.zeros(len(self.names), dtype=np.int32)
+        for a in a_idx:
+            h += self.row(a)
+        valid = np.ones(len(self.names), dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+        valid[a_idx] = False
+        order = np.flatnonzero(valid)
+        order = order[np.lexsort((order, -h[order]))]
+        if len(order) < free:
+            return out
+
+        heap = _ComboHeap(top_k)
+        for total, picks in self._beam(order, h, base, free, beam_width):
+            heap.push(total, picks)
+        if mode == "exact":
+            stats = _branch_and_bound(self.row, self._row_max(), order, h, base, free, heap,
+                                      t0 + budget_s)
+            out.update(stats)
+        elif mode == "parallel":
+            out.update(self._parallel(order, h, base, free, heap, t0 + budget_s, workers))
+
+        n_pairs = size * (size - 1) / 2
+        for total, picks in heap.items():
+            out["combos"].append({
+                "names": anchors + [self.names[i] for i in picks],
+                "added": [self.names[i] for i in picks],
+                "score": round(total / n_pairs, 1),
+            })
+        out["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        self.results.put(key, out)
+        return out
+
+    def _beam(self, order, h, base, free, width):
+        """束搜索：返回 [(总分, 按候选顺序排列的下标元组)]"""
+        rank = np.empty(len(self.names), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        beam = [(base, (), h)]
+        for _ in range(free):
+            nxt = {}
+            for total, picks, hh in beam:
+                cand = order[rank[picks[-1]] + 1:] if picks else order
+                best = cand[np.argsort(-hh[cand], kind="stable")[:width]]
+                for c in best:
+                    p = picks + (int(c),)
+                    if p not in nxt:
+                        nxt[p] = (total + int(hh[c]), p, hh + self.row(int(c)))
+            beam = sorted(nxt.values(), key=lambda x: (-x[0], x[1]))[:width]
+        return [(total, picks) for total, picks, _ in beam]
+
+    def _parallel(self, order, h, base, free, heap, deadline, workers):
+        from concurrent.futures import ProcessPoolExecutor
+        workers = workers or os.cpu_count() or 1
+        jobs = [(order, h, base, free, heap.top_k, heap.threshold(), deadline, w, workers)
+                for w in range(workers)]
+        stats = {"complete": True, "nodes": 0, "pruned": 0}
+        initargs = (self.indptr, self.indices, self.n_notes, self._row_max())
+        with ProcessPoolExecutor(workers, initializer=_init_combo_worker, initargs=initargs) as ex:
+            for items, st in ex.map(_combo_worker, jobs):
+                for total, picks in items:
+                    heap.push(total, picks)
+                stats["complete"] &= st["complete"]
+                stats["nodes"] += st["nodes"]
+                stats["pruned"] += st["pruned"]
+        return stats
+
+
+class _ComboHeap:
+    """定长 Top-K：同分时按下标元组字典序，结果可复现"""
+
+    def __init__(self, top_k, floor=-1):
+        self.top_k = top_k
+        self.floor = floor          # 已知的第 K 名分数（多进程时由主进程下发）
+        self._items = {}
+
+    def push(self, total, picks):
+        key = tuple(sorted(picks))
+        if key in self._items:
+            return
+        self._items[key] = total
+        if len(self._items) > self.top_k:
+            worst = min(self._items.items(), key=lambda kv: (kv[1], [-i for i in kv[0]]))
+            del self._items[worst[0]]
+
+    def threshold(self):
+        if len(self._items) >= self.top_k:
+            return max(self.floor, min(self._items.values()))
+        return self.floor
+
+    def items(self):
+        return sorted(((v, k) for k, v in self._items.items()), key=lambda x: (-x[0], x[1]))
+
+
+def _branch_and_bound(row, row_max, order, h, base, free, heap, deadline, part=(0, 1)):
+    """
+    在 order 上按下标递增展开组合。h[c] = c 与锚点及已选成员的共鸣之和；
+    选 c 后还剩 r 个名额，上界 = 当前和 + h[c] + r·m[c] + r·max(h 后缀) + C(r,2)·max(m 后缀)。
+    part=(w, W) 时只展开第一层中轮转到第 w 份的分支（多进程切分用）。
+    """
+    stats = {"complete": True, "nodes": 0, "pruned": 0}
+    m = row_max
+
+    def expand(start, total, picks, hh, r):
+        if time.perf_counter() > deadline:
+            stats["complete"] = False
+            return
+        stats["nodes"] += 1
+        suf = order[start:]
+        if len(suf) < r:
+            return
+        if r == 1:
+            # 最后一层：整行向量化，直接取够进入 Top-K 的那些
+            totals = total + hh[suf]
+            keep = np.flatnonzero(totals > heap.threshold())
+            stats["pruned"] += len(suf) - len(keep)
+            for k in keep[np.argsort(-totals[keep], kind="stable")[:heap.top_k]]:
+                heap.push(int(totals[k]), picks + (int(suf[k]),))
+            return
+        r2 = r - 1
+        h_after = np.maximum.accumulate(hh[suf][::-1])[::-1]
+        m_after = np.maximum.accumulate(m[suf][::-1])[::-1]
+        h_next = np.append(h_after[1:], 0)
+        m_next = np.append(m_after[1:], 0)
+        ub = total + hh[suf] + r2 * m[suf] + r2 * h_next + (r2 * (r2 - 1) // 2) * m_next
+        ub[len(suf) - r2:] = -1            # 剩余候选不够填满
+        live = np.flatnonzero(ub > heap.threshold())
+        if not picks and part[1] > 1:
+            live = live[live % part[1] == part[0]]
+        stats["pruned"] += len(suf) - len(live)
+        for k in live[np.argsort(-ub[live], kind="stable")]:
+            if ub[k] <= heap.threshold():
+                stats["pruned"] += 1
+                continue
+            c = int(suf[k])
+            expand(start + k + 1, total + int(hh[c]), picks + (c,), hh + row(c), r2)
+            if not stats["complete"]:
+                return
+
+    expand(0, base, (), h, free)
+    return stats
+
+
+_CW = {}
+
+def _init_combo_worker(indptr, indices, n_notes, row_max):
+    _CW["X"] = dense_rows(indptr, indices, n_notes)
+    _CW["sizes"] = np.diff(indptr).astype(np.float64)
+    _CW["row_max"] = row_max
+
+def _combo_worker_row(i):
+    X, sizes = _CW["X"], _CW["sizes"]
+    r = sim_scores(X @ X[i], sizes[i], sizes).astype(np.int32)
+    r[i] = 0
+    return r
+
+def _combo_worker(job):
+    order, h, base, free, top_k, threshold, deadline, w, n_workers = job
+    heap = _ComboHeap(top_k, floor=threshold)
+    stats = _branch_and_bound(_combo_worker_row, _CW["row_max"], order, h, base, free, heap,
+                              deadline, part=(w, n_workers))
+    return heap.items(), stats
+
+# ================================================================
+# 4d. 风味虫洞：食材相似图上的路径搜索
+# ================================================================
+GRAPH_TOPK = 12
+GRAPH_LANDMARKS = 8
+
+def knn_graph(indptr, indices, n_notes, nb_idx, block=256):
+    """
+    由 Top-K 邻居表建对称的稀疏相似图（u→v 与 v→u 只要有一条在 Top-K 里就连边）。
+    返回 CSR：adj_ptr / adj_idx，以及每条有向边的 Jaccard 相似度与共鸣指数。
+    """
+    n = len(indptr) - 1
+    nb_idx = np.asarray(nb_idx)
+    src = np.repeat(np.arange(n), nb_idx.shape[1])
+    dst = nb_idx.ravel().astype(np.int64)
+    a, b = np.minimum(src, dst), np.maximum(src, dst)
+    pairs = np.unique(a * n + b)
+    a, b = pairs // n, pairs % n
+
+    # 边上的交集大小：按块展开稠密行后逐边点积
+    sizes = np.diff(indptr).astype(np.int64)
+    inter = np.zeros(len(a), dtype=np.float64)
+    for s in range(0, len(a), block * 16):
+        e = min(s + block * 16, len(a))
+        Xa = dense_rows(indptr, indices, n_notes, a[s:e])
+        Xb = dense_rows(indptr, indices, n_notes, b[s:e])
+        inter[s:e] = np.einsum("ij,ij->i", Xa, Xb)
+    na, nb = sizes[a], sizes[b]
+    union = na + nb - inter
+    jac = np.where(union > 0, inter / np.maximum(union, 1), 0.0)
+    score = sim_scores(inter, na, nb)
+
+    src = np.concatenate([a, b])
+    dst = np.concatenate([b, a])
+    order = np.lexsort((dst, src))
+    adj_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(adj_ptr, src + 1, 1)
+    return {
+        "adj_ptr": np.cumsum(adj_ptr),
+        "adj_idx": dst[order].astype(np.int32),
+        "jaccard": np.concatenate([jac, jac])[order],
+        "score": np.concatenate([score, score])[order],
+        "n_edges": len(a),
+    }
+
+
+class FlavorGraph:
+    """
+    食材相似图：每个食材连向共鸣指数 Top-K 的邻居（再对称化），CSR 存储。
+    边权 = Jaccard 距离 1 - |A∩B|/|A∪B|。Jaccard 距离满足三角不等式，
+    所以 h(v) = 1 - J(v, 终点) 是可采纳且一致的 A* 启发函数；
+    建图时再选几个地标预存最短路距离（ALT），两者取大，搜索范围小得多。
+    每个数据版本只建一次，之后每次查询只在稀疏图上搜索。
+    """
+
+    def __init__(self, names, indptr, indices, n_notes, nb_idx=None, k=GRAPH_TOPK, block=256,
+                 n_landmarks=GRAPH_LANDMARKS):
+        self.names = list(names)
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.indptr, self.indices = indptr, indices
+        self.sizes = np.diff(indptr).astype(np.int64)
+        n = len(self.names)
+        if nb_idx is None:
+            nb_idx, _ = topk_neighbors(indptr, indices, n_notes, k)
+        nb_idx = np.asarray(nb_idx)[:, :k]
+
+        g = knn_graph(indptr, indices, n_notes, nb_idx, block)
+        self.adj_ptr, self.adj_idx = g["adj_ptr"], g["adj_idx"]
+        self.adj_w = 1.0 - g["jaccard"]
+        self.adj_score = g["score"]
+        self.n_edges = g["n_edges"]
+        self._adj = None
+        # 标签 → 食材的倒排表（CSC），启发函数只需扫目标食材那几个标签的倒排链
+        order = np.argsort(indices, kind="stable")
+        self.note_rows = np.repeat(np.arange(n), np.diff(indptr))[order]
+        self.note_ptr = np.zeros(n_notes + 1, dtype=np.int64)
+        np.add.at(self.note_ptr, indices.astype(np.int64) + 1, 1)
+        self.note_ptr = np.cumsum(self.note_ptr)
+        self._build_landmarks(n_landmarks)
+
+    # ---------- 基础工具 ----------
+    def _sssp(self, src):
+        """单源最短路（整图 Dijkstra），建地标时用"""
+        import heapq
+        dist = np.full(len(self.names), np.inf)
+        dist[src] = 0.0
+        heap = [(0.0, src)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in self._edges(u):
+                if d + w < dist[v]:
+                    dist[v] = d + w
+                    heapq.heappush(heap, (d + w, v))
+        return dist
+
+    def _build_landmarks(self, n_landmarks):
+        """最远点法选地标，预存它们到所有节点的距离（ALT 启发）"""
+        rows, far = [], 0
+        for _ in range(min(n_landmarks, len(self.names))):
+            d = self._sssp(far)
+            rows.append(d)
+            reach = np.min(np.stack(rows), axis=0)
+            reach[~np.isfinite(reach)] = -1
+            far = int(np.argmax(reach))
+        self.landmarks = np.stack(rows) if rows else np.zeros((0, len(self.names)))
+
+    def _heuristic(self, target):
+        """
+        h(v) = max(1 - J(v, target), max_L |d(L, target) - d(L, v)|)。
+        两项都是可采纳的一致下界，取最大仍然可采纳；全部节点一次性向量化算出，
+        交集大小走倒排表，只和目标食材标签的倒排链总长有关。
+        """
+        notes = self.indices[self.indptr[target]:self.indptr[target + 1]]
+        if len(notes):
+            rows = np.concatenate([self.note_rows[self.note_ptr[j]:self.note_ptr[j + 1]] for j in notes])
+        else:
+            rows = np.zeros(0, dtype=np.int64)
+        inter = np.bincount(rows, minlength=len(self.names))
+        union = self.sizes + self.sizes[target] - inter
+        h = np.where(union > 0, 1 - inter / np.maximum(union, 1), 1.0)
+        if len(self.landmarks):
+            lt = self.landmarks[:, target:target + 1]
+            with np.errstate(invalid="ignore"):
+                alt = np.abs(lt - self.landmarks)
+            alt[~np.isfinite(alt)] = 0.0          # 不连通的地标不提供信息
+            h = np.maximum(h, alt.max(axis=0))
+        return h.tolist()
+
+    def _adjacency(self):
+        if self._adj is None:
+            # 第一次查询时把 CSR 展开成 Python 列表，之后的搜索循环不再碰 numpy
+            idx, w = self.adj_idx.tolist(), self.adj_w.tolist()
+            ptr = self.adj_ptr.tolist()
+            self._adj = [list(zip(idx[ptr[i]:ptr[i + 1]], w[ptr[i]:ptr[i + 1]]))
+                         for i in range(len(ptr) - 1)]
+        return self._adj
+
+    def _edges(self, u):
+        return self._adjacency()[u]
+
+    def edge_score(self, u, v):
+        s, e = self.adj_ptr[u], self.adj_ptr[u + 1]
+        hit = np.flatnonzero(self.adj_idx[s:e] == v)
+        return int(self.adj_score[s + hit[0]]) if len(hit) else None
+
+    # ---------- 单条最短路 ----------
+    def astar(self, src, dst, banned_nodes=(), banned_edges=(), h=None):
+        import heapq
+        h = self._heuristic(dst) if h is None else h
+        g = [math.inf] * len(self.names)
+        g[src] = 0.0
+        closed = bytearray(len(self.names))
+        for b in banned_nodes:
+            closed[b] = 1
+        prev = {}
+        heap = [(h[src], 0.0, src)]
+        adj = self._adjacency()
+        while heap:
+            f, gu, u = heapq.heappop(heap)
+            if closed[u]:
+                continue
+            if u == dst:
+                return gu, self._unwind(prev, src, dst)
+            closed[u] = 1
+            for v, w in adj[u]:
+                if closed[v]:
+                    continue
+                gv = gu + w
+                if gv < g[v] and not (banned_edges and (u, v) in banned_edges):
+                    g[v] = gv
+                    prev[v] = u
+                    heapq.heappush(heap, (gv + h[v], gv, v))
+        return math.inf, None
+
+    def bidirectional_dijkstra(self, src, dst):
+        import heapq
+        if src == dst:
+            return 0.0, [src]
+        dist = [{src: 0.0}, {dst: 0.0}]
+        prev = [{}, {}]
+        heaps = [[(0.0, src)], [(0.0, dst)]]
+        done = [set(), set()]
+        best, meet = math.inf, None
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            du, u = heapq.heappop(heaps[side])
+            if u in done[side]:
+                continue
+            done[side].add(u)
+            for v, w in self._edges(u):        # 无向图，反向搜索用同一份邻接
+                dv = du + w
+                if dv < dist[side].get(v, math.inf):
+                    dist[side][v] = dv
+                    prev[side][v] = u
+                    heapq.heappush(heaps[side], (dv, v))
+                if v in dist[1 - side] and dv + dist[1 - side][v] < best:
+                    best, meet = dv + dist[1 - side][v], v
+        if meet is None:
+            return math.inf, None
+        left = self._unwind(prev[0], src, meet)
+        right = self._unwind(prev[1], dst, meet)
+        return best, left + right[::-1][1:]
+
+    @staticmethod
+    def _unwind(prev, src, node):
+        path = [node]
+        while path[-1] != src:
+            path.append(prev[path[-1]])
+        return path[::-1]
+
+    # ---------- K 条备选路径（Yen） ----------
+    def k_shortest(self, src, dst, k=3):
+        import heapq
+        h = self._heuristic(dst)           # 所有偏离路径的终点相同，启发值共用
+        cost, path = self.astar(src, dst, h=h)
+        if path is None:
+            return []
+        found = [(cost, path)]
+        cands, seen = [], {tuple(path)}
+        while len(found) < k:
+            last = found[-1][1]
+            for i in range(len(last) - 1):
+                spur, root = last[i], last[:i + 1]
+                banned_edges = set()
+                for _, p in found:
+                    if p[:i + 1] == root:
+                        banned_edges.add((p[i], p[i + 1]))
+                spur_cost, spur_path = self.astar(spur, dst, set(root[:-1]), banned_edges, h)
+                if spur_path is None:
+                    continue
+                total = root[:-1] + spur_path
+                if tuple(total) in seen:
+                    continue
+                seen.add(tuple(total))
+                heapq.heappush(cands, (self.path_cost(total), total))
+            if not cands:
+                break
+            found.append(heapq.heappop(cands))
+        return found
+
+    def path_cost(self, path):
+        total = 0.0
+        for u, v in zip(path, path[1:]):
+            total += next(w for x, w in self._edges(u) if x == v)
+        return total
+
+    # ---------- 对外接口 ----------
+    def wormholes(self, a, b, k=3, method="astar"):
+        """a → b 的最多 k 条虫洞路径：食材链、每一跳的共鸣指数、总 Jaccard 距离"""
+        if a not in self.index or b not in self.index:
+            return []
+        src, dst = self.index[a], self.index[b]
+        if method == "bidirectional":
+            cost, path = self.bidirectional_dijkstra(src, dst)
+            paths = [] if path is None else [(cost, path)]
+        else:
+            paths = self.k_shortest(src, dst, k)
+        return [{
+            "names": [self.names[i] for i in p],
+            "hops": [self.edge_score(u, v) for u, v in zip(p, p[1:])],
+            "cost": round(c, 4),
+        } for c, p in paths]
+
+# ================================================================
+# 4e. 风味家族（相似图上的社区发现）
+# ================================================================
+FAMILY_TOPK = 10
+FAMILY_MIN_SIZE = 3
+
+def _relabel_by_size(labels):
+    """社区编号按规模从大到小重排为 0..C-1（同规模按最小成员下标）"""
+    uniq, inv, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    first = np.full(len(uniq), len(labels), dtype=np.int64)
+    np.minimum.at(first, inv, np.arange(len(labels)))
+    order = np.lexsort((first, -counts))
+    rank = np.empty(len(uniq), dtype=np.int32)
+    rank[order] = np.arange(len(uniq))
+    return rank[inv]
+
+def label_propagation(adj_ptr, adj_idx, weights, max_iter=30, seed=0):
+    """
+    向量化的加权标签传播：每轮随机选一半节点，改用邻居中权重和最大的标签
+    （半同步更新避免二分图上的来回振荡）。全部是 numpy 分组运算，10 万节点几秒内完成。
+    """
+    n = len(adj_ptr) - 1
+    rng = np.random.default_rng(seed)
+    labels = np.arange(n, dtype=np.int64)
+    src = np.repeat(np.arange(n), np.diff(adj_ptr))
+    dst = np.asarray(adj_idx, dtype=np.int64)
+    w = np.asarray(weights, dtype=np.float64)
+    for _ in range(max_iter):
+        key = src * n + labels[dst]
+        uk, inv = np.unique(key, return_inverse=True)
+        tot = np.bincount(inv, weights=w)
+        node, lab = uk // n, uk % n
+        # 每个节点取权重和最大的标签；同分取编号最小的，保证可复现
+        order = np.lexsort((lab, -tot, node))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = node[order][1:] != node[order][:-1]
+        best = np.full(n, -1, dtype=np.int64)
+        best[node[order][first]] = lab[order][first]
+        update = (rng.random(n) < 0.5) & (best >= 0)
+        changed = update & (best != labels)
+        labels = np.where(update, best, labels)
+        if not changed.any():
+            break
+    return _relabel_by_size(labels)
+
+def louvain(adj_ptr, adj_idx, weights, resolution=1.0, max_levels=10, seed=0):
+    """
+    本地实现的 Louvain：逐节点移动到模块度增益最大的邻居社区，收敛后把社区压缩成超节点再来一轮。
+    局部移动是纯 Python 循环（边数 × 轮数），压缩用 numpy 分组求和。
+    """
+    n = len(adj_ptr) - 1
+    rng = np.random.default_rng(seed)
+    src = np.repeat(np.arange(n), np.diff(adj_ptr))
+    dst = np.asarray(adj_idx, dtype=np.int64)
+    w = np.asarray(weights, dtype=np.float64)
+    membership = np.arange(n, dtype=np.int64)
+    m2 = w.sum()                                  # 2m（无向边两个方向都计）
+    if m2 <= 0:
+        return _relabel_by_size(membership)
+
+    n_nodes = n
+    for _ in range(max_levels):
+        ptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.add.at(ptr, src + 1, 1)
+        ptr = np.cumsum(ptr).tolist()
+        nbr, nw = dst.tolist(), w.tolist()
+        k = np.bincount(src, weights=w, minlength=n_nodes).tolist()
+        comm = list(range(n_nodes))
+        tot = list(k)
+        moved_any = False
+        for _ in range(20):
+            moved = 0
+            for u in rng.permutation(n_nodes).tolist():
+                cu, ku = comm[u], k[u]
+                links = {}
+                for e in range(ptr[u], ptr[u + 1]):
+                    v = nbr[e]
+                    if v != u:
+                        links[comm[v]] = links.get(comm[v], 0.0) + nw[e]
+                tot[cu] -= ku
+                best_c, best_gain = cu, links.get(cu, 0.0) - resolution * tot[cu] * ku / m2
+                for c, kin in links.items():
+                    gain = kin - resolution * tot[c] * ku / m2
+                    if gain > best_gain + 1e-12 or (abs(gain - best_gain) <= 1e-12 and c < best_c):
+                        best_c, best_gain = c, gain
+                tot[best_c] += ku
+                if best_c != cu:
+                    comm[u] = best_c
+                    moved += 1
+            if not moved:
+                break
+            moved_any = True
+        if not moved_any:
+            break
+        # 压缩：社区 → 超节点，社区间边权求和（社区内部变成自环）
+        _, comm_id = np.unique(np.asarray(comm), return_inverse=True)
+        membership = comm_id[membership]
+        n_nodes = int(comm_id.max()) + 1
+        uk, inv = np.unique(comm_id[src] * n_nodes + comm_id[dst], return_inverse=True)
+        w = np.bincount(inv, weights=w)
+        src, dst = uk // n_nodes, uk % n_nodes
+    return _relabel_by_size(membership)
+
+def flavor_families(indptr, indices, n_notes, adj_ptr, adj_idx, weights, labels,
+                    n_reps=5, n_top_notes=3):
+    """
+    每个风味家族的代表成员（家族内加权度最高）与特征标签（比全库更集中出现的标签）。
+    返回 {"labels", "sizes", "reps" (C×n_reps, -1 补齐), "top_notes" (C×n_top_notes, -1 补齐)}
+    """
+    n = len(indptr) - 1
+    labels = np.asarray(labels, dtype=np.int64)
+    C = int(labels.max()) + 1 if n else 0
+    sizes = np.bincount(labels, minlength=C)
+    src = np.repeat(np.arange(n), np.diff(adj_ptr))
+    dst = np.asarray(adj_idx, dtype=np.int64)
+    inside = labels[src] == labels[dst]
+    strength = np.bincount(src[inside], weights=np.asarray(weights)[inside], minlength=n)
+
+    order = np.lexsort((np.arange(n), -strength, labels))
+    starts = np.searchsorted(labels[order], np.arange(C))
+    reps = np.full((C, n_reps), -1, dtype=np.int32)
+    for j in range(n_reps):
+        pos = starts + j
+        ok = j < sizes
+        reps[ok, j] = order[pos[ok]]
+
+    # 特征标签：家族内占比高、且明显高于全库占比的标签（按 KL 贡献 p·log(p/q) 排序）
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    freq = np.bincount(labels[rows] * n_notes + indices, minlength=C * n_notes).reshape(C, n_notes)
+    p = freq / np.maximum(sizes, 1)[:, None]
+    q = np.bincount(indices, minlength=n_notes) / max(n, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distinct = np.where(freq > 0, p * np.log(p / np.maximum(q, 1e-12)[None, :]), -np.inf)
+    top_notes = np.full((C, n_top_notes), -1, dtype=np.int32)
+    t = min(n_top_notes, n_notes)
+    if t:
+        best = np.argsort(-distinct, axis=1, kind="stable")[:, :t]
+        has = np.take_along_axis(distinct, best, axis=1) > 0
+        top_notes[:, :t] = np.where(has, best, -1)
+    return {"labels": labels.astype(np.int32), "sizes": sizes.astype(np.int32),
+            "reps": reps, "top_notes": top_notes}
+
+def build_families(indptr, indices, n_notes, nb_idx=None, k=FAMILY_TOPK, method="louvain", seed=0):
+    """Top-K 相似图 + 社区发现 + 家族摘要，一步到位（precompute.py 与应用冷启动共用）"""
+    if nb_idx is None:
+        nb_idx, _ = topk_neighbors(indptr, indices, n_notes, k)
+    g = knn_graph(indptr, indices, n_notes, np.asarray(nb_idx)[:, :k])
+    detect = label_propagation if method == "lpa" else louvain
+    labels = detect(g["adj_ptr"], g["adj_idx"], g["jaccard"], seed=seed)
+    return flavor_families(indptr, indices, n_notes, g["adj_ptr"], g["adj_idx"], g["jaccard"], labels)
+
+# ================================================================
+# 4f. 风味地图（全部食材的二维嵌入）
+# ================================================================
+MAP_SVD_DIM = 32
+MAP_TOPK = 10
+MAP_EPOCHS = 200
+
+def _tfidf_values(indptr, indices, n_notes):
+    """CSR 非零元的 TF-IDF 权重，按行 L2 归一化（行向量点积即余弦相似度）"""
+    n = len(indptr) - 1
+    idf = np.log((1.0 + n) / (1.0 + np.bincount(indices, minlength=n_notes))) + 1.0
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    vals = idf[indices]
+    norm = np.sqrt(np.bincount(rows, weights=vals ** 2, minlength=n))
+    return vals / np.maximum(norm, 1e-12)[rows]
+
+def _weighted_blocks(indptr, indices, vals, n_notes, block):
+    """按行分块展开带权稠密矩阵（标签词表只有几百列，稠密块走 BLAS 比逐元素散射快一个量级）"""
+    n = len(indptr) - 1
+    for s in range(0, n, block):
+        e = min(s + block, n)
+        D = np.zeros((e - s, n_notes), dtype=np.float32)
+        D[np.repeat(np.arange(e - s), np.diff(indptr[s:e + 1])),
+          indices[indptr[s]:indptr[e]]] = vals[indptr[s]:indptr[e]]
+        yield s, e, D
+
+def truncated_svd(indptr, indices, n_notes, dim=MAP_SVD_DIM, n_iter=4, seed=0, block=4096):
+    """
+    TF-IDF 食材×标签矩阵的随机化截断 SVD（Halko 等，带 n_iter 次幂迭代）。
+    矩阵始终分块展开，不整体驻留内存。返回 (坐标 U·S n×dim, 奇异值 S)。
+    """
+    n = len(indptr) - 1
+    vals = _tfidf_values(indptr, indices, n_notes)
+    k = max(1, min(dim, n, n_notes))
+    p = min(k + 10, n, n_notes)
+    rng = np.random.default_rng(seed)
+
+    def xb(B):
+        out = np.empty((n, B.shape[1]), dtype=np.float32)
+        for s, e, D in _weighted_blocks(indptr, indices, vals, n_notes, block):
+            out[s:e] = D @ B
+        return out
+
+    def xtq(Q):
+        out = np.zeros((n_notes, Q.shape[1]), dtype=np.float64)
+        for s, e, D in _weighted_blocks(indptr, indices, vals, n_notes, block):
+            out += D.T @ Q[s:e]
+        return out
+
+    Q, _ = np.linalg.qr(xb(rng.standard_normal((n_notes, p)).astype(np.float32)))
+    for _ in range(n_iter):
+        Z, _ = np.linalg.qr(xtq(Q))
+        Q, _ = np.linalg.qr(xb(Z.astype(np.float32)))
+    Ub, S, _ = np.linalg.svd(xtq(Q).T, full_matrices=False)
+    return ((Q @ Ub[:, :k]) * S[:k]).astype(np.float32), S[:k]
+
+def _cosine_topk(Y, k, block=2048):
+    """低维坐标上的余弦 Top-k 邻居（不含自身）"""
+    n = Y.shape[0]
+    Z = (Y / np.maximum(np.linalg.norm(Y, axis=1), 1e-12)[:, None]).astype(np.float32)
+    k = min(k, max(n - 1, 0))
+    idx = np.zeros((n, k), dtype=np.int64)
+    if k == 0:
+        return idx
+    for s in range(0, n, block):
+        e = min(s + block, n)
+        G = Z[s:e] @ Z.T
+        G[np.arange(e - s), np.arange(s, e)] = -np.inf
+        idx[s:e] = np.argpartition(-G, k - 1, axis=1)[:, :k]
+    return idx
+
+def _classical_mds(Y):
+    """SVD 坐标上的经典 MDS（中心化后取前两个主轴），输出按整体标准差缩放"""
+    C = Y - Y.mean(axis=0)
+    if C.shape[1] < 2:
+        C = np.hstack([C, np.zeros((C.shape[0], 2 - C.shape[1]), dtype=C.dtype)])
+    _, _, vt = np.linalg.svd(C, full_matrices=False)
+    P = C @ vt[:2].T
+    return P / max(float(P.std()), 1e-12)
+
+def neighbor_embedding(Y, nb_idx, epochs=MAP_EPOCHS, neg=5, seed=0):
+    """
+    UMAP 式邻域图嵌入：以经典 MDS 为初值，按边权采样近邻边做吸引、随机负样本做排斥。
+    每轮所有节点同时更新（吸引力按本轮采到的边数取平均），全部是 numpy 分组运算。
+    """
+    n = Y.shape[0]
+    rng = np.random.default_rng(seed)
+    P = (_classical_mds(Y) * 10.0).astype(np.float32)
+    if n < 3 or nb_idx.shape[1] == 0:
+        return P
+    src = np.repeat(np.arange(n), nb_idx.shape[1])
+    dst = np.asarray(nb_idx, dtype=np.int64).ravel()
+    a, b = np.minimum(src, dst), np.maximum(src, dst)
+    keep = a != b
+    pairs = np.unique(a[keep] * n + b[keep])
+    a, b = pairs // n, pairs % n
+    # 边权 = SVD 空间的余弦相似度，采样概率与之成正比
+    Z = Y / np.maximum(np.linalg.norm(Y, axis=1), 1e-12)[:, None]
+    w = np.maximum(np.einsum("ij,ij->i", Z[a], Z[b]), 0.0)
+    prob = w / max(float(w.max()), 1e-12)
+    heads = np.repeat(np.arange(n), neg)
+
+    for ep in range(epochs):
+        lr = 1.0 - ep / epochs
+        m = rng.random(len(prob)) < prob
+        ea, eb = a[m], b[m]
+        d = P[ea] - P[eb]
+        g = d * (-2.0 / (1.0 + (d * d).sum(axis=1)))[:, None]
+        np.clip(g, -4.0, 4.0, out=g)
+        cnt = np.maximum(np.bincount(ea, minlength=n) + np.bincount(eb, minlength=n), 1)
+        # 负样本按节点抽取（期望上等价于每条边各抽 neg 个，但采样量少一个数量级）
+        tails = rng.integers(0, n, len(heads))
+        dn = P[heads] - P[tails]
+        dn2 = (dn * dn).sum(axis=1)
+        gn = dn * (2.0 / ((0.001 + dn2) * (1.0 + dn2)))[:, None]
+        np.clip(gn, -4.0, 4.0, out=gn)
+        gn[heads == tails] = 0.0
+        grad = gn.reshape(n, neg, 2).sum(axis=1)
+        for j in range(2):
+            grad[:, j] += (np.bincount(ea, g[:, j], n) - np.bincount(eb, g[:, j], n)) / cnt
+        P += lr * grad
+    return P
+
+def flavor_map(indptr, indices, n_notes, nb_idx=None, method="umap", dim=MAP_SVD_DIM,
+               k=MAP_TOPK, epochs=MAP_EPOCHS, seed=0):
+    """
+    全部食材的二维风味地图：TF-IDF → 截断 SVD → 邻域图嵌入（method="umap"）或经典 MDS（"mds"）。
+    nb_idx 为预计算的 Top-K 邻居表（可选），没有时在 SVD 空间里求余弦近邻。
+    返回 {"xy" float32 n×2（中心化、单位标准差）, "singular_values"}
+    """
+    Y, S = truncated_svd(indptr, indices, n_notes, dim, seed=seed)
+    if method == "mds":
+        P = _classical_mds(Y)
+    else:
+        nb = _cosine_topk(Y, k) if nb_idx is None else np.asarray(nb_idx)[:, :k]
+        P = neighbor_embedding(Y, nb, epochs, seed=seed)
+    P = P - P.mean(axis=0)
+    P = P / max(float(P.std()), 1e-12)
+    return {"xy": P.astype(np.float32), "singular_values": S.astype(np.float32)}
+
+# ================================================================
+# 4g. 多食材对比矩阵（20-60 种食材一次比较）
+# ================================================================
+COMPARE_MAX = 60
+
+def resonance_matrix(indptr, indices, n_notes, rows, scores=None):
+    """
+    若干食材两两之间的共鸣指数与共享标签数：一次矩阵乘法得到全部交集，不逐对调用 calc_sim。
+    scores 为预计算的全量分数矩阵（可为 mmap），有则直接切片。
+    返回 {"scores" uint8 N×N, "shared" int32 N×N}
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    X = dense_rows(indptr, indices, n_notes, rows)
+    inter = X @ X.T
+    if scores is not None:
+        sc = np.asarray(scores[np.ix_(rows, rows)], dtype=np.uint8)
+    else:
+        sizes = np.diff(indptr)[rows]
+        sc = sim_scores(inter, sizes[:, None], sizes[None, :])
+    return {"scores": sc, "shared": np.rint(inter).astype(np.int32)}
+
+def cluster_order(scores):
+    """
+    平均连接层次聚类（距离 = 100 - 共鸣指数）给出的叶子顺序。
+    合并两簇时在四种首尾拼接方式中取相接两端最相似的一种，让热力图对角线附近更连贯。
+    """
+    S = np.asarray(scores, dtype=np.float64)
+    n = len(S)
+    if n <= 2:
+        return list(range(n))
+    dist = 100.0 - S
+    D = dist.copy()
+    np.fill_diagonal(D, np.inf)
+    members = {i: [i] for i in range(n)}
+    size = np.ones(n)
+    for _ in range(n - 1):
+        i, j = divmod(int(np.argmin(D)), n)
+        a, b = members.pop(i), members.pop(j)
+        options = [a + b, a + b[::-1], a[::-1] + b, a[::-1] + b[::-1]]
+        joins = [dist[o[len(a) - 1], o[len(a)]] for o in options]
+        members[i] = options[int(np.argmin(joins))]
+        # Lance-Williams：新簇到其他簇的距离 = 两簇距离按成员数加权平均
+        row = (D[i] * size[i] + D[j] * size[j]) / (size[i] + size[j])
+        D[i, :] = row
+        D[:, i] = row
+        D[i, i] = np.inf
+        D[j, :] = np.inf
+        D[:, j] = np.inf
+        size[i] += size[j]
+    return next(iter(members.values()))
+
+# ================================================================
+# 4h. 按风味标签反查食材（倒排索引 + Block-Max MaxScore）
+# ================================================================
+NOTE_SEARCH_BLOCK = 1024
+
+class NoteSearch:
+    """
+    「想要烘烤 + 柑橘 + 花香，不要硫味」→ 排序后的食材列表。
+
+    评分：命中的 must / should 标签权重之和，权重 = IDF × 长度归一（BM25，tf 恒为 1），
+    稀有标签比 "sweet" 这类人人都有的标签更有分量，标签特别多的食材不会因「什么都沾一点」占优。
+    检索：食材按下标分块，预存每个标签在每块里的最大权重；查询时先算每块的分数上界，
+    按上界从高到低逐块向量化打分，上界低于当前第 K 名时提前结束（MaxScore / Block-Max WAND 思路）。
+    标签可用英文或 localization_zh.json 里的中文译名查询。
+    """
+
+    def __init__(self, names, indptr, indices, vocab, translations=None, k1=1.2, b=0.75,
+                 block=NOTE_SEARCH_BLOCK):
+        self.names = list(names)
+        self.vocab = list(vocab)
+        self.note_id = {v: j for j, v in enumerate(self.vocab)}
+        n, m = len(self.names), len(self.vocab)
+        self.block = block
+        self.n_blocks = max(1, -(-n // block))
+
+        lengths = np.diff(indptr).astype(np.float64)
+        avg = lengths[lengths > 0].mean() if (lengths > 0).any() else 1.0
+        norm = (k1 + 1.0) / (1.0 + k1 * (1.0 - b + b * lengths / avg))
+        # 索引内部按长度归一系数从大到小重新编号：高分食材集中在前几块，块上界下降得快，剪枝更有效
+        self.perm = np.argsort(-norm, kind="stable")
+        rank = np.empty(n, dtype=np.int64)
+        rank[self.perm] = np.arange(n)
+        self.norm = norm[self.perm]
+
+        # 倒排表（CSC）：每个标签对应的食材内部编号，升序
+        rows = rank[np.repeat(np.arange(n), np.diff(indptr))]
+        order = np.lexsort((rows, indices))
+        self.post_rows = rows[order]
+        ptr = np.zeros(m + 1, dtype=np.int64)
+        np.add.at(ptr, np.asarray(indices, dtype=np.int64) + 1, 1)
+        self.post_ptr = np.cumsum(ptr)
+
+        df = np.diff(self.post_ptr).astype(np.float64)
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+        # 每个标签在每个块里的最大权重（块上界）
+        terms = np.repeat(np.arange(m), np.diff(self.post_ptr))
+        self.block_max = np.zeros((m, self.n_blocks))
+        np.maximum.at(self.block_max, (terms, self.post_rows // block),
+                      self.idf[terms] * self.norm[self.post_rows])
+
+        # 中英文查询词 → 标签编号（一个中文译名可能对应多个英文标签）
+        self.aliases = {}
+        for j, v in enumerate(self.vocab):
+            self.aliases.setdefault(v.lower(), []).append(j)
+            zh = (translations or {}).get(v)
+            if zh and zh.lower() != v.lower():
+                self.aliases.setdefault(zh.lower(), []).append(j)
+
+    def resolve(self, term):
+        """查询词 → 标签编号列表：先精确匹配中英文，找不到再按子串匹配"""
+        key = str(term).strip().lower()
+        if not key:
+            return []
+        if key in self.aliases:
+            return list(self.aliases[key])
+        hits = {j for alias, ids in self.aliases.items() if key in alias for j in ids}
+        return sorted(hits)
+
+    def _groups(self, terms):
+        """每个查询词 → 它解析出的标签编号组（同一个词对应的多个标签之间是「任一」关系）"""
+        out = []
+        for term in terms or []:
+            ids = [term] if isinstance(term, (int, np.integer)) else self.resolve(term)
+            if len(ids):
+                out.append(list(dict.fromkeys(int(j) for j in ids)))
+        return out
+
+    def _ids(self, terms):
+        return list(dict.fromkeys(j for g in self._groups(terms) for j in g))
+
+    def _postings(self, j, lo, hi):
+        p = self.post_rows[self.post_ptr[j]:self.post_ptr[j + 1]]
+        return p[np.searchsorted(p, lo):np.searchsorted(p, hi)]
+
+    def search(self, must=None, should=None, must_not=None, k=10, mask=None):
+        """
+        must 每个词都要命中（一个词解析出多个标签时命中其一即可，如「烘烤」→ baked / roast），
+        must_not 一个都不能有、should 命中越多越靠前；查询词可混用中英文。
+        mask 为可选的布尔数组（例如侧边栏的纯素 / 大类筛选）。
+        返回 {"results": [{"name", "score", "matched", "missing"}], "blocks_scored", "blocks_total",
+              "postings", "elapsed_ms", "terms"}
+        """
+        t0 = time.perf_counter()
+        must_groups, not_ids = self._groups(must), self._ids(must_not)
+        must_ids = list(dict.fromkeys(j for g in must_groups for j in g))
+        should_ids = [j for j in self._ids(should) if j not in must_ids]
+        pos = must_ids + should_ids
+        stats = {"results": [], "blocks_scored": 0, "blocks_total": self.n_blocks, "postings": 0,
+                 "terms": {"must": [self.vocab[j] for j in must_ids],
+                           "should": [self.vocab[j] for j in should_ids],
+                           "must_not": [self.vocab[j] for j in not_ids]}}
+        if not pos or k <= 0:
+            stats["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+            return stats
+
+        # 块上界：正向标签块内最大权重之和；某个 must 词的标签在块里一个都没有时整块排除
+        ub = self.block_max[pos].sum(axis=0)
+        for g in must_groups:
+            ub[(self.block_max[g] <= 0).all(axis=0)] = -np.inf
+        order = np.argsort(-ub, kind="stable")
+
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0)
+        theta = -np.inf
+        for blk in order.tolist():
+            if ub[blk] == -np.inf or (len(best_scores) >= k and ub[blk] < theta - 1e-9):
+                break
+            lo, hi = blk * self.block, min((blk + 1) * self.block, len(self.names))
+            acc = np.zeros(hi - lo)
+            post = {}
+            for j in pos:
+                p = post[j] = self._postings(j, lo, hi)
+                acc[p - lo] += self.idf[j] * self.norm[p]
+                stats["postings"] += len(p)
+            ok = acc > 0
+            for g in must_groups:
+                hit = np.zeros(hi - lo, dtype=bool)
+                for j in g:
+                    hit[post[j] - lo] = True
+                ok &= hit
+            for j in not_ids:
+                ok[self._postings(j, lo, hi) - lo] = False
+            if mask is not None:
+                ok &= np.asarray(mask, dtype=bool)[self.perm[lo:hi]]
+            stats["blocks_scored"] += 1
+            rows = np.flatnonzero(ok)
+            best_rows = np.concatenate([best_rows, rows + lo])
+            best_scores = np.concatenate([best_scores, acc[rows]])
+            # 只保留当前前 K 名（同分按原始下标升序），第 K 名的分数即剪枝阈值
+            keep = np.lexsort((self.perm[best_rows], -best_scores))[:k]
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+            if len(best_scores) >= k:
+                theta = best_scores[-1]
+
+        for r, sc in zip(best_rows.tolist(), best_scores.tolist()):
+            matched = [(self.vocab[j], round(float(self.idf[j] * self.norm[r]), 3)) for j in pos
+                       if self._postings(j, r, r + 1).size]
+            have = {v for v, _ in matched}
+            stats["results"].append({
+                "name": self.names[self.perm[r]], "score": round(sc, 3), "matched": matched,
+                "missing": [self.vocab[j] for j in should_ids if self.vocab[j] not in have]})
+        stats["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+        return stats
+
+# ================================================================
+# 4i. 可插拔相似度核（稀疏打分后端）
+# ================================================================
+SIM_KERNELS = {}
+DEFAULT_KERNEL = "resonance"
+
+def sim_kernel(name, needs=("inter",), label=None, scale=1.0):
+    """
+    注册相似度核。核函数接收一组可广播的统计量（只计算 needs 里声明的）：
+      inter / size_a / size_b   交集与各自的标签数
+      w_inter / w_a / w_b       交集与各自的 IDF 权重和
+      dot / norm_a / norm_b     PPMI 加权向量的点积与模长
+    scale 为分数上限（共鸣指数是 97 分制，其余核是 0-1），供界面统一着色与聚类。
+    """
+    def deco(fn):
+        SIM_KERNELS[name] = {"fn": fn, "needs": tuple(needs), "label": label or name, "scale": scale}
+        return fn
+    return deco
+
+@sim_kernel("resonance", label="分子共鸣指数（默认）", scale=97)
+def _kernel_resonance(st):
+    return sim_scores(st["inter"], st["size_a"], st["size_b"])
+
+@sim_kernel("jaccard", label="Jaccard")
+def _kernel_jaccard(st):
+    union = st["size_a"] + st["size_b"] - st["inter"]
+    return np.where(union > 0, st["inter"] / np.maximum(union, 1e-12), 0.0)
+
+@sim_kernel("idf_jaccard", needs=("w_inter",), label="IDF 加权 Jaccard")
+def _kernel_idf_jaccard(st):
+    union = st["w_a"] + st["w_b"] - st["w_inter"]
+    return np.where(union > 0, st["w_inter"] / np.maximum(union, 1e-12), 0.0)
+
+@sim_kernel("cosine", label="余弦")
+def _kernel_cosine(st):
+    denom = np.sqrt(st["size_a"] * st["size_b"])
+    return np.where(denom > 0, st["inter"] / np.maximum(denom, 1e-12), 0.0)
+
+@sim_kernel("overlap", label="重叠系数")
+def _kernel_overlap(st):
+    denom = np.minimum(st["size_a"], st["size_b"])
+    return np.where(denom > 0, st["inter"] / np.maximum(denom, 1e-12), 0.0)
+
+@sim_kernel("ppmi_cosine", needs=("dot",), label="PPMI 加权余弦")
+def _kernel_ppmi_cosine(st):
+    denom = st["norm_a"] * st["norm_b"]
+    return np.where(denom > 0, st["dot"] / np.maximum(denom, 1e-12), 0.0)
+
+
+class SimilarityBackend:
+    """
+    稀疏食材×标签矩阵上的统一打分入口：同一个核可以算一对、一对全库、或全库两两。
+      pair        两个标签下标数组求交（np.intersect1d）
+      one_vs_all  倒排表 + bincount，只触及查询食材那几个标签的倒排链
+      all_vs_all  按行分块展开稠密矩阵走 BLAS（标签只有几百列，稠密块最快）
+    默认核 resonance 与 calc_sim 的分数逐位一致。
+    """
+
+    def __init__(self, indptr, indices, n_notes):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.n_notes = n_notes
+        self.n = len(self.indptr) - 1
+        rows = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        self.sizes = np.diff(self.indptr).astype(np.float64)
+        df = np.bincount(self.indices, minlength=n_notes).astype(np.float64)
+        self.idf = np.log((self.n + 1.0) / (df + 1.0)) + 1.0
+        self.w_sizes = np.bincount(rows, weights=self.idf[self.indices], minlength=self.n)
+        # PPMI(i, t) = max(0, log(P(i, t) / (P(i)·P(t))))，二值矩阵下只依赖行长与文档频率
+        nnz = max(len(self.indices), 1)
+        with np.errstate(divide="ignore"):
+            pmi = np.log(nnz) - np.log(np.maximum(self.sizes[rows], 1)) - np.log(np.maximum(df[self.indices], 1))
+        self.ppmi = np.maximum(pmi, 0.0)
+        self.ppmi_norm = np.sqrt(np.bincount(rows, weights=self.ppmi ** 2, minlength=self.n))
+        # 倒排表（CSC），同时带上每个非零元的 PPMI 值
+        order = np.argsort(self.indices, kind="stable")
+        self.post_rows = rows[order]
+        self.post_ppmi = self.ppmi[order]
+        ptr = np.zeros(n_notes + 1, dtype=np.int64)
+        np.add.at(ptr, self.indices + 1, 1)
+        self.post_ptr = np.cumsum(ptr)
+        self._full = {}
+
+    @staticmethod
+    def kernel(name):
+        if name not in SIM_KERNELS:
+            raise KeyError(f"未知的相似度核: {name}（可选：{', '.join(SIM_KERNELS)}）")
+        return SIM_KERNELS[name]
+
+    def _side(self, rows):
+        return {"size": self.sizes[rows], "w": self.w_sizes[rows], "norm": self.ppmi_norm[rows]}
+
+    def _finish(self, name, st, a, b):
+        k = self.kernel(name)
+        st.update(size_a=a["size"], size_b=b["size"], w_a=a["w"], w_b=b["w"],
+                  norm_a=a["norm"], norm_b=b["norm"])
+        return k["fn"](st)
+
+    def pair(self, i, j, kernel=DEFAULT_KERNEL):
+        """两个食材（行下标）之间的分数"""
+        ai = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        bj = self.indices[self.indptr[j]:self.indptr[j + 1]]
+        common, ia, ib = np.intersect1d(ai, bj, assume_unique=True, return_indices=True)
+        pa = self.ppmi[self.indptr[i]:self.indptr[i + 1]][ia]
+        pb = self.ppmi[self.indptr[j]:self.indptr[j + 1]][ib]
+        st = {"inter": np.float64(len(common)), "w_inter": self.idf[common].sum(), "dot": float(pa @ pb)}
+        out = self._finish(kernel, st, self._side(i), self._side(j))
+        return out.item() if hasattr(out, "item") else out
+
+    def one_vs_all(self, i, kernel=DEFAULT_KERNEL):
+        """第 i 个食材对全库每个食材的分数（含自身）"""
+        needs = self.kernel(kernel)["needs"]
+        notes = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        spans = [(self.post_ptr[t], self.post_ptr[t + 1]) for t in notes.tolist()]
+        pos = (np.concatenate([np.arange(lo, hi) for lo, hi in spans]) if spans
+               else np.zeros(0, dtype=np.int64))
+        hit = self.post_rows[pos]
+        st = {"inter": np.bincount(hit, minlength=self.n).astype(np.float64)}
+        if "w_inter" in needs:
+            lens = [hi - lo for lo, hi in spans]
+            st["w_inter"] = np.bincount(hit, weights=np.repeat(self.idf[notes], lens), minlength=self.n)
+        if "dot" in needs:
+            lens = [hi - lo for lo, hi in spans]
+            qa = np.repeat(self.ppmi[self.indptr[i]:self.indptr[i + 1]], lens)
+            st["dot"] = np.bincount(hit, weights=qa * self.post_ppmi[pos], minlength=self.n)
+        return self._finish(kernel, st, self._side(i), self._side(slice(None)))
+
+    def _dense(self, rows, weights):
+        rows = np.asarray(rows, dtype=np.int64)
+        D = np.zeros((len(rows), self.n_notes), dtype=np.float32)
+        lens = self.indptr[rows + 1] - self.indptr[rows]
+        # 各行非零元在 CSR 中的位置：行起点按长度展开 + 行内偏移
+        offs = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+        pos = np.repeat(self.indptr[rows], lens) + offs
+        D[np.repeat(np.arange(len(rows)), lens), self.indices[pos]] = 1.0 if weights is None else weights[pos]
+        return D
+
+    def _dense_all(self, key):
+        """全库稠密矩阵（二值 / PPMI），第一次做全库打分时展开并缓存"""
+        if key not in self._full:
+            self._full[key] = self._dense(np.arange(self.n), None if key == "bin" else self.ppmi)
+        return self._full[key]
+
+    def block(self, rows_a, rows_b=None, kernel=DEFAULT_KERNEL):
+        """rows_a × rows_b 的分数矩阵（rows_b=None 表示全库）；两侧都按需展开为稠密块"""
+        needs = self.kernel(kernel)["needs"]
+        rows_a = np.asarray(rows_a, dtype=np.int64)
+        full = rows_b is None
+        rows_b = np.arange(self.n) if full else np.asarray(rows_b, dtype=np.int64)
+        Xa = self._dense(rows_a, None)
+        Xb = self._dense_all("bin") if full else self._dense(rows_b, None)
+        st = {"inter": (Xa @ Xb.T).astype(np.float64)}
+        if "w_inter" in needs:
+            st["w_inter"] = ((Xa * self.idf.astype(np.float32)) @ Xb.T).astype(np.float64)
+        if "dot" in needs:
+            Pb = self._dense_all("ppmi") if full else self._dense(rows_b, self.ppmi)
+            st["dot"] = (self._dense(rows_a, self.ppmi) @ Pb.T).astype(np.float64)
+        a, b = self._side(rows_a), self._side(rows_b)
+        a = {k: v[:, None] for k, v in a.items()}
+        b = {k: v[None, :] for k, v in b.items()}
+        return self._finish(kernel, st, a, b)
+
+    def all_vs_all(self, kernel=DEFAULT_KERNEL, block=1024):
+        """按行分块逐块产出 (起始行, 分块×全库 分数矩阵)，整表不必同时驻留内存"""
+        for s in range(0, self.n, block):
+            yield s, self.block(np.arange(s, min(s + block, self.n)), kernel=kernel)
+
+# ================================================================
+# 4j. 风味网络图（所选食材 + 它们的全部风味标签，数百个节点）
+# ================================================================
+NETWORK_GRAPH_MAX_NOTES = 800   # 单张网络图最多的标签节点（按重要度截断）
+NETWORK_ITERS = 120
+# 缩放层级：keep = 单独显示的最重要标签数，其余次要标签按 cell 大小的网格聚成簇（坐标已归一到单位标准差）
+NETWORK_LOD = {
+    "overview": {"label": "全局", "keep": 40, "cell": 0.6},
+    "region":   {"label": "局部", "keep": 120, "cell": 0.3},
+    "full":     {"label": "全部", "keep": None, "cell": 0.0},
+}
+
+def force_layout(init, src, dst, iterations=NETWORK_ITERS, gravity=0.05):
+    """
+    Fruchterman-Reingold 力导向布局：全部节点对的斥力一次算成 n×n 矩阵，边上的引力用 bincount 聚合，
+    每轮所有节点同时移动，步长随温度线性冷却。
+    init 为 n×2 初始坐标，src/dst 为边的两端；返回中心化、单位标准差的 float32 坐标
+    """
+    P = np.array(init, dtype=np.float32)
+    n = len(P)
+    if n < 2:
+        return P
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    k = np.float32(2.0 / sqrt(n))   # 理想边长：边长 2 的正方形里均分面积
+    t0 = np.float32(0.2)
+    for it in range(iterations):
+        # 两两距离平方用 Gram 矩阵展开（走 BLAS），不物化 n×n×2 的差向量
+        sq = (P * P).sum(axis=1)
+        d2 = sq[:, None] + sq[None, :] - 2.0 * (P @ P.T)
+        np.maximum(d2, 1e-6, out=d2)
+        np.fill_diagonal(d2, np.inf)
+        # 斥力 k²/d 沿单位方向：Σ_j f_ij (p_i − p_j)，f = k²/d²
+        f = (k * k) / d2
+        disp = P * f.sum(axis=1)[:, None] - f @ P
+        # 引力 d²/k 沿单位方向 → E·d/k
+        E = P[src] - P[dst]
+        att = E * (np.sqrt((E * E).sum(axis=1)) / k)[:, None]
+        for j in range(2):
+            disp[:, j] += np.bincount(dst, att[:, j], n) - np.bincount(src, att[:, j], n)
+        disp -= gravity * P * n ** 0.5   # 弱向心力：没有共享标签的子图不会被推得太远
+        length = np.maximum(np.sqrt((disp * disp).sum(axis=1)), 1e-9)
+        t = t0 * (1.0 - it / iterations)
+        P += disp * (np.minimum(length, t) / length)[:, None]
+    P -= P.mean(axis=0)
+    return (P / max(float(P.std()), 1e-12)).astype(np.float32)
+
+def note_network(indptr, indices, rows, doc_freq, max_notes=NETWORK_GRAPH_MAX_NOTES,
+                 iterations=NETWORK_ITERS, seed=0):
+    """
+    所选食材与它们全部风味标签组成的二部图及其力导向布局。
+    节点 0..k-1 为食材（rows 顺序），k.. 为标签，按重要度排序：持有它的食材数降序，再按全库出现次数升序
+    （越少见越有辨识度）。owners 为每个标签的持有者位掩码（第 b 位 = 第 b 种食材）。
+    返回 {"rows", "notes" int32, "owners" uint8, "degree" 持有者数, "src", "dst", "xy" float32 (k+m)×2}
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    k = len(rows)
+    owned = [indices[indptr[r]:indptr[r + 1]] for r in rows]
+    notes = np.unique(np.concatenate(owned)) if k else np.zeros(0, dtype=np.int32)
+    owners = np.zeros(len(notes), dtype=np.uint8)
+    for b, ids in enumerate(owned):
+        owners[np.searchsorted(notes, ids)] |= np.uint8(1 << b)
+    cnt = np.unpackbits(owners[:, None], axis=1).sum(axis=1)
+    order = np.lexsort((notes, doc_freq[notes], -cnt.astype(np.int64)))[:max_notes]
+    notes, owners, cnt = notes[order].astype(np.int32), owners[order], cnt[order].astype(np.uint8)
+    m = len(notes)
+    bits = (owners[:, None] >> np.arange(k, dtype=np.uint8)) & 1
+    note_i, ing_i = np.nonzero(bits)
+    src, dst = ing_i.astype(np.int64), (note_i + k).astype(np.int64)
+    # 初值：食材均匀排在单位圆上（第一种在左侧），标签放在持有者的重心附近，加少量固定种子的抖动
+    ang = np.pi + 2 * np.pi * np.arange(k) / max(k, 1)
+    anchors = np.column_stack([np.cos(ang), np.sin(ang)])
+    rng = np.random.default_rng(seed)
+    w = bits / np.maximum(bits.sum(axis=1, keepdims=True), 1)
+    init = np.vstack([anchors, w @ anchors + rng.normal(0.0, 0.15, (m, 2))])
+    xy = force_layout(init, src, dst, iterations)
+    return {"rows": rows, "notes": notes, "owners": owners, "degree": cnt, "src": src, "dst": dst, "xy": xy}
+
+def network_lod(net, level="overview"):
+    """
+    按缩放层级聚合：最重要的 keep 个标签单独显示，其余按 (网格单元, 持有者掩码) 聚成簇，
+    簇放在成员重心上。返回 {"xy", "owners", "count", "ptr", "members"}，
+    第 t 个显示项的成员为 members[ptr[t]:ptr[t+1]]（标签在 net["notes"] 中的下标，按重要度）
+    """
+    cfg = NETWORK_LOD[level]
+    k = len(net["rows"])
+    xy = net["xy"][k:]
+    m = len(xy)
+    keep = m if cfg["keep"] is None else min(cfg["keep"], m)
+    minor = np.arange(keep, m)
+    if len(minor) and cfg["cell"] > 0:
+        cells = np.floor(xy[minor] / cfg["cell"]).astype(np.int64)
+        key = np.column_stack([cells, net["owners"][minor].astype(np.int64)])
+        _, inv = np.unique(key, axis=0, return_inverse=True)
+        group = np.concatenate([np.arange(keep), keep + inv.ravel()])
+    else:
+        group = np.arange(m)
+    n_items = int(group.max()) + 1 if m else 0
+    members = np.argsort(group, kind="stable")
+    count = np.bincount(group, minlength=n_items)
+    ptr = np.concatenate([[0], np.cumsum(count)])
+    out_xy = np.column_stack([np.bincount(group, xy[:, j], n_items) for j in range(2)])
+    out_xy /= np.maximum(count, 1)[:, None]
+    owners = net["owners"][members[ptr[:-1]]] if m else net["owners"]
+    return {"xy": out_xy.astype(np.float32), "owners": owners, "count": count, "ptr": ptr, "members": members}
+
+class NoteNetworkService:
+    """风味网络图布局（跨会话共享）：按所选食材集合缓存，与选择顺序无关"""
+
+    def __init__(self, indptr, indices, n_notes, maxsize=64):
+        self.indptr = indptr
+        self.indices = indices
+        self.doc_freq = np.bincount(indices, minlength=n_notes)
+        self.cache = LRUCache(maxsize)
+
+    def get(self, rows):
+        key = tuple(sorted(int(r) for r in rows))
+        net = self.cache.get(key)
+        if net is None:
+            net = note_network(self.indptr, self.indices, key, self.doc_freq)
+            self.cache.put(key, net)
+        return net
+
+# ================================================================
+# 5. 预计算产物（precompute.py 生成，应用启动时只读加载）
+# ================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 数据文件按代码所在目录定位，与启动时的工作目录无关
+DATA_PATH = os.path.join(BASE_DIR, "flavordb_data.csv")
+LOC_PATH = os.path.join(BASE_DIR, "localization_zh.json")
+ARTIFACT_DIR = os.getenv("FLAVOR_LAB_ARTIFACTS", os.path.join(BASE_DIR, "artifacts"))
+ARTIFACT_MANIFEST = "manifest.json"
+SHARED_DIR = os.getenv("FLAVOR_LAB_SHARED_DIR", "")
+
+def data_fingerprint(data_hash, canonical=None):
+    """引擎代码版本 + 数据内容指纹（+ 标签规范化版本）；持久化缓存与预计算产物都以此判断是否过期"""
+    canonical = CANONICAL_NOTES if canonical is None else canonical
+    return f"v{ENGINE_VERSION}-{data_hash}" + (f"-c{CANON_VERSION}" if canonical else "")
+
+class DatasetVersion:
+    """
+    数据版本：食材库 CSV 与本地化 JSON 的内容哈希 + 引擎代码版本（+ 标签规范化版本）。
+      key       所有进程内 / 持久化缓存的键，三者任一变化即换新键，旧条目不会再被命中
+      data_key  只含影响计算结果的部分；预计算产物按它判断是否过期（只改译名不必重跑 precompute）
+    """
+
+    def __init__(self, data_hash, loc_hash, canonical=None):
+        self.data_hash = data_hash
+        self.loc_hash = loc_hash
+        self.engine_version = ENGINE_VERSION
+        self.canonical = CANONICAL_NOTES if canonical is None else bool(canonical)
+        self.data_key = data_fingerprint(data_hash, self.canonical)
+        self.key = f"{self.data_key}-l{loc_hash}"
+
+    def as_dict(self):
+        return {"engine_version": self.engine_version, "data_hash": self.data_hash,
+                "loc_hash": self.loc_hash, "canonical": self.canonical,
+                "data_key": self.data_key, "key": self.key}
+
+    def __eq__(self, other):
+        return isinstance(other, DatasetVersion) and other.key == self.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return self.key
+
+    def __repr__(self):
+        return f"DatasetVersion({self.key})"
+
+def dataset_version(csv_path=None, loc_path=None, canonical=None):
+    """按文件内容计算当前数据版本"""
+    return DatasetVersion(file_hash(csv_path or DATA_PATH), file_hash(loc_path or LOC_PATH), canonical)
+
+def catalog_frame(ids, names, categories, vocab, indptr, indices, canonical=None):
+    """由紧凑存储的食材库重建与 read_catalog 等价的 DataFrame；canonical 为词表的标签模式（None 跟随全局开关）"""
+    mol_sets = [set(vocab[j] for j in indices[indptr[i]:indptr[i + 1]]) for i in range(len(names))]
+    df = pd.DataFrame({
+        "id": ids, "name": names, "category": categories,
+        "mol_set": mol_sets, "mol_count": np.diff(indptr).astype(np.int64),
+    })
+    df.attrs["canonical"] = CANONICAL_NOTES if canonical is None else canonical
+    return df
+
+def mmap_npz(path):
+    """
+    以只读 mmap 打开未压缩的 npz：各成员直接映射到文件里的数据段，不拷贝进进程私有内存，
+    同机多个进程共享同一份页缓存（np.load 对 npz 会把成员整个读进内存，mmap_mode 对 npz 无效）。
+    压缩成员、0 维或含 Python 对象的成员退化为普通读取。
+    """
+    out = {}
+    with open(path, "rb") as f, zipfile.ZipFile(f) as zf:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                # 本地文件头：固定 30 字节，第 26-29 字节为文件名与扩展字段长度，其后才是 .npy 数据
+                n_name, n_extra = struct.unpack("<HH", mm[info.header_offset + 26:info.header_offset + 30])
+                f.seek(info.header_offset + 30 + n_name + n_extra)
+                version = np.lib.format.read_magic(f)
+                reader = {(1, 0): np.lib.format.read_array_header_1_0,
+                          (2, 0): np.lib.format.read_array_header_2_0}.get(version)
+                if reader is not None:
+                    shape, fortran, dtype = reader(f)
+                    if shape and not dtype.hasobject:
+                        out[name] = np.ndarray(shape, dtype, buffer=mm, offset=f.tell(),
+                                               order="F" if fortran else "C")
+                        continue
+            with zf.open(info) as member:
+                out[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return out
+
+def load_artifacts(data_hash, art_dir=None):
+    """
+    读取预计算产物；清单缺失或指纹与当前数据/引擎版本不符时返回 None（回退到现场计算）。
+    data_hash 也可以传 DatasetVersion（按其 data_key 比较）。
+    全部数组以 mmap 只读方式打开（见 mmap_npz），不占用进程私有内存，同机多个进程共享一份。
+    每次成功加载都会刷新清单的修改时间，evict_shared 据此判断目录最近是否还有人用。
+    """
+    art_dir = art_dir or ARTIFACT_DIR
+    manifest_path = os.path.join(art_dir, ARTIFACT_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        want = data_hash.data_key if isinstance(data_hash, DatasetVersion) else data_fingerprint(data_hash)
+        if manifest.get("fingerprint") != want:
+            return None
+        with open(os.path.join(art_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        cat = mmap_npz(os.path.join(art_dir, "catalog.npz"))
+        feat = mmap_npz(os.path.join(art_dir, "features.npz"))
+        out = {
+            "dir": art_dir,
+            "manifest": manifest,
+            "vocab": vocab,
+            "catalog": cat,
+            "features": {"names": cat["names"].tolist(), "dims": feat["dims"].tolist(),
+                         "radar": feat["radar"], "polarity": feat["polarity"]},
+        }
+        for name in ("neighbors", "bridges"):
+            out[name] = mmap_npz(os.path.join(art_dir, f"{name}.npz"))
+        for name in ("families", "flavor_map"):
+            path = os.path.join(art_dir, f"{name}.npz")
+            out[name] = mmap_npz(path) if os.path.exists(path) else None
+        scores_path = os.path.join(art_dir, "scores.npy")
+        out["scores"] = np.load(scores_path, mmap_mode="r") if os.path.exists(scores_path) else None
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        os.utime(manifest_path)
+    except OSError:  # 只读部署的产物目录：不影响使用
+        pass
+    return out
+
+def shared_artifacts(data_path, root=None, **kwargs):
+    """
+    同机多个应用进程共用的产物目录 root/<data_key>，返回目录路径。
+    不存在时由第一个拿到文件锁的进程生成（单进程计算，其余进程阻塞等待），
+    之后各进程都以只读 mmap 映射同一份文件，进程私有内存不随进程数增长。
+    生成用的是 precompute.build_all，只在真正需要生成时才导入离线脚本。
+    """
+    root = root or SHARED_DIR
+    version = dataset_version(data_path)
+    out_dir = os.path.join(root, version.data_key)
+    manifest = os.path.join(out_dir, ARTIFACT_MANIFEST)
+    if os.path.exists(manifest):
+        return out_dir
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".build.lock"), "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(manifest):
+                from precompute import build_all
+                tmp = f"{out_dir}.tmp-{os.getpid()}"
+                kwargs.setdefault("workers", 1)
+                try:
+                    build_all(data_path, tmp, canonical=version.canonical, **kwargs)
+                except BaseException:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    raise
+                try:
+                    os.rename(tmp, out_dir)
+                except OSError:
+                    # 另一个进程已经生成好了（没有文件锁的平台）：用它的
+                    shutil.rmtree(tmp, ignore_errors=True)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return out_dir
+
+def evict_shared(keep, root=None, grace=600):
+    """
+    删除 root 下不属于 keep（仍在使用的 data_key）且超过宽限期没被加载过的产物目录，返回删除的目录数。
+    最近一次使用看清单的修改时间（load_artifacts 每次加载都会刷新），没有清单的残留目录看目录本身。
+    仍在映射旧文件的进程不受影响（文件删除后映射继续有效）。
+    """
+    root = root or SHARED_DIR
+    if not root or not os.path.isdir(root):
+        return 0
+    keep, cutoff, n = set(keep), time.time() - grace, 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(".") or name in keep or not os.path.isdir(path):
+            continue
+        manifest = os.path.join(path, ARTIFACT_MANIFEST)
+        try:
+            used = os.path.getmtime(manifest if os.path.exists(manifest) else path)
+        except OSError:
+            continue
+        if used < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            n += 1
+    return n
+
+# ================================================================
+# 5b. 数据快照与热更新
+# ================================================================
+HOT_RELOAD = os.getenv("FLAVOR_LAB_HOT_RELOAD", "0") == "1"
+RELOAD_INTERVAL = float(os.getenv("FLAVOR_LAB_RELOAD_INTERVAL", "2"))
+RELOAD_KEEP = 2           # 同时保留的数据版本数（当前 + 上一版，供还没跑完的重跑使用）
+SNAPSHOT_TOPK = 20
+_EMPTY_LOC = {"ingredients": {}, "flavor_notes": {}, "categories": {}}
+
+def read_localization(path):
+    """本地化词表与其内容指纹；文件缺失时返回空词表"""
+    if not os.path.exists(path):
+        return dict(_EMPTY_LOC), file_hash(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f), file_hash(path)
+
+class DataSnapshot:
+    """
+    一个数据版本的只读快照：食材库 CSR、特征矩阵、Top-K 共鸣邻居（可选全量分数矩阵）与本地化词表。
+    catalog 为 None 表示轻量快照（未开启热更新），派生结构由调用方按原路径现场计算。
+    """
+
+    def __init__(self, version, loc, catalog=None, features=None, neighbors=None, scores=None, diff=None):
+        self.version = version
+        self.data_hash = version.data_hash
+        self.loc_hash = version.loc_hash
+        self.loc = loc
+        self.catalog = catalog
+        self.features = features
+        self.neighbors = neighbors
+        self.scores = scores
+        self.diff = diff
+        self.created = time.time()
+
+    def with_loc(self, loc, version):
+        """只有本地化变化：数据部分原样共享"""
+        return DataSnapshot(version, loc, self.catalog, self.features,
+                            self.neighbors, self.scores, diff={"loc_only": True})
+
+def build_snapshot(csv_path, loc_path, full=True, art_dir=None, topk=SNAPSHOT_TOPK):
+    """完整构建一个快照：预计算产物匹配时直接复用，否则流式解析并现场计算特征与 Top-K"""
+    loc, loc_hash = read_localization(loc_path)
+    version = DatasetVersion(file_hash(csv_path), loc_hash)
+    if not full:
+        return DataSnapshot(version, loc)
+    art = load_artifacts(version, art_dir)
+    if art is not None:
+        c = art["catalog"]
+        cat = {"ids": c["ids"], "names": c["names"].tolist(), "categories": c["categories"].tolist(),
+               "vocab": art["vocab"], "indptr": c["indptr"], "indices": c["indices"], "stats": None}
+        return DataSnapshot(version, loc, cat, art["features"],
+                            {"idx": art["neighbors"]["idx"], "score": art["neighbors"]["score"]}, art["scores"])
+    cat = stream_catalog(csv_path)
+    if cat is None:
+        return DataSnapshot(version, loc)
+    feats = feature_matrices(catalog_frame(cat["ids"], cat["names"], cat["categories"], cat["vocab"],
+                                           cat["indptr"], cat["indices"]))
+    idx, sc = topk_neighbors(cat["indptr"], cat["indices"], len(cat["vocab"]), topk)
+    return DataSnapshot(version, loc, cat, feats, {"idx": idx, "score": sc})
+
+def _csr_gather(indptr, indices, rows):
+    """若干行的非零元拼在一起，返回 (拼接后的下标, 每行长度)"""
+    rows = np.asarray(rows, dtype=np.int64)
+    lens = indptr[rows + 1] - indptr[rows]
+    offs = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    return indices[np.repeat(indptr[rows], lens) + offs], lens
+
+def diff_catalogs(old, new):
+    """
+    按食材名称逐行比较两个版本的食材库（标签集合按名称比较，与词表编号无关）。
+    返回 old_pos（新行 → 旧行号，新增为 -1）、dirty（新增或标签变化的新行）与汇总统计。
+    """
+    old_index = {n: i for i, n in enumerate(old["names"])}
+    old_pos = np.array([old_index.get(n, -1) for n in new["names"]], dtype=np.int64)
+    # 旧词表编号 → 新词表编号（两边词表都按字母序，映射单调，行内顺序不变）
+    new_vid = {v: j for j, v in enumerate(new["vocab"])}
+    remap = np.array([new_vid.get(v, -1) for v in old["vocab"]] + [-1], dtype=np.int64)
+    dirty = old_pos < 0
+    both = np.flatnonzero(~dirty)
+    lens_new = np.diff(new["indptr"])[both]
+    lens_old = np.diff(old["indptr"])[old_pos[both]]
+    same_len = lens_new == lens_old
+    cand = both[same_len]
+    a, la = _csr_gather(new["indptr"], new["indices"], cand)
+    b, _ = _csr_gather(old["indptr"], old["indices"], old_pos[cand])
+    owner = np.repeat(np.arange(len(cand)), la)
+    mismatch = np.bincount(owner, weights=(remap[b] != a), minlength=len(cand)) > 0
+    dirty[both[~same_len]] = True
+    dirty[cand[mismatch]] = True
+    kept = set(old_pos[old_pos >= 0].tolist())
+    removed = [n for i, n in enumerate(old["names"]) if i not in kept]
+    old_vocab, new_vocab_set = set(old["vocab"]), set(new["vocab"])
+    clean = np.flatnonzero(~dirty)
+    return {
+        "old_pos": old_pos, "dirty": dirty,
+        "added": int((old_pos < 0).sum()), "changed": int(dirty.sum() - (old_pos < 0).sum()),
+        "removed": len(removed), "unchanged": int(len(clean)),
+        "removed_names": removed[:50],
+        "notes_added": sorted(new_vocab_set - old_vocab)[:50],
+        "notes_removed": sorted(old_vocab - new_vocab_set)[:50],
+        # 未变化的行相对顺序是否保持（同分按下标排序的 Top-K 只有在此前提下才能增量合并）
+        "order_kept": bool(np.all(np.diff(old_pos[clean]) > 0)) if len(clean) > 1 else True,
+    }
+
+def _topk_from_scores(sc, rows, k):
+    """分数块（rows × 全库）→ 每行 Top-k，规则与 topk_neighbors 相同（不含自身，同分按下标升序）"""
+    n = sc.shape[1]
+    key = sc.astype(np.float64) * (n + 1) - np.arange(n)[None, :]
+    key[np.arange(len(rows)), rows] = -np.inf
+    part = np.argpartition(-key, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(key, part, axis=1), axis=1, kind="stable")
+    idx = np.take_along_axis(part, order, axis=1)
+    return idx.astype(np.int32), np.take_along_axis(sc, idx, axis=1)
+
+def update_snapshot(old, new_cat, version, loc, block=1024, full_ratio=0.25):
+    """
+    由旧快照增量得到新版本：只重算受影响的行。
+      特征矩阵    未变化的行直接拷贝，新增 / 变化的行重新计算
+      Top-K 邻居  变化行整行重算；其余行把旧列表（去掉已失效的邻居）与「对变化行的分数」合并，
+                  旧列表里有邻居失效的行才整行重算
+      分数矩阵    （旧快照带全量矩阵时）未变化的块按新行号搬运，变化行的行与列用新分数覆盖
+    变化超过 full_ratio 或行顺序被打乱时退化为整体重算。
+    """
+    t0 = time.perf_counter()
+    n, V = len(new_cat["names"]), len(new_cat["vocab"])
+    indptr, indices = new_cat["indptr"], new_cat["indices"]
+    d = diff_catalogs(old.catalog, new_cat)
+    old_pos, dirty = d["old_pos"], d["dirty"]
+    D = np.flatnonzero(dirty)
+    clean = np.flatnonzero(~dirty)
+    k_old = old.neighbors["idx"].shape[1]
+    k = min(k_old, max(n - 1, 0))
+    full = len(D) > full_ratio * n or not d["order_kept"] or k != k_old or k == 0
+
+    # 特征矩阵
+    feats = {"names": list(new_cat["names"]), "dims": old.features["dims"]}
+    for key in ("radar", "polarity"):
+        arr = np.zeros((n,) + old.features[key].shape[1:], dtype=old.features[key].dtype)
+        arr[clean] = np.asarray(old.features[key])[old_pos[clean]]
+        feats[key] = arr
+    if len(D):
+        sub_ptr = np.zeros(len(D) + 1, dtype=np.int64)
+        sub_idx, lens = _csr_gather(indptr, indices, D)
+        np.cumsum(lens, out=sub_ptr[1:])
+        sub = feature_matrices(catalog_frame(new_cat["ids"][D], [new_cat["names"][i] for i in D],
+                                             [new_cat["categories"][i] for i in D], new_cat["vocab"],
+                                             sub_ptr, sub_idx))
+        feats["radar"][D], feats["polarity"][D] = sub["radar"], sub["polarity"]
+
+    # Top-K 邻居
+    if full:
+        nb_idx, nb_sc = topk_neighbors(indptr, indices, V, k_old)
+        recomputed = n
+    else:
+        # 旧行号 → 新行号（失效的旧行记为 -1）
+        new_of_old = np.full(len(old.catalog["names"]) + 1, -1, dtype=np.int64)
+        new_of_old[old_pos[clean]] = clean
+        o_idx = new_of_old[np.asarray(old.neighbors["idx"])[old_pos[clean]]]
+        o_sc = np.asarray(old.neighbors["score"])[old_pos[clean]]
+        lost = (o_idx < 0).any(axis=1)
+        merge_rows, F = clean[~lost], np.concatenate([D, clean[lost]])
+        X = dense_rows(indptr, indices, V)
+        sizes = np.diff(indptr).astype(np.float64)
+        nb_idx = np.zeros((n, k), dtype=np.int32)
+        nb_sc = np.zeros((n, k), dtype=np.uint8)
+        sc_D = np.zeros((len(D), n), dtype=np.uint8)
+        for s in range(0, len(F), block):
+            rows = F[s:s + block]
+            sc = sim_scores(X[rows] @ X.T, sizes[rows, None], sizes[None, :])
+            nb_idx[rows], nb_sc[rows] = _topk_from_scores(sc, rows, k)
+            in_d = s + np.arange(len(rows)) < len(D)
+            sc_D[(s + np.arange(len(rows)))[in_d]] = sc[in_d]
+        # 未失效的旧列表 ∪ 对变化行的分数：行顺序保持时，列表外的旧候选不可能排进前 k
+        cand_idx = np.concatenate([o_idx[~lost], np.broadcast_to(D, (len(merge_rows), len(D)))], axis=1)
+        cand_sc = np.concatenate([o_sc[~lost], sc_D[:, merge_rows].T], axis=1)
+        key = cand_sc.astype(np.float64) * (n + 1) - cand_idx
+        order = np.argsort(-key, axis=1, kind="stable")[:, :k]
+        nb_idx[merge_rows] = np.take_along_axis(cand_idx, order, axis=1)
+        nb_sc[merge_rows] = np.take_along_axis(cand_sc, order, axis=1)
+        recomputed = len(F)
+
+    # 全量分数矩阵（只有旧快照带着才维护）
+    scores = None
+    if old.scores is not None:
+        scores = np.empty((n, n), dtype=np.uint8)
+        scores[np.ix_(clean, clean)] = np.asarray(old.scores)[np.ix_(old_pos[clean], old_pos[clean])]
+        if len(D):
+            X = dense_rows(indptr, indices, V)
+            sizes = np.diff(indptr).astype(np.float64)
+            for s in range(0, len(D), block):
+                rows = D[s:s + block]
+                sc = sim_scores(X[rows] @ X.T, sizes[rows, None], sizes[None, :])
+                scores[rows] = sc
+                scores[:, rows] = sc.T
+
+    diff = {k_: v for k_, v in d.items() if k_ not in ("old_pos", "dirty")}
+    diff.update(full_rebuild=bool(full), rows_recomputed=int(recomputed),
+                update_s=round(time.perf_counter() - t0, 3), parse=new_cat.get("stats"))
+    return DataSnapshot(version, loc, new_cat, feats, {"idx": nb_idx, "score": nb_sc}, scores, diff)
+
+class DatasetWatcher:
+    """
+    数据文件监视器：按 mtime / 大小做廉价检查，变化时再按内容哈希确认，增量构建新快照后原子替换。
+      · current()  每次重跑开头调用一次并固定使用；到了检查间隔才去看文件
+      · 只有一个线程负责重建（非阻塞锁），其他会话在此期间继续用旧快照
+      · 新快照构建完成前旧快照一直有效；构建失败（如文件写到一半）保留旧版本，下次再试
+      · 最近 keep 个版本可按版本键（DatasetVersion.key）取回，供还在用旧版本的重跑查询
+    enabled=False 时只在启动时读一次（轻量快照，行为与未开启热更新一致）。
+    """
+
+    def __init__(self, csv_path, loc_path, enabled=None, interval=RELOAD_INTERVAL, keep=RELOAD_KEEP,
+                 art_dir=None, topk=SNAPSHOT_TOPK):
+        self.csv_path, self.loc_path = csv_path, loc_path
+        self.enabled = HOT_RELOAD if enabled is None else enabled
+        self.interval, self.keep = interval, keep
+        self.art_dir, self.topk = art_dir, topk
+        self.events = []
+        self._lock = threading.Lock()
+        self._stat = self._file_stat()
+        self._checked = time.monotonic()
+        self._current = build_snapshot(csv_path, loc_path, full=self.enabled, art_dir=art_dir, topk=topk)
+        self._versions = OrderedDict([(self._current.version.key, self._current)])
+
+    def _file_stat(self):
+        out = []
+        for p in (self.csv_path, self.loc_path):
+            try:
+                s = os.stat(p)
+                out.append((s.st_mtime_ns, s.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def current(self):
+        if self.enabled and time.monotonic() - self._checked >= self.interval:
+            self.poll()
+        return self._current
+
+    def get(self, key):
+        return self._versions.get(key)
+
+    def live_keys(self):
+        """仍被保留的版本键（缓存淘汰时据此判断哪些条目已过期）"""
+        return list(self._versions)
+
+    def poll(self, force=False):
+        """检查文件是否变化；有新版本时构建并换入。返回当前快照"""
+        if not self._lock.acquire(blocking=False):
+            return self._current
+        try:
+            self._checked = time.monotonic()
+            stat = self._file_stat()
+            if stat == self._stat and not force:
+                return self._current
+            self._stat = stat
+            cur = self._current
+            version = dataset_version(self.csv_path, self.loc_path)
+            if version == cur.version:
+                return cur
+            t0 = time.perf_counter()
+            loc = read_localization(self.loc_path)[0] if version.loc_hash != cur.loc_hash else cur.loc
+            if version.data_key == cur.version.data_key:
+                new = cur.with_loc(loc, version)
+            elif cur.catalog is None:
+                new = build_snapshot(self.csv_path, self.loc_path, art_dir=self.art_dir, topk=self.topk)
+            else:
+                cat = stream_catalog(self.csv_path)
+                if cat is None:
+                    raise OSError(f"{self.csv_path} 不存在")
+                art = load_artifacts(version, self.art_dir)
+                new = (build_snapshot(self.csv_path, self.loc_path, art_dir=self.art_dir, topk=self.topk)
+                       if art is not None else update_snapshot(cur, cat, version, loc))
+            self._versions[new.version.key] = new
+            self._versions.move_to_end(new.version.key)
+            while len(self._versions) > self.keep:
+                self._versions.popitem(last=False)
+            # 引用赋值是原子的：之后开始的重跑拿到新快照，正在跑的重跑继续用手里的旧快照
+            self._current = new
+            self.events.append({"time": time.strftime("%H:%M:%S"), "version": new.version.key,
+                                "elapsed_s": round(time.perf_counter() - t0, 3), "diff": new.diff})
+            del self.events[:-10]
+            return new
+        except (OSError, ValueError, KeyError, pd.errors.ParserError) as e:
+            # 多半是文件正写到一半：保留旧版本，下次检查再试
+            self._stat = None
+            self.events.append({"time": time.strftime("%H:%M:%S"), "error": str(e)})
+            del self.events[:-10]
+            return self._current
+        finally:
+            self._lock.release()
+
+# ================================================================
+# 5c. 驻留符号表（风味标签 / 品类 / 食材名）
+# ================================================================
+def translate_ingredient(loc, name):
+    m = loc.get("ingredients", {})
+    return m.get(name) or m.get(name.strip()) or name
+
+def translate_category(loc, cat):
+    return loc.get("categories", {}).get(cat, cat)
+
+def translate_note(loc, note):
+    m = loc.get("flavor_notes", {})
+    return m.get(note.strip().lower()) or m.get(note.strip()) or note.strip()
+
+class SymbolTable:
+    """
+    字符串驻留表：每个不同的字符串只存一份（sys.intern），对应一个小整数编号；
+    en / zh 是与编号平行的原文与译名数组，翻译就是按编号取下标，不再每次做规范化 + 字典查找。
+    表外的字符串（如 AI 回复或分子数据里的描述词）交给 fallback 现场翻译。
+    """
+
+    def __init__(self, labels, fallback=None):
+        self._fallback = fallback or (lambda s: s)
+        self.en = np.array([sys.intern(str(s)) for s in labels], dtype=object)
+        self.index = {}
+        for i, s in enumerate(self.en):
+            self.index.setdefault(s, i)
+        self.zh = np.array([sys.intern(self._fallback(s)) for s in self.en], dtype=object)
+
+    def __len__(self):
+        return len(self.en)
+
+    def id(self, s, default=-1):
+        return self.index.get(s, default)
+
+    def translate(self, s):
+        i = self.index.get(s)
+        return self.zh[i] if i is not None else self._fallback(s)
+
+    def labels(self, ids, lang="zh"):
+        """一组编号 → 标签列表（向量化下标）"""
+        return (self.zh if lang == "zh" else self.en)[np.asarray(ids, dtype=np.int64)].tolist()
+
+def build_symbols(catalog, loc):
+    """
+    一个数据版本的符号表：notes 与词表编号一致（CSR 的列号），ingredients 与食材库行号一致，
+    row_category 为每行的品类编号（int16）。catalog 为 None 时返回空表。
+    """
+    names = catalog["names"] if catalog is not None else []
+    vocab = catalog["vocab"] if catalog is not None else []
+    cats = [str(c) for c in catalog["categories"]] if catalog is not None else []
+    categories = SymbolTable(sorted(set(cats)), lambda c: translate_category(loc, c))
+    return {
+        "notes": SymbolTable(vocab, lambda n: translate_note(loc, n)),
+        "ingredients": SymbolTable(names, lambda n: translate_ingredient(loc, n)),
+        "categories": categories,
+        "row_category": np.array([categories.index[c] for c in cats], dtype=np.int16),
+    }
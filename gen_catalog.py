@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+味觉虫洞 - 合成食材库生成器（压测用）
+
+从 flavordb_data.csv 与 localization_zh.json 学习：
+  · 品类分布（category mix）
+  · 每个品类的风味标签数量分布
+  · 风味标签共现关系
+然后按同样的 CSV 结构逐行流式写出任意规模的食材库，
+固定 seed 时输出完全一致，生成 100 万行也只占常数内存。
+
+用法：
+    python gen_catalog.py --rows 1000000 --out synth_1m.csv.gz --seed 7
+    python gen_catalog.py --rows 20000 --out synth.csv --loc-out synth_zh.json
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_COLUMNS = ["id", "name", "category", "flavor_profiles", "flavors",
+               "molecules_count", "sample_molecules"]
+
+
+def _split_fp(s):
+    if not isinstance(s, str) or not s.strip():
+        return []
+    return [x.strip().lower() for x in s.split(",") if x.strip()]
+
+
+def _split_fl(s):
+    if not isinstance(s, str) or not s.strip():
+        return []
+    return [x.strip().lower() for x in re.split(r"[@,]+", s) if x.strip()]
+
+
+def open_text(path, mode):
+    """按扩展名自动选择 gzip / 普通文本"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+# ================================================================
+# 1. 学习源数据的统计特征
+# ================================================================
+def learn_model(csv_path, loc_path):
+    df = pd.read_csv(csv_path)
+    loc = {"ingredients": {}, "flavor_notes": {}, "categories": {}}
+    if loc_path and os.path.exists(loc_path):
+        with open(loc_path, "r", encoding="utf-8") as f:
+            loc = json.load(f)
+
+    rows = []
+    for r in df.itertuples(index=False):
+        fp = _split_fp(r.flavor_profiles)
+        fl = _split_fl(r.flavors)
+        notes = sorted(set(fp) | set(fl))
+        if notes:
+            rows.append((str(r.name), str(r.category), notes, bool(fl) and not fp))
+    if not rows:
+        raise ValueError(f"{csv_path} 中没有可用的风味数据")
+
+    vocab = sorted({n for _, _, notes, _ in rows for n in notes})
+    note_id = {n: i for i, n in enumerate(vocab)}
+    cats = sorted({c for _, c, _, _ in rows})
+    cat_id = {c: i for i, c in enumerate(cats)}
+
+    # 行 × 标签 0/1 矩阵（源数据只有几百行，稠密即可）
+    X = np.zeros((len(rows), len(vocab)), dtype=np.float64)
+    row_cat = np.empty(len(rows), dtype=np.int64)
+    for i, (_, c, notes, _) in enumerate(rows):
+        X[i, [note_id[n] for n in notes]] = 1.0
+        row_cat[i] = cat_id[c]
+
+    # 共现条件概率 P(j | i) = C[i, j] / C[i, i]
+    C = X.T @ X
+    diag = np.maximum(np.diag(C), 1.0)
+    cond = C / diag[:, None]
+
+    cat_weights = np.bincount(row_cat, minlength=len(cats)).astype(np.float64)
+    cat_weights /= cat_weights.sum()
+
+    cat_note_freq, cat_sizes, cat_fl_ratio, cat_names = [], [], [], []
+    for ci, c in enumerate(cats):
+        mask = row_cat == ci
+        freq = X[mask].sum(axis=0) + 0.05        # 平滑，保证能采到长尾标签
+        cat_note_freq.append(freq / freq.sum())
+        cat_sizes.append(X[mask].sum(axis=1).astype(np.int64))
+        cat_fl_ratio.append(float(np.mean([rows[i][3] for i in np.flatnonzero(mask)])))
+        cat_names.append([rows[i][0] for i in np.flatnonzero(mask)])
+
+    return {
+        "vocab": vocab, "cats": cats, "cat_weights": cat_weights,
+        "cond": cond, "cat_note_freq": cat_note_freq, "cat_sizes": cat_sizes,
+        "cat_fl_ratio": cat_fl_ratio, "cat_names": cat_names, "loc": loc,
+        "source_rows": len(rows),
+    }
+
+
+# ================================================================
+# 2. 逐行生成
+# ================================================================
+def _sample_notes(model, rng, ci, k):
+    """种子标签按品类频率抽取，其余按共现概率扩散（Gumbel top-k 无放回采样）"""
+    freq = model["cat_note_freq"][ci]
+    n_seed = min(k, int(rng.integers(1, 4)))
+    seeds = rng.choice(len(freq), size=n_seed, replace=False, p=freq)
+    w = 0.35 * freq + 0.65 * model["cond"][seeds].mean(axis=0) + 1e-9
+    keys = np.log(w) + rng.gumbel(size=w.shape[0])
+    keys[seeds] = np.inf
+    k = min(k, w.shape[0])
+    return np.argpartition(-keys, k - 1)[:k]
+
+
+def _format_flavors(notes, rng):
+    """模拟 FlavorDB 的分子分组写法：note@note@note, note@note"""
+    groups, i = [], 0
+    while i < len(notes):
+        step = int(rng.integers(2, 9))
+        groups.append("@".join(notes[i:i + step]))
+        i += step
+    return ", ".join(groups)
+
+
+def iter_rows(model, n_rows, seed, start_id=1):
+    rng = np.random.default_rng(seed)
+    vocab = model["vocab"]
+    cats = model["cats"]
+    for rid in range(start_id, start_id + n_rows):
+        ci = int(rng.choice(len(cats), p=model["cat_weights"]))
+        k = int(max(1, rng.choice(model["cat_sizes"][ci])))
+        picked = _sample_notes(model, rng, ci, k)
+        notes = [vocab[j] for j in picked]
+        base = model["cat_names"][ci][int(rng.integers(len(model["cat_names"][ci])))]
+        name = f"{base} #{rid}"
+        if rng.random() < model["cat_fl_ratio"][ci]:
+            fp, fl = "", _format_flavors(notes, rng)
+        else:
+            fp, fl = ", ".join(notes), ""
+        yield [rid, name, cats[ci], fp, fl, "", ""], base
+
+
+def write_catalog(model, out_path, n_rows, seed, loc_out=None, report_every=100000):
+    loc = model["loc"]
+    ing_zh = loc.get("ingredients", {})
+    t0 = time.time()
+
+    loc_f = None
+    if loc_out:
+        # 流式写 JSON：先写公共词表，再逐条追加食材译名
+        loc_f = open_text(loc_out, "w")
+        loc_f.write('{\n"flavor_notes": ')
+        loc_f.write(json.dumps(loc.get("flavor_notes", {}), ensure_ascii=False))
+        loc_f.write(',\n"categories": ')
+        loc_f.write(json.dumps(loc.get("categories", {}), ensure_ascii=False))
+        loc_f.write(',\n"ingredients": {')
+
+    with open_text(out_path, "w") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_COLUMNS)
+        for i, (row, base) in enumerate(iter_rows(model, n_rows, seed)):
+            w.writerow(row)
+            if loc_f is not None:
+                zh = ing_zh.get(base, base)
+                sep = "\n" if i == 0 else ",\n"
+                loc_f.write(sep + json.dumps(row[1], ensure_ascii=False) + ": "
+                            + json.dumps(f"{zh} #{row[0]}", ensure_ascii=False))
+            if report_every and (i + 1) % report_every == 0:
+                rate = (i + 1) / max(time.time() - t0, 1e-9)
+                print(f"   · 已写出 {i + 1:,} 行（{rate:,.0f} 行/秒）", file=sys.stderr)
+
+    if loc_f is not None:
+        loc_f.write("\n}\n}\n")
+        loc_f.close()
+    return time.time() - t0
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="生成合成 FlavorDB 食材库（压测用）")
+    p.add_argument("--rows", type=int, default=10000, help="生成行数")
+    p.add_argument("--out", default="synthetic_flavordb.csv", help="输出 CSV（.gz 结尾则 gzip 压缩）")
+    p.add_argument("--seed", type=int, default=42, help="随机种子，相同 seed 输出一致")
+    p.add_argument("--source", default=os.path.join(BASE_DIR, "flavordb_data.csv"))
+    p.add_argument("--loc", default=os.path.join(BASE_DIR, "localization_zh.json"))
+    p.add_argument("--loc-out", default=None, help="同时写出对应的本地化 JSON")
+    args = p.parse_args(argv)
+
+    model = learn_model(args.source, args.loc)
+    print(f"✅ 已学习 {model['source_rows']} 种食材 · {len(model['vocab'])} 个风味标签 · "
+          f"{len(model['cats'])} 个品类")
+    elapsed = write_catalog(model, args.out, args.rows, args.seed, args.loc_out)
+    print(f"✅ 已生成 {args.rows:,} 行 → {args.out}（{elapsed:.1f}s）")
+
+
+if __name__ == "__main__":
+    main()
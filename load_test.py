@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+味觉虫洞 - 无头多会话压测工具
+
+基于 Streamlit 官方测试 API（streamlit.testing.v1.AppTest），
+在多个进程中并行模拟用户会话，每个会话按脚本化旅程操作 app.py：
+切换 Vegan、搜索、点击「经典共振搭配」、拖动配方比例滑块、向本地 stub 发送 AI 对话。
+
+输出：
+  · 每步重跑（rerun）延迟分布 p50 / p90 / p99 / max
+  · 每会话内存增量与进程峰值 RSS
+  · 给定并发下的吞吐（reruns/s、sessions/s）
+
+用法：
+    python load_test.py --sessions 40 --concurrency 4 --journey full
+    python load_test.py --sessions 8 --journey chat --stub-latency 200
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, "app.py")
+STUB_KEY = "sk-loadtest-stub-0000000000000000"
+
+# ================================================================
+# 1. 会话旅程脚本
+# ================================================================
+JOURNEYS = {
+    "browse": [
+        ("open",),
+        ("vegan", False),
+        ("search", "apple"),
+        ("search", ""),
+        ("vegan", True),
+        ("classic", "random_resonance"),
+    ],
+    "formula": [
+        ("open",),
+        ("classic", "random_resonance"),
+        ("tab", "配方台"),
+        ("sliders", 3),
+        ("tab", "实验台"),
+    ],
+    "chat": [
+        ("open",),
+        ("classic", "random_resonance"),
+        ("chat", "用这两种食材设计一道甜品"),
+        ("chat", "当前比例是最优的吗？"),
+    ],
+}
+JOURNEYS["full"] = (JOURNEYS["browse"] + JOURNEYS["formula"][1:] + JOURNEYS["chat"][2:]
+                    + [("classic", "random_contrast")])
+
+
+# ================================================================
+# 2. 本地 AI stub（OpenAI 兼容 /chat/completions）
+# ================================================================
+def _make_stub_handler(latency_s):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            if latency_s:
+                time.sleep(latency_s)
+            body = json.dumps({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()),
+                "model": "qwen-turbo",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant",
+                                         "content": "🌀 分子逻辑：**压测 stub 回复**\n- 入口→中段→尾韵"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return StubHandler
+
+
+def start_stub(latency_ms):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_stub_handler(latency_ms / 1000.0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+# ================================================================
+# 3. 单会话执行（worker 进程内）
+# ================================================================
+def _rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * (os.sysconf("SC_PAGE_SIZE") // 1024)
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _sync_multiselects(at):
+    """
+    AppTest 1.28 的 multiselect 以 format_func 之后的文本回传选项，
+    而 session_state 里存的是原始食材名，直接重跑会 ValueError。
+    这里把原始值映射回 display_name 生成的选项文本（「中文（English）」或原名）。
+    """
+    for ms in at.multiselect:
+        try:
+            raw = list(ms.value)
+        except (AssertionError, KeyError):
+            continue
+        labels = []
+        for v in raw:
+            v = str(v)
+            label = next((o for o in ms.options if o == v or o.endswith(f"（{v}）")), None)
+            if label is not None:
+                labels.append(label)
+        ms.set_value(labels)
+
+
+_LAST_PASSES = [0]
+
+
+def _wait_for_shutdown(runner, timeout=3):
+    """
+    替换 AppTest 1.28 的 require_widgets_deltas：
+    原实现每 100ms 轮询一次，且在 st.rerun() 触发的 SCRIPT_STOPPED_FOR_RERUN 就提前返回，
+    导致延迟被量化成 100ms 的整数倍、脚本内部的 rerun 还在后台线程里跑。
+    这里改为 2ms 轮询，等脚本线程真正 SHUTDOWN（含内部 rerun）后再返回。
+    """
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if ScriptRunnerEvent.SHUTDOWN in runner.events:
+            runner.join()
+            _LAST_PASSES[0] = runner.events.count(ScriptRunnerEvent.SCRIPT_STARTED)
+            return
+        time.sleep(0.002)
+    runner.request_stop()
+    runner.join()
+    raise RuntimeError(f"AppTest script run timed out after {timeout}s")
+
+
+def _patch_apptest():
+    """
+    AppTest 1.28 的两处补丁（仅作用于压测 worker 进程）：
+      · 等待脚本线程真正结束（见 _wait_for_shutdown）
+      · st.rerun() 的内部重跑前清空按钮触发值，等价于浏览器重跑时不再携带点击事件，
+        否则「点击 → st.rerun()」会在测试运行器里无限循环；
+        同时丢弃被打断那一轮的页面消息，只用最后一轮构建元素树
+    """
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.testing.v1 import local_script_runner
+
+    runner_cls = local_script_runner.LocalScriptRunner
+    if getattr(runner_cls, "_load_test_patched", False):
+        return
+    orig_finished = runner_cls._on_script_finished
+
+    def _on_script_finished(self, ctx, event, premature_stop):
+        if event == ScriptRunnerEvent.SCRIPT_STOPPED_FOR_RERUN:
+            with self._session_state._lock:
+                self._session_state._state._reset_triggers()
+            self.forward_msg_queue.clear()
+        orig_finished(self, ctx, event, premature_stop)
+
+    runner_cls._on_script_finished = _on_script_finished
+    runner_cls._load_test_patched = True
+    local_script_runner.require_widgets_deltas = _wait_for_shutdown
+
+
+def _run_until_settled(at):
+    """执行一次交互对应的重跑（含 st.rerun() 触发的后续轮次），返回脚本执行轮数"""
+    _sync_multiselects(at)
+    at.run()
+    return _LAST_PASSES[0]
+
+
+def _apply_step(at, step, rng):
+    """执行一步操作，返回本步是否触发了重跑"""
+    kind = step[0]
+    if kind == "open":
+        return True
+    if kind == "vegan":
+        at.toggle(key="vegan_toggle").set_value(step[1])
+    elif kind == "search":
+        at.text_input(key="search_box").input(step[1])
+    elif kind == "classic":
+        at.button(key=step[1]).click()
+    elif kind == "tab":
+        at.radio(key="sidebar_tab_radio").set_value(step[1])
+    elif kind == "sliders":
+        sliders = [s for s in at.slider if str(s.key or "").startswith("r_")]
+        if not sliders:
+            return False
+        for _ in range(step[1]):
+            sl = rng.choice(sliders)
+            sl.set_value(rng.randrange(0, 101, 5))
+        return True
+    elif kind == "chat":
+        boxes = [w for w in at.text_input if w.key == "chat_input"]
+        if not boxes:
+            return False
+        boxes[0].input(step[1])
+        at.button(key="send_btn").click()
+    return True
+
+
+def run_session(args):
+    session_id, journey, seed, timeout = args
+    from streamlit.testing.v1 import AppTest
+
+    _patch_apptest()
+    os.chdir(BASE_DIR)
+    # ScriptRunner 会把 sys.modules["__main__"] 换成 app.py，结束后需还原，
+    # 否则进程池反序列化下一个任务时找不到 worker 函数
+    saved_main = sys.modules.get("__main__")
+    rng = random.Random(seed)
+    rss_before = _rss_kb()
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    samples, errors = [], []
+    t_start = time.perf_counter()
+    for step in JOURNEYS[journey]:
+        # 多个滑块一次提交，模拟一次拖动后的重跑
+        if step[0] == "sliders":
+            for _ in range(step[1]):
+                if not _apply_step(at, ("sliders", 1), rng):
+                    break
+                t0 = time.perf_counter()
+                hops = _run_until_settled(at)
+                samples.append(("sliders", time.perf_counter() - t0, hops))
+            continue
+        try:
+            if not _apply_step(at, step, rng):
+                continue
+        except (KeyError, IndexError, ValueError) as e:
+            errors.append(f"{step[0]}: {e}")
+            continue
+        t0 = time.perf_counter()
+        hops = _run_until_settled(at)
+        samples.append((step[0], time.perf_counter() - t0, hops))
+        if at.exception:
+            errors.append(f"{step[0]}: {at.exception[0].value}")
+    sys.modules["__main__"] = saved_main
+    return {
+        "session": session_id,
+        "pid": os.getpid(),
+        "samples": samples,
+        "errors": errors,
+        "elapsed": time.perf_counter() - t_start,
+        "rss_delta_kb": _rss_kb() - rss_before,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _init_worker(base_url):
+    os.environ["DASHSCOPE_API_KEY"] = STUB_KEY
+    os.environ["DASHSCOPE_BASE_URL"] = base_url
+
+
+# ================================================================
+# 4. 汇总报告
+# ================================================================
+def _pct(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(q * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+def summarize(results, wall, concurrency):
+    by_step = {}
+    for r in results:
+        for kind, dt, _ in r["samples"]:
+            by_step.setdefault(kind, []).append(dt)
+    all_vals = sorted(dt for v in by_step.values() for dt in v)
+    n_runs = sum(hops for r in results for _, _, hops in r["samples"])
+    per_pid = {}
+    for r in results:
+        per_pid.setdefault(r["pid"], []).append(r)
+    return {
+        "sessions": len(results),
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "interactions": len(all_vals),
+        "reruns": n_runs,
+        "reruns_per_s": n_runs / wall if wall else 0.0,
+        "sessions_per_s": len(results) / wall if wall else 0.0,
+        "latency_ms": {
+            kind: {
+                "n": len(v),
+                "p50": _pct(sorted(v), 0.5) * 1000,
+                "p90": _pct(sorted(v), 0.9) * 1000,
+                "p99": _pct(sorted(v), 0.99) * 1000,
+                "max": max(v) * 1000,
+            }
+            for kind, v in sorted(by_step.items())
+        },
+        "overall_ms": {
+            "p50": _pct(all_vals, 0.5) * 1000,
+            "p90": _pct(all_vals, 0.9) * 1000,
+            "p99": _pct(all_vals, 0.99) * 1000,
+        },
+        "mem_per_session_kb": (sum(r["rss_delta_kb"] for r in results) / len(results)) if results else 0,
+        "peak_rss_kb_per_worker": {pid: max(x["peak_rss_kb"] for x in rs) for pid, rs in per_pid.items()},
+        "errors": [e for r in results for e in r["errors"]],
+    }
+
+
+def print_report(rep):
+    print("\n" + "=" * 60)
+    print(f"  会话 {rep['sessions']} · 并发 {rep['concurrency']} · 用时 {rep['wall_s']:.1f}s")
+    print("=" * 60)
+    print(f"吞吐：{rep['reruns_per_s']:.1f} reruns/s · {rep['sessions_per_s']:.2f} sessions/s")
+    print(f"每次交互延迟（含 st.rerun 触发的后续轮次），脚本总执行 {rep['reruns']} 轮")
+    print(f"{'步骤':<10}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for kind, s in rep["latency_ms"].items():
+        print(f"{kind:<10}{s['n']:>6}{s['p50']:>10.1f}{s['p90']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+    o = rep["overall_ms"]
+    print(f"{'全部':<10}{rep['interactions']:>6}{o['p50']:>10.1f}{o['p90']:>10.1f}{o['p99']:>10.1f}")
+    print(f"内存：每会话 RSS 增量 ≈ {rep['mem_per_session_kb'] / 1024:.1f} MB")
+    for pid, kb in rep["peak_rss_kb_per_worker"].items():
+        print(f"   · worker {pid} 峰值 RSS {kb / 1024:.1f} MB")
+    if rep["errors"]:
+        print(f"⚠️  {len(rep['errors'])} 个错误，例如：{rep['errors'][0]}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="无头多会话压测 app.py")
+    p.add_argument("--sessions", type=int, default=8, help="模拟会话总数")
+    p.add_argument("--concurrency", type=int, default=os.cpu_count() or 2, help="并行进程数")
+    p.add_argument("--journey", choices=sorted(JOURNEYS), default="full")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--stub-latency", type=float, default=50.0, help="AI stub 响应延迟（毫秒）")
+    p.add_argument("--timeout", type=float, default=60.0, help="单次重跑超时（秒）")
+    p.add_argument("--json", default=None, help="将报告写入 JSON 文件")
+    args = p.parse_args(argv)
+
+    # 以模块路径引用 worker 函数（而不是 __main__.xxx），见 run_session 中的说明
+    import load_test
+
+    server, base_url = start_stub(args.stub_latency)
+    jobs = [(i, args.journey, args.seed + i, args.timeout) for i in range(args.sessions)]
+    ctx = get_context("spawn")
+    t0 = time.perf_counter()
+    try:
+        with ctx.Pool(args.concurrency, initializer=load_test._init_worker,
+                      initargs=(base_url,)) as pool:
+            results = pool.map(load_test.run_session, jobs, chunksize=1)
+    finally:
+        server.shutdown()
+    rep = summarize(results, time.perf_counter() - t0, args.concurrency)
+    print_report(rep)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+    return 1 if rep["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
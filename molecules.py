@@ -0,0 +1,344 @@
+"""
+味觉虫洞 Flavor Lab - 分子级数据接入
+
+FlavorDB 原始导出是两张表：
+  · 食材 → 化合物   每行一条边（食材编号或名称, PubChem CID）
+  · 化合物 → 气味   每行一个化合物（CID, 名称, 以 @ 分隔的气味描述）
+这里把它们读成紧凑的列式结构，行顺序与食材库一致：
+  · 食材 × 化合物   int32 CSR（ing_ptr / comp_idx）
+  · 化合物          int64 外部编号 + 名称 + 气味描述 CSR（odor_ptr / odor_idx）
+CSV 按块流式读取（pandas chunksize，可直接读 .gz），每块只保留两列整数，
+几十万条边几秒内载入，内存只随边数线性增长（每条边 12 字节）。
+结果可存为单个 npz，应用启动时只读加载；没有原始导出时退化为食材库自带的 sample_molecules 列。
+
+分子重合度直接复用 engine.SimilarityBackend / resonance_matrix：
+它们只认 CSR，把「标签」换成「化合物」即可得到分子层面的共鸣指数与各个相似度核。
+"""
+
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from engine import SimilarityBackend, note_key
+
+MOLECULE_DIR = os.getenv("FLAVOR_LAB_MOLECULES", "")
+EDGE_FILE = "ingredient_compounds.csv"
+COMPOUND_FILE = "compounds.csv"
+CHUNK_ROWS = 200_000
+MOLECULE_FORMAT = "1"
+
+_ODOR_SPLIT = re.compile(r"[@,]+")
+
+
+def _csv_path(base, name):
+    """目录下的 name 或 name.gz"""
+    for p in (os.path.join(base, name), os.path.join(base, name + ".gz")):
+        if os.path.exists(p):
+            return p
+    return None
+
+
+def _compound_keys(values):
+    """化合物编号：纯数字按 PubChem CID 取整，其余（化合物名称等）用稳定哈希映射到 int64"""
+    num = pd.to_numeric(values, errors="coerce")
+    keys = np.zeros(len(values), dtype=np.int64)
+    ok = num.notna().to_numpy()
+    keys[ok] = num[ok].to_numpy(dtype=np.int64)
+    if not ok.all():
+        codes, uniq = pd.factorize(values[~ok].astype(str).str.strip().str.lower())
+        # 哈希值取负，不会与真实 CID 冲突
+        keys[~ok] = -np.array([note_key(u) for u in uniq], dtype=np.int64)[codes]
+    return keys
+
+
+def ingredient_lookup(names, ids=None):
+    """食材键 → 行号：名称（小写）与食材库编号都能对上"""
+    look = {str(n).strip().lower(): i for i, n in enumerate(names)}
+    if ids is not None:
+        look.update({str(x): i for i, x in enumerate(ids)})
+    return look
+
+
+# ================================================================
+# 1. 流式读取两张表
+# ================================================================
+def read_compounds(path, id_col="pubchem_id", name_col="common_name", odor_col="flavor_profile",
+                   chunksize=CHUNK_ROWS):
+    """
+    化合物表 → {"keys" int64, "names", "odor_vocab", "odor_ptr", "odor_idx"}（按读入顺序，重复编号保留首条）
+    """
+    keys, names, ptr_parts, idx_parts = [], [], [], []
+    vocab = {}
+    for chunk in pd.read_csv(path, usecols=lambda c: c in (id_col, name_col, odor_col),
+                             dtype=str, chunksize=chunksize):
+        chunk = chunk.dropna(subset=[id_col])
+        keys.append(_compound_keys(chunk[id_col]))
+        names.append(chunk[name_col].fillna("").to_numpy(dtype=str) if name_col in chunk
+                     else np.full(len(chunk), "", dtype=str))
+        odors = (chunk[odor_col] if odor_col in chunk else pd.Series("", index=chunk.index)).fillna("")
+        # 每个化合物的描述拆开成长表，去重后再按全局词表编号
+        parts = odors.str.lower().str.split(_ODOR_SPLIT)
+        pos = np.repeat(np.arange(len(chunk)), parts.str.len().to_numpy())
+        long = parts.explode().str.strip().fillna("").to_numpy()
+        keep = long != ""
+        codes, uniq = pd.factorize(long[keep])
+        idx = np.array([vocab.setdefault(u, len(vocab)) for u in uniq], dtype=np.int32)[codes]
+        counts = np.bincount(pos[keep], minlength=len(chunk))
+        ptr_parts.append(counts)
+        idx_parts.append(idx)
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+    counts = np.concatenate(ptr_parts) if ptr_parts else np.zeros(0, dtype=np.int64)
+    odor_ptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=odor_ptr[1:])
+    return {
+        "keys": keys,
+        "names": np.concatenate(names) if names else np.zeros(0, dtype=str),
+        "odor_vocab": list(vocab),
+        "odor_ptr": odor_ptr,
+        "odor_idx": np.concatenate(idx_parts) if idx_parts else np.zeros(0, dtype=np.int32),
+    }
+
+
+def read_edges(path, lookup, ingredient_col="ingredient", compound_col="pubchem_id", chunksize=CHUNK_ROWS):
+    """
+    食材 → 化合物边表 → {"rows" int32, "keys" int64, "n_edges", "n_unmatched"}
+    食材列可以是食材库编号或名称；对不上食材库的边计入 n_unmatched 后丢弃。
+    """
+    rows, keys = [], []
+    n_edges = n_unmatched = 0
+    for chunk in pd.read_csv(path, usecols=[ingredient_col, compound_col], dtype=str, chunksize=chunksize):
+        chunk = chunk.dropna()
+        n_edges += len(chunk)
+        # 先对去重后的食材键查表，再按编码展开（边表里同一食材会重复上千次）
+        codes, uniq = pd.factorize(chunk[ingredient_col].str.strip().str.lower())
+        row_of = np.array([lookup.get(u, -1) for u in uniq], dtype=np.int32)[codes]
+        ok = row_of >= 0
+        n_unmatched += int((~ok).sum())
+        rows.append(row_of[ok])
+        keys.append(_compound_keys(chunk[compound_col])[ok])
+    return {
+        "rows": np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+        "keys": np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64),
+        "n_edges": n_edges, "n_unmatched": n_unmatched,
+    }
+
+
+def read_catalog_samples(path, lookup, column="sample_molecules"):
+    """没有原始导出时，从食材库 CSV 的 sample_molecules 列（逗号分隔的化合物名称）取边"""
+    df = pd.read_csv(path, usecols=lambda c: c in ("name", column), dtype=str)
+    if column not in df:
+        return {"rows": np.zeros(0, dtype=np.int32), "keys": np.zeros(0, dtype=np.int64),
+                "n_edges": 0, "n_unmatched": 0, "names": {}}
+    df = df.dropna()
+    # 化合物名称里可能带逗号（如 2,4-Decadienal），只按「逗号 + 空格」切分
+    long = df.assign(m=df[column].str.split(r",\s+")).explode("m")
+    long["m"] = long["m"].str.strip()
+    long = long[long["m"] != ""]
+    row_of = long["name"].str.strip().str.lower().map(lookup).fillna(-1).to_numpy(dtype=np.int32)
+    keys = _compound_keys(long["m"])
+    ok = row_of >= 0
+    names = dict(zip(keys[ok].tolist(), long["m"].to_numpy()[ok].tolist()))
+    return {"rows": row_of[ok], "keys": keys[ok], "n_edges": len(long),
+            "n_unmatched": int((~ok).sum()), "names": names}
+
+
+# ================================================================
+# 2. 紧凑存储
+# ================================================================
+class MoleculeStore:
+    """
+    食材 × 化合物的列式存储，行与食材库一一对应（没有分子数据的食材是空行）。
+      ing_ptr / comp_idx        食材 → 化合物 CSR（化合物内部编号 0..n_compounds-1）
+      compound_keys             内部编号 → 外部编号（PubChem CID；名称哈希为负数）
+      compound_names            化合物名称（缺失时为 "CID xxx"）
+      odor_ptr / odor_idx       化合物 → 气味描述 CSR，描述词表为 odor_vocab
+    """
+
+    def __init__(self, names, ing_ptr, comp_idx, compound_keys, compound_names,
+                 odor_vocab, odor_ptr, odor_idx, source="", stats=None):
+        self.names = list(names)
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.ing_ptr = np.asarray(ing_ptr, dtype=np.int64)
+        self.comp_idx = np.asarray(comp_idx, dtype=np.int32)
+        self.compound_keys = np.asarray(compound_keys, dtype=np.int64)
+        self.compound_names = np.asarray(compound_names, dtype=str)
+        self.odor_vocab = list(odor_vocab)
+        self.odor_ptr = np.asarray(odor_ptr, dtype=np.int64)
+        self.odor_idx = np.asarray(odor_idx, dtype=np.int32)
+        self.n_compounds = len(self.compound_keys)
+        self.sizes = np.diff(self.ing_ptr)
+        self.source = source
+        self.stats = dict(stats or {})
+        self._backend = None
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_edges(cls, names, edges, compounds=None, source=""):
+        """
+        由 read_edges / read_catalog_samples 的边与（可选）read_compounds 的化合物表组装 CSR。
+        边里出现但化合物表没有的编号也保留（名称记为 CID，没有气味描述）。
+        """
+        t0 = time.perf_counter()
+        n = len(names)
+        ckeys = compounds["keys"] if compounds is not None else np.zeros(0, dtype=np.int64)
+        universe = np.unique(np.concatenate([ckeys, edges["keys"]]))
+        nc = len(universe)
+        comp = np.searchsorted(universe, edges["keys"]).astype(np.int64)
+        # (行, 化合物) 编码成一个 int64 去重，顺带按行、化合物排好序
+        code = np.unique(edges["rows"].astype(np.int64) * max(nc, 1) + comp)
+        rows, comp_idx = np.divmod(code, max(nc, 1))
+        ing_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=ing_ptr[1:])
+
+        comp_names = np.array([f"CID {k}" if k >= 0 else "" for k in universe.tolist()], dtype=object)
+        for k, v in edges.get("names", {}).items():
+            comp_names[np.searchsorted(universe, k)] = v
+        odor_counts = np.zeros(nc, dtype=np.int64)
+        odor_idx = np.zeros(0, dtype=np.int32)
+        vocab = []
+        if compounds is not None and len(ckeys):
+            # 化合物表里重复的编号只保留首条
+            uk, first = np.unique(ckeys, return_index=True)
+            at = np.searchsorted(universe, uk)
+            named = compounds["names"][first]
+            has = named != ""
+            comp_names[at[has]] = named[has]
+            cptr = compounds["odor_ptr"]
+            lens = cptr[first + 1] - cptr[first]
+            odor_counts[at] = lens
+            # 按新编号顺序收集各化合物的描述区间
+            order = np.argsort(at, kind="stable")
+            starts, lens = cptr[first][order], lens[order]
+            offs = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+            odor_idx = compounds["odor_idx"][np.repeat(starts, lens) + offs].astype(np.int32)
+            vocab = compounds["odor_vocab"]
+        odor_ptr = np.zeros(nc + 1, dtype=np.int64)
+        np.cumsum(odor_counts, out=odor_ptr[1:])
+
+        stats = {"n_edges": int(edges["n_edges"]), "n_unmatched": int(edges["n_unmatched"]),
+                 "build_s": round(time.perf_counter() - t0, 3)}
+        return cls(names, ing_ptr, comp_idx.astype(np.int32), universe, comp_names.astype(str),
+                   vocab, odor_ptr, odor_idx, source=source, stats=stats)
+
+    @classmethod
+    def from_dump(cls, names, edges_path, compounds_path=None, ids=None, edge_cols=None,
+                  compound_cols=None, chunksize=CHUNK_ROWS):
+        """读取 FlavorDB 风格的原始导出（CSV 或 CSV.gz）"""
+        t0 = time.perf_counter()
+        lookup = ingredient_lookup(names, ids)
+        edges = read_edges(edges_path, lookup, chunksize=chunksize, **(edge_cols or {}))
+        compounds = (read_compounds(compounds_path, chunksize=chunksize, **(compound_cols or {}))
+                     if compounds_path else None)
+        store = cls.from_edges(names, edges, compounds, source=os.path.basename(edges_path))
+        store.stats["load_s"] = round(time.perf_counter() - t0, 3)
+        return store
+
+    @classmethod
+    def from_catalog(cls, names, csv_path, ids=None):
+        """食材库自带的 sample_molecules 列（只有部分食材有，且每种最多十来个化合物）"""
+        edges = read_catalog_samples(csv_path, ingredient_lookup(names, ids))
+        return cls.from_edges(names, edges, source="sample_molecules")
+
+    # ---------- 持久化 ----------
+    def arrays(self):
+        """列式数组（可直接交给 np.savez）；食材按名称哈希保存，重新加载时不依赖行顺序"""
+        return {
+            "format": np.array(MOLECULE_FORMAT),
+            "ingredient_keys": np.array([note_key(n) for n in self.names], dtype=np.int64),
+            "ing_ptr": self.ing_ptr, "comp_idx": self.comp_idx,
+            "compound_keys": self.compound_keys, "compound_names": self.compound_names,
+            "odor_vocab": np.array(self.odor_vocab, dtype=str),
+            "odor_ptr": self.odor_ptr, "odor_idx": self.odor_idx,
+            "source": np.array(self.source),
+        }
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path, names):
+        """从 npz 加载并对齐到当前食材库的行顺序；格式不符时返回 None"""
+        with np.load(path, allow_pickle=False) as z:
+            if str(z["format"]) != MOLECULE_FORMAT:
+                return None
+            a = {k: z[k] for k in z.files}
+        saved = {k: i for i, k in enumerate(a["ingredient_keys"].tolist())}
+        src = np.array([saved.get(note_key(n), -1) for n in names], dtype=np.int64)
+        lens = np.where(src >= 0, a["ing_ptr"][src + 1] - a["ing_ptr"][np.maximum(src, 0)], 0)
+        starts = a["ing_ptr"][np.maximum(src, 0)]
+        offs = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+        comp_idx = a["comp_idx"][np.repeat(starts, lens) + offs]
+        ing_ptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(lens, out=ing_ptr[1:])
+        return cls(names, ing_ptr, comp_idx, a["compound_keys"], a["compound_names"],
+                   a["odor_vocab"].tolist(), a["odor_ptr"], a["odor_idx"], source=str(a["source"]))
+
+    # ---------- 查询 ----------
+    @property
+    def n_edges(self):
+        return len(self.comp_idx)
+
+    @property
+    def coverage(self):
+        """有分子数据的食材数"""
+        return int((self.sizes > 0).sum())
+
+    def has(self, name):
+        i = self.index.get(name)
+        return i is not None and self.sizes[i] > 0
+
+    def compounds_of(self, name):
+        i = self.index[name]
+        return self.comp_idx[self.ing_ptr[i]:self.ing_ptr[i + 1]]
+
+    def odors_of(self, c):
+        return [self.odor_vocab[j] for j in self.odor_idx[self.odor_ptr[c]:self.odor_ptr[c + 1]]]
+
+    def compound_label(self, c):
+        return self.compound_names[c] or f"CID {self.compound_keys[c]}"
+
+    def shared(self, a, b):
+        """两种食材共有的化合物（内部编号，升序）"""
+        return np.intersect1d(self.compounds_of(a), self.compounds_of(b), assume_unique=True)
+
+    def backend(self):
+        """食材 × 化合物矩阵上的打分后端：与标签模式同一套相似度核"""
+        if self._backend is None:
+            self._backend = SimilarityBackend(self.ing_ptr, self.comp_idx, self.n_compounds)
+        return self._backend
+
+    def overlap(self, a, b, kernel="resonance"):
+        """分子层面的一对比较：共享化合物与指定核下的分数"""
+        common = self.shared(a, b)
+        return {"score": self.backend().pair(self.index[a], self.index[b], kernel=kernel),
+                "shared": common, "n_a": int(self.sizes[self.index[a]]),
+                "n_b": int(self.sizes[self.index[b]])}
+
+    def nbytes(self):
+        return int(sum(v.nbytes for v in (self.ing_ptr, self.comp_idx, self.compound_keys,
+                                          self.compound_names, self.odor_ptr, self.odor_idx)))
+
+
+def open_store(names, ids=None, csv_path=None, art_path=None, mol_dir=None):
+    """
+    按优先级取分子数据：预计算的 molecules.npz → FLAVOR_LAB_MOLECULES 目录下的原始导出
+    → 食材库 CSV 的 sample_molecules 列。都没有时返回 None。
+    """
+    if art_path and os.path.exists(art_path):
+        try:
+            store = MoleculeStore.load(art_path, names)
+            if store is not None:
+                return store
+        except (OSError, ValueError, KeyError):
+            pass
+    mol_dir = MOLECULE_DIR if mol_dir is None else mol_dir
+    edges_path = _csv_path(mol_dir, EDGE_FILE) if mol_dir else None
+    if edges_path:
+        return MoleculeStore.from_dump(names, edges_path, _csv_path(mol_dir, COMPOUND_FILE), ids=ids)
+    if csv_path and os.path.exists(csv_path):
+        store = MoleculeStore.from_catalog(names, csv_path, ids=ids)
+        return store if store.n_edges else None
+    return None
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+味觉虫洞 - 离线预计算工具
+
+部署前一次性生成全部派生产物，应用启动时只需加载：
+  · catalog.npz    编译后的食材库（名称、品类、CSR 风味标签、标签稳定编号）
+  · vocab.json     风味标签词表
+  · features.npz   雷达 / 介质极性特征矩阵
+  · scores.npy     全食材两两共鸣指数矩阵（uint8，规模过大时跳过）
+  · neighbors.npz  每个食材共鸣指数最高的 Top-K 邻居
+  · bridges.npz    每个食材的 Top-K 桥接候选（按对该食材的风味覆盖率）
+  · families.npz   风味家族：Top-K 相似图上社区发现的归属、代表成员与特征标签
+  · flavor_map.npz 风味地图：全部食材的二维坐标（截断 SVD + 邻域图嵌入）
+  · molecules.npz  分子级数据：食材 → 化合物 CSR、化合物名称与气味描述（列式存储）
+  · manifest.json  版本指纹、各阶段耗时与文件大小（最后写入）
+
+两两评分按行分块，使用多进程并行；所有文件先写临时文件再原子替换。
+npz 不压缩且各成员数据段按 64 字节对齐，应用端以只读 mmap 直接映射（engine.mmap_npz），
+同机多个 Streamlit 进程共享同一份页缓存。没有跑预计算时，设置 FLAVOR_LAB_SHARED_DIR 后
+由第一个启动的应用进程按同样流程生成到该目录（engine.shared_artifacts），其余进程等它完成后直接映射。
+
+用法：
+    python precompute.py
+    python precompute.py --data synth.csv --out artifacts_synth --topk 30 --workers 8
+    python precompute.py --data synth_1m.csv.gz --chunksize 20000   # 分块流式解析，直接读 gzip
+    python precompute.py --canonical        # 标签规范化后的产物（应用需设置 FLAVOR_LAB_CANONICAL_NOTES=1）
+    python precompute.py --molecules flavordb_dump/   # 目录下放 ingredient_compounds.csv(.gz) 与 compounds.csv(.gz)
+"""
+
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from engine import (
+    ARTIFACT_DIR, ARTIFACT_MANIFEST, ENGINE_VERSION, FAMILY_TOPK, MAP_TOPK, LOC_PATH, dataset_version,
+    build_families, canonical_report, dense_rows, feature_matrices, flavor_map,
+    CATALOG_CHUNK, catalog_frame, note_key, sim_scores, stream_catalog,
+    SHARED_DIR, evict_shared, shared_artifacts,  # 共享产物目录的管理在 engine 里，这里保留旧的导入路径
+)
+from molecules import MOLECULE_DIR, open_store
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 各产物依赖的输入（写进清单；应用按数据版本的 data_key 判断整套产物是否可用）
+ARTIFACT_INPUTS = {"molecules.npz": ["engine", "data", "molecules"]}
+NPZ_ALIGN = 64
+
+
+def print_header(text):
+    print("\n" + "=" * 60)
+    print(f"  {text}")
+    print("=" * 60)
+
+
+# ================================================================
+# 1. 原子写入
+# ================================================================
+def atomic_write_bytes(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(data)
+
+
+def aligned_npz_bytes(arrays):
+    """
+    与 np.savez 兼容的未压缩 npz；每个成员的数据段按 NPZ_ALIGN 字节对齐
+    （在本地文件头扩展字段里补齐），mmap 映射出的数组对齐，数值运算不必先拷贝
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, arr in arrays.items():
+            body = io.BytesIO()
+            np.save(body, np.asanyarray(arr), allow_pickle=False)
+            info = zipfile.ZipInfo(f"{name}.npy", date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED
+            # .npy 头本身补齐到 64 字节，所以只需让 .npy 起点对齐
+            start = buf.tell() + 30 + len(info.filename.encode("utf-8")) + 4
+            pad = -start % NPZ_ALIGN
+            info.extra = struct.pack("<HH", 0xA11E, pad) + b"\0" * pad
+            zf.writestr(info, body.getvalue())
+    return buf.getvalue()
+
+
+def atomic_save_npz(path, **arrays):
+    return atomic_write_bytes(path, aligned_npz_bytes(arrays))
+
+
+def atomic_save_npy(path, arr):
+    buf = io.BytesIO()
+    np.save(buf, arr)
+    return atomic_write_bytes(path, buf.getvalue())
+
+
+def atomic_save_json(path, obj):
+    return atomic_write_bytes(path, json.dumps(obj, ensure_ascii=False, indent=1).encode("utf-8"))
+
+
+# ================================================================
+# 2. 两两评分（worker 进程）
+# ================================================================
+_W = {}
+
+
+def _init_pair_worker(indptr, indices, n_notes, topk, keep_dense):
+    _W["X"] = dense_rows(indptr, indices, n_notes)
+    _W["sizes"] = np.diff(indptr).astype(np.float64)
+    _W["topk"] = topk
+    _W["keep_dense"] = keep_dense
+
+
+def _topk_rows(values, k, tie_key=None):
+    """逐行取最大的 k 个（相同分数按下标从小到大），返回 (下标, 值)"""
+    k = min(k, values.shape[1])
+    if k <= 0:
+        return (np.zeros((values.shape[0], 0), dtype=np.int32),
+                np.zeros((values.shape[0], 0), dtype=values.dtype))
+    key = values.astype(np.float64) if tie_key is None else tie_key
+    part = np.argpartition(-key, k - 1, axis=1)[:, :k]
+    part_key = np.take_along_axis(key, part, axis=1)
+    order = np.lexsort((part, -part_key), axis=1)
+    idx = np.take_along_axis(part, order, axis=1)
+    return idx.astype(np.int32), np.take_along_axis(values, idx, axis=1)
+
+
+def _pair_block(bounds):
+    start, stop = bounds
+    X, sizes, k = _W["X"], _W["sizes"], _W["topk"]
+    n = X.shape[0]
+    inter = X[start:stop] @ X.T
+    na = sizes[start:stop, None]
+    scores = sim_scores(inter, na, sizes[None, :])
+    rows = np.arange(stop - start)
+    cols = np.arange(start, stop)
+
+    # 共鸣邻居：排除自身；同分按下标升序
+    nb_key = scores.astype(np.float64) * (n + 1) - np.arange(n)[None, :]
+    nb_key[rows, cols] = -np.inf
+    nb_idx, nb_sc = _topk_rows(scores, k, nb_key)
+
+    # 桥接候选：对本食材的风味覆盖率 |a∩c| / |a|
+    cov = (inter / np.maximum(na, 1)).astype(np.float32)
+    br_key = cov.astype(np.float64) - np.arange(n)[None, :] * 1e-12
+    br_key[rows, cols] = -np.inf
+    br_idx, br_cov = _topk_rows(cov, k, br_key)
+
+    return start, (scores if _W["keep_dense"] else None), nb_idx, nb_sc, br_idx, br_cov
+
+
+def compute_pairs(indptr, indices, n_notes, topk, workers, block, keep_dense):
+    n = len(indptr) - 1
+    bounds = [(s, min(s + block, n)) for s in range(0, n, block)]
+    dense = np.zeros((n, n), dtype=np.uint8) if keep_dense else None
+    nb_idx = np.zeros((n, min(topk, n)), dtype=np.int32)
+    nb_sc = np.zeros((n, min(topk, n)), dtype=np.uint8)
+    br_idx = np.zeros((n, min(topk, n)), dtype=np.int32)
+    br_cov = np.zeros((n, min(topk, n)), dtype=np.float32)
+
+    def _collect(result):
+        start, sc, ni, ns, bi, bc = result
+        stop = start + ni.shape[0]
+        if dense is not None:
+            dense[start:stop] = sc
+        nb_idx[start:stop], nb_sc[start:stop] = ni, ns
+        br_idx[start:stop], br_cov[start:stop] = bi, bc
+
+    initargs = (indptr, indices, n_notes, topk, keep_dense)
+    if workers <= 1:
+        _init_pair_worker(*initargs)
+        for b in bounds:
+            _collect(_pair_block(b))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_pair_worker, initargs=initargs) as ex:
+            for result in ex.map(_pair_block, bounds):
+                _collect(result)
+    return dense, nb_idx, nb_sc, br_idx, br_cov
+
+
+# ================================================================
+# 3. 主流程
+# ================================================================
+def ingest_reporter(every=100000):
+    """流式解析的进度回调：每读过 every 行打印一次速率"""
+    state = {"next": every}
+
+    def report(stats):
+        if stats["rows_read"] >= state["next"]:
+            state["next"] = (stats["rows_read"] // every + 1) * every
+            print(f"   · 已解析 {stats['rows_read']:,} 行（{stats['rows_per_s']:,} 行/秒）", file=sys.stderr)
+    return report
+
+
+def build_all(data_path, out_dir, topk=20, workers=None, block=256, max_dense=20000,
+              families="louvain", flavor_map_method="umap", canonical=False, molecules=MOLECULE_DIR,
+              chunksize=CATALOG_CHUNK, loc_path=LOC_PATH):
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    stages, files = {}, {}
+
+    t = time.perf_counter()
+    # 分块流式解析：直接得到词表与 CSR，峰值内存只与分块大小有关
+    cat = stream_catalog(data_path, chunksize, canonical, progress=ingest_reporter())
+    if cat is None:
+        raise FileNotFoundError(data_path)
+    vocab, indptr, indices = cat["vocab"], cat["indptr"], cat["indices"]
+    df = catalog_frame(cat["ids"], cat["names"], cat["categories"], vocab, indptr, indices, canonical)
+    version = dataset_version(data_path, loc_path, canonical)
+    stages["parse"] = time.perf_counter() - t
+
+    canon = None
+    if canonical:
+        t = time.perf_counter()
+        raw = stream_catalog(data_path, chunksize, canonical=False)
+        raw_sets = catalog_frame(raw["ids"], raw["names"], raw["categories"], raw["vocab"],
+                                 raw["indptr"], raw["indices"], canonical=False)["mol_set"]
+        canon = canonical_report(raw_sets, df["mol_set"])
+        if canon["feature_regressions"]:
+            raise ValueError("规范化后这些特征的命中食材数少于原始标签："
+                             + "、".join(canon["feature_regressions"]) + "（雷达 / 极性关键词表未按规范名重建？）")
+        canon["merges"] = canon["merges"][:20]
+        stages["canonical_report"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    files["vocab.json"] = atomic_save_json(os.path.join(out_dir, "vocab.json"), vocab)
+    files["catalog.npz"] = atomic_save_npz(
+        os.path.join(out_dir, "catalog.npz"),
+        ids=df["id"].to_numpy(dtype=np.int64),
+        names=np.asarray(df["name"].tolist(), dtype=str),
+        categories=np.asarray(df["category"].astype(str).tolist(), dtype=str),
+        indptr=indptr, indices=indices,
+        note_keys=np.asarray([note_key(v) for v in vocab], dtype=np.int64))
+    stages["vocab_catalog"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    feats = feature_matrices(df)
+    files["features.npz"] = atomic_save_npz(
+        os.path.join(out_dir, "features.npz"),
+        dims=np.asarray(feats["dims"], dtype=str), radar=feats["radar"], polarity=feats["polarity"])
+    stages["features"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    n = len(df)
+    keep_dense = n <= max_dense
+    dense, nb_idx, nb_sc, br_idx, br_cov = compute_pairs(
+        indptr, indices, len(vocab), topk, workers, block, keep_dense)
+    stages["pairs"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    scores_path = os.path.join(out_dir, "scores.npy")
+    if dense is not None:
+        files["scores.npy"] = atomic_save_npy(scores_path, dense)
+    elif os.path.exists(scores_path):
+        os.remove(scores_path)
+    files["neighbors.npz"] = atomic_save_npz(os.path.join(out_dir, "neighbors.npz"),
+                                             idx=nb_idx, score=nb_sc)
+    files["bridges.npz"] = atomic_save_npz(os.path.join(out_dir, "bridges.npz"),
+                                           idx=br_idx, coverage=br_cov)
+    stages["write"] = time.perf_counter() - t
+
+    fam_path = os.path.join(out_dir, "families.npz")
+    if families != "none":
+        t = time.perf_counter()
+        nb_for_graph = nb_idx if nb_idx.shape[1] >= FAMILY_TOPK else None
+        fam = build_families(indptr, indices, len(vocab), nb_idx=nb_for_graph, method=families)
+        files["families.npz"] = atomic_save_npz(fam_path, **fam)
+        stages["families"] = time.perf_counter() - t
+    elif os.path.exists(fam_path):
+        os.remove(fam_path)
+
+    map_path = os.path.join(out_dir, "flavor_map.npz")
+    if flavor_map_method != "none":
+        t = time.perf_counter()
+        nb_for_map = nb_idx if nb_idx.shape[1] >= MAP_TOPK else None
+        fmap = flavor_map(indptr, indices, len(vocab), nb_idx=nb_for_map, method=flavor_map_method)
+        files["flavor_map.npz"] = atomic_save_npz(map_path, **fmap)
+        stages["flavor_map"] = time.perf_counter() - t
+    elif os.path.exists(map_path):
+        os.remove(map_path)
+
+    mol_path = os.path.join(out_dir, "molecules.npz")
+    mol = None
+    if molecules != "none":
+        t = time.perf_counter()
+        # 目录为空时退化为食材库 CSV 自带的 sample_molecules 列
+        store = open_store(df["name"].tolist(), ids=df["id"].tolist(), csv_path=data_path, mol_dir=molecules)
+        if store is not None:
+            files["molecules.npz"] = atomic_save_npz(mol_path, **store.arrays())
+            mol = {"source": store.source, "n_edges": store.n_edges, "n_compounds": store.n_compounds,
+                   "n_odors": len(store.odor_vocab), "coverage": store.coverage,
+                   "unmatched_edges": store.stats.get("n_unmatched", 0)}
+        stages["molecules"] = time.perf_counter() - t
+    if mol is None and os.path.exists(mol_path):
+        os.remove(mol_path)
+
+    manifest = {
+        "engine_version": ENGINE_VERSION,
+        "data_path": os.path.basename(data_path),
+        "data_hash": version.data_hash,
+        "fingerprint": version.data_key,
+        # 生成时的完整数据版本（本地化指纹仅作记录，产物本身与译名无关）
+        "version": version.as_dict(),
+        "canonical": canon,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "n_ingredients": n,
+        "n_notes": len(vocab),
+        "ingest": cat["stats"],
+        "topk": int(nb_idx.shape[1]),
+        "dense_scores": dense is not None,
+        "workers": workers,
+        "families": families,
+        "flavor_map": flavor_map_method,
+        "molecules": mol,
+        "stages_s": {k: round(v, 4) for k, v in stages.items()},
+        "files": files,
+        "artifacts": {name: {"version": version.data_key, "bytes": size,
+                             "inputs": ARTIFACT_INPUTS.get(name, ["engine", "data"])}
+                      for name, size in files.items()},
+    }
+    # 清单最后写入：只有全部产物就绪后，应用才会认为这一版可用
+    atomic_save_json(os.path.join(out_dir, ARTIFACT_MANIFEST), manifest)
+    return manifest
+
+
+def print_report(manifest):
+    print_header(f"预计算完成 · {manifest['n_ingredients']} 种食材 · {manifest['n_notes']} 个标签")
+    print(f"指纹：{manifest['fingerprint']}  ·  进程数 {manifest['workers']}")
+    ing = manifest.get("ingest")
+    if ing:
+        print(f"解析：{ing['rows_read']:,} 行，丢弃 {ing['rows_dropped']:,} 行无风味数据，"
+              f"{ing['nnz']:,} 个标签关联 · {ing['rows_per_s']:,} 行/秒")
+    print("\n阶段耗时：")
+    for k, v in manifest["stages_s"].items():
+        print(f"   · {k:<14}{v * 1000:>10.1f} ms")
+    print("\n产物大小：")
+    for k, v in manifest["files"].items():
+        print(f"   · {k:<14}{v / 1024:>10.1f} KB")
+    if manifest["families"] != "none":
+        print(f"\n风味家族：{manifest['families']}")
+    if manifest["flavor_map"] != "none":
+        print(f"风味地图：{manifest['flavor_map']}")
+    mol = manifest.get("molecules")
+    if mol:
+        print(f"分子数据：{mol['source']} · {mol['n_edges']:,} 条食材-化合物边 · {mol['n_compounds']:,} 个化合物 · "
+              f"{mol['n_odors']} 个气味描述 · 覆盖 {mol['coverage']} 种食材"
+              + (f"（{mol['unmatched_edges']:,} 条边对不上食材库）" if mol["unmatched_edges"] else ""))
+    canon = manifest.get("canonical")
+    if canon:
+        print(f"\n标签规范化：词表 {canon['vocab_before']} → {canon['vocab_after']}，"
+              f"平均每种食材 {canon['mean_size_before']:.1f} → {canon['mean_size_after']:.1f} 个标签")
+        print(f"   · 共鸣指数平均变化 {canon['mean_score_delta']:+.2f}，"
+              f"{canon['changed_pairs'] * 100:.1f}% 的组合分数改变，"
+              f"{canon['changed_type'] * 100:.1f}% 的组合类型改变（{canon['pairs']:,} 对）")
+        print("   · 特征命中食材数 " + "，".join(f"{k} {canon['feature_hits_before'][k]} → {v}"
+                                           for k, v in canon["feature_hits_after"].items()))
+        for c, variants in canon["merges"][:8]:
+            print(f"   · {c:<16}← {', '.join(v for v in variants if v != c)}")
+    if not manifest["dense_scores"]:
+        print("\n⚠️  食材数超过 --max-dense，已跳过全量两两矩阵，仅保留 Top-K 列表")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="离线预计算派生产物（部署前运行）")
+    p.add_argument("--data", default=os.path.join(BASE_DIR, "flavordb_data.csv"))
+    p.add_argument("--loc", default=LOC_PATH, help="本地化词表（只记录其指纹，不影响产物内容）")
+    p.add_argument("--out", default=ARTIFACT_DIR, help="产物目录")
+    p.add_argument("--topk", type=int, default=20, help="每个食材保留的邻居 / 桥接候选数")
+    p.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    p.add_argument("--block", type=int, default=256, help="每个任务处理的行数")
+    p.add_argument("--max-dense", type=int, default=20000, help="超过该食材数时不保存全量两两矩阵")
+    p.add_argument("--families", choices=["louvain", "lpa", "none"], default="louvain",
+                   help="风味家族的社区发现算法（lpa 更快，louvain 模块度更高）")
+    p.add_argument("--map", choices=["umap", "mds", "none"], default="umap",
+                   help="风味地图的二维嵌入方式（mds 更快，umap 更好地保留近邻结构）")
+    p.add_argument("--canonical", action="store_true",
+                   help="解析时做标签规范化（词形 / 同义词合并），并输出前后对比报告")
+    p.add_argument("--molecules", default=MOLECULE_DIR,
+                   help="FlavorDB 分子导出目录；留空则使用食材库的 sample_molecules 列，none 跳过")
+    p.add_argument("--chunksize", type=int, default=CATALOG_CHUNK, help="流式解析时每块读取的行数")
+    args = p.parse_args(argv)
+
+    try:
+        manifest = build_all(args.data, args.out, args.topk, args.workers, args.block, args.max_dense,
+                             args.families, args.map, args.canonical, args.molecules, args.chunksize,
+                             args.loc)
+    except FileNotFoundError as e:
+        print(f"❌ 找不到数据文件: {e}")
+        return 1
+    print_report(manifest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())